@@ -0,0 +1,91 @@
+"""
+Streamlit script that run_benchmarks.py runs through AppTest. It wraps the
+app so that each run can either time the app's own session functions or
+time a full rerun of the app, and leaves the timings in the session state.
+
+    st.session_state["bench"] = {"mode": "core", "data": b"[...]", "repeat": 5}
+    st.session_state["bench"] = {"mode": "rerun", "trace_memory": False}
+"""
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import streamlit as st
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "streamlit_app"))
+
+import streamlit_app as app  # noqa: E402
+
+
+def timed(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def run_core(bench):
+    data = bench["data"]
+    repeat = bench["repeat"]
+    app.init_session_state()
+    documents = app.shared_documents()
+
+    def load_file():
+        # What loading an upload does past the uploader: hash the bytes, then
+        # check the document out of the shared cache, parsing it on a miss
+        app.load_shared_document(
+            app.content_hash(data), lambda: app.parse_definition_file(io.BytesIO(data))
+        )
+
+    def load_file_cold():
+        documents.clear()
+        load_file()
+
+    def build_cold():
+        st.session_state["build_cache"] = app.new_build_cache()
+        app.mark_all_dirty()
+        app.build_final_json()
+
+    results = {
+        "parse_definition_file": timed(lambda: app.parse_definition_file(io.BytesIO(data)), repeat),
+        "load_file_cold": timed(load_file_cold, repeat),
+        "load_file_shared": timed(load_file, repeat),
+        "build_final_json_cold": timed(build_cold, repeat),
+        "build_final_json_warm": timed(app.build_final_json, repeat),
+        "export_json_dumps": timed(lambda: json.dumps(app.build_final_json(), indent=4), repeat),
+        "export_streamed": timed(app.build_final_json_text, repeat),
+    }
+
+    # Memory is traced in a separate pass: tracemalloc slows everything down
+    tracemalloc.start()
+    load_file_cold()
+    build_cold()
+    json.dumps(app.build_final_json(), indent=4)
+    results["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return results
+
+
+def run_rerun(bench):
+    if bench.get("trace_memory"):
+        tracemalloc.start()
+    start = time.perf_counter()
+    app.main()
+    elapsed = time.perf_counter() - start
+    result = {"seconds": elapsed}
+    if bench.get("trace_memory"):
+        result["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+
+bench = st.session_state["bench"]
+if bench["mode"] == "core":
+    st.session_state["bench_result"] = run_core(bench)
+else:
+    st.session_state["bench_result"] = run_rerun(bench)
@@ -0,0 +1,135 @@
+"""
+Cold-start check of the editor: the time from a fresh Python process to the
+first render of the editor page, phase by phase (see streamlit_app/startup.py).
+
+    python benchmarks/cold_start.py [--runs 5] [--budget SECONDS] [--output FILE]
+
+Each run starts a new interpreter that renders the app once, headless,
+through Streamlit's AppTest harness, and reads the app's startup profile.
+The process is fresh, so everything before the script's first line (the
+interpreter, Streamlit and the harness starting up) is added as "runtime
+start". The median of every phase is reported and written as JSON (by
+default to benchmarks/results/cold_start-<commit>.json). With --budget the
+command exits with status 1 when the median time to first render is over it.
+
+This measures a CPython process on the host. In the desktop build the
+Pyodide boot and package loading come on top; they show up as "runtime
+start" in the app's own profile (sidebar, Profiling).
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+APP = HERE.parent / "streamlit_app" / "streamlit_app.py"
+PROFILE_PREFIX = "startup profile:"
+RUN_TIMEOUT = 300
+
+CHILD = f"""
+import json
+import os
+import time
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file({str(APP)!r}, default_timeout={RUN_TIMEOUT})
+at.run()
+if at.exception:
+    raise SystemExit(at.exception[0].message)
+
+import startup  # the app's, already imported by the run
+profile = startup.PROFILE
+with open("/proc/self/stat") as f:
+    # Field 22, the start time in clock ticks since boot; the command name
+    # before it is in parentheses and may contain spaces
+    start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+with open("/proc/uptime") as f:
+    age = float(f.read().split()[0]) - start_ticks / os.sysconf("SC_CLK_TCK")
+runtime_start = age - (time.perf_counter() - profile.started)
+report = profile.report()
+report["time to first render"] += runtime_start
+print({PROFILE_PREFIX!r}, json.dumps({{"runtime start": runtime_start, **report}}), flush=True)
+"""
+
+
+def cold_start():
+    """The startup profile of one fresh process."""
+    env = dict(os.environ)
+    # A plain first session: nothing to index, and only the profile above printed
+    env.pop("MODALITY_LIBRARY_DIR", None)
+    env.pop("MODALITY_PROFILE_STARTUP", None)
+    result = subprocess.run(
+        [sys.executable, "-c", CHILD], env=env, capture_output=True, text=True,
+        timeout=RUN_TIMEOUT,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip() or result.stdout.strip())
+    for line in result.stdout.splitlines():
+        if line.startswith(PROFILE_PREFIX):
+            return json.loads(line[len(PROFILE_PREFIX):])
+    raise RuntimeError("the app printed no startup profile")
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True,
+            text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the editor's cold start.")
+    parser.add_argument("--runs", type=int, default=5, help="fresh processes to start")
+    parser.add_argument("--budget", type=float,
+                        help="fail if the median time to first render exceeds this many seconds")
+    parser.add_argument("--output", help="result file (default: benchmarks/results/cold_start-<commit>.json)")
+    args = parser.parse_args(argv)
+
+    profiles = []
+    for i in range(args.runs):
+        profiles.append(cold_start())
+        print(f"run {i + 1}: {profiles[-1].get('time to first render', 0.0):.3f} s", flush=True)
+
+    phases = list(dict.fromkeys(phase for profile in profiles for phase in profile))
+    medians = {
+        phase: statistics.median(profile[phase] for profile in profiles if phase in profile)
+        for phase in phases
+    }
+    print()
+    for phase, seconds in medians.items():
+        print(f"  {phase:25} {seconds:>8.3f} s")
+
+    import streamlit
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "streamlit": streamlit.__version__,
+        "platform": platform.platform(),
+        "runs": profiles,
+        "median_s": medians,
+    }
+    output = (
+        Path(args.output) if args.output
+        else HERE / "results" / f"cold_start-{results['commit'] or 'latest'}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+    print(f"\nResults written to {output}")
+
+    first_render = medians.get("time to first render")
+    if args.budget is not None and first_render is not None and first_render > args.budget:
+        print(f"Time to first render {first_render:.3f} s is over the budget of {args.budget:.3f} s")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
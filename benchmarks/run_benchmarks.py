@@ -0,0 +1,197 @@
+"""
+Benchmarks of the editor on synthetic definitions of growing size.
+
+    python benchmarks/run_benchmarks.py [--sizes small,medium,large] [--repeat 5]
+                                        [--output FILE] [--compare OLD.json]
+
+For each size this times, through Streamlit's AppTest harness:
+
+* parse_definition_file on the definition's bytes, loading them into the
+  session (hash and shared-cache checkout) on a cache miss and on a hit,
+  build_final_json (cold and warm), and the JSON export, both
+  json.dumps(indent=4) and the streamed export,
+* full reruns of the editor page and of the review page, as time spent in
+  the script (the harness's own polling is left out) and wall time,
+
+and records the peak traced memory of each and the widgets on each page.
+Results are written as JSON (by default to benchmarks/results/<commit>.json)
+so two commits can be compared with --compare.
+"""
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE))
+sys.path.insert(0, str(HERE.parent / "streamlit_app"))
+
+from streamlit.testing.v1 import AppTest  # noqa: E402
+from streamlit.testing.v1.element_tree import Widget  # noqa: E402
+
+from modality_definition import iter_json_array_items, parse_document  # noqa: E402
+from synthetic import make_definition  # noqa: E402
+
+BENCH_APP = str(HERE / "bench_app.py")
+# raw-text headings, tables, rows per table, columns per table
+SIZES = {
+    "small": dict(raw_headings=10, tables=3, rows=5, cols=4),
+    "medium": dict(raw_headings=50, tables=20, rows=20, cols=5),
+    "large": dict(raw_headings=200, tables=50, rows=100, cols=6),
+}
+APP_TIMEOUT = 600
+
+
+def summarize(times):
+    return {
+        "median_s": statistics.median(times),
+        "min_s": min(times),
+        "runs": len(times),
+    }
+
+
+def count_widgets(at):
+    """Widgets of the last run by type; grid editors show up as "dataframe"."""
+    counts = Counter()
+    for node in list(at.main) + list(at.sidebar):
+        if isinstance(node, Widget):
+            counts[node.type] += 1
+        elif getattr(node, "type", None) == "dataframe":
+            counts["data_editor"] += 1
+    return dict(counts, total=sum(counts.values()))
+
+
+def bench_core(data, repeat):
+    at = AppTest.from_file(BENCH_APP, default_timeout=APP_TIMEOUT)
+    at.session_state["bench"] = {"mode": "core", "data": data, "repeat": repeat}
+    at.run()
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+    result = at.session_state["bench_result"]
+    metrics = {name: summarize(times) for name, times in result.items() if name != "peak_memory_bytes"}
+    metrics["peak_memory_bytes"] = result["peak_memory_bytes"]
+    return metrics
+
+
+def bench_page(data, review, repeat):
+    at = AppTest.from_file(BENCH_APP, default_timeout=APP_TIMEOUT)
+    at.session_state["document"] = parse_document(iter_json_array_items(io.BytesIO(data)))
+    at.session_state["show_review_page"] = review
+
+    def run(trace_memory=False):
+        at.session_state["bench"] = {"mode": "rerun", "trace_memory": trace_memory}
+        start = time.perf_counter()
+        at.run()
+        wall = time.perf_counter() - start
+        if at.exception:
+            raise RuntimeError(at.exception[0].message)
+        return at.session_state["bench_result"], wall
+
+    first, first_wall = run()
+    script_times, wall_times = [], []
+    for _ in range(repeat):
+        result, wall = run()
+        script_times.append(result["seconds"])
+        wall_times.append(wall)
+    memory, _ = run(trace_memory=True)
+    return {
+        "first_run_s": first["seconds"],
+        "rerun_script": summarize(script_times),
+        "rerun_wall": summarize(wall_times),
+        "peak_memory_bytes": memory["peak_memory_bytes"],
+        "widgets": count_widgets(at),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True,
+            text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(metrics, prefix=""):
+    """{"a": {"b": 1}} -> {"a.b": 1}, for comparing two result files."""
+    flat = {}
+    for key, value in metrics.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def compare(old, new):
+    """Prints the change of every median time, peak memory and widget total."""
+    old_cases = {case["name"]: flatten(case["metrics"]) for case in old["cases"]}
+    for case in new["cases"]:
+        before = old_cases.get(case["name"])
+        if before is None:
+            continue
+        print(f"\n{case['name']} ({old.get('commit')} -> {new.get('commit')})")
+        for key, value in flatten(case["metrics"]).items():
+            if not key.endswith(("median_s", "peak_memory_bytes", "widgets.total", "first_run_s")):
+                continue
+            if before.get(key):
+                change = (value - before[key]) / before[key] * 100
+                print(f"  {key:45} {before[key]:>14.4f} -> {value:>14.4f}  {change:+7.1f}%")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the modality editor on synthetic definitions.")
+    parser.add_argument("--sizes", default="small,medium,large",
+                        help=f"comma-separated subset of {', '.join(SIZES)}")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per measurement")
+    parser.add_argument("--output", help="result file (default: benchmarks/results/<commit>.json)")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    args = parser.parse_args(argv)
+
+    # Benchmark a plain session: no library to index
+    os.environ.pop("MODALITY_LIBRARY_DIR", None)
+
+    import streamlit
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "streamlit": streamlit.__version__,
+        "platform": platform.platform(),
+        "cases": [],
+    }
+    for name in args.sizes.split(","):
+        params = SIZES[name]
+        data = json.dumps(make_definition(**params), indent=4).encode()
+        print(f"{name}: {params}", flush=True)
+        metrics = {
+            "core": bench_core(data, args.repeat),
+            "editor_page": bench_page(data, review=False, repeat=args.repeat),
+            "review_page": bench_page(data, review=True, repeat=args.repeat),
+        }
+        results["cases"].append({"name": name, "params": params, "metrics": metrics})
+        for key, value in flatten(metrics).items():
+            if key.endswith(("median_s", "peak_memory_bytes", "widgets.total")):
+                print(f"  {key:45} {value:>14.4f}")
+
+    output = Path(args.output) if args.output else HERE / "results" / f"{results['commit'] or 'latest'}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        compare(json.loads(Path(args.compare).read_text()), results)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,55 @@
+"""
+Synthetic modality definitions for the benchmarks, in the JSON file format
+(a list of entries, as written by the editor).
+"""
+import random
+
+WORDS = (
+    "scan image signal contrast dose slice voxel tissue sequence protocol "
+    "acquisition resolution field gradient echo pulse frequency phase noise "
+    "artifact calibration detector energy filter kernel window reconstruction"
+).split()
+
+
+def _text(rnd, words):
+    return " ".join(rnd.choice(WORDS) for _ in range(words))
+
+
+def make_definition(raw_headings=20, tables=5, rows=10, cols=4, seed=0):
+    """
+    A definition with 'raw_headings' markdown headings and 'tables' tables
+    of 'rows' data rows by 'cols' columns (plus the header row).
+    """
+    rnd = random.Random(seed)
+    entries = [
+        {"level": "meta-data-id", "title": "id", "content-type": "rawtext", "content": f"synthetic{seed}"},
+        {"level": "meta-data-parents", "title": "parents", "content-type": "list_of_strings", "content": ["synthetic"]},
+        {"level": "meta-data-title", "title": "title", "content-type": "rawtext", "content": _text(rnd, 4)},
+        {"level": "meta-data-acronyms", "title": "acronyms", "content-type": "list_of_strings", "content": ["SYN"]},
+        {"level": "meta-data-shortDescription", "title": "shortDescription", "content-type": "rawtext", "content": _text(rnd, 30)},
+    ]
+    for i in range(raw_headings):
+        entries.append({
+            "level": f"{i // 5 + 1}.{i % 5 + 1}",
+            "title": _text(rnd, 3),
+            "content-type": "markdown",
+            "content": "\n\n".join(_text(rnd, 40) for _ in range(3)),
+        })
+    for t in range(tables):
+        content = [[f"Column {c + 1}" for c in range(cols)]]
+        content += [[_text(rnd, 2) for _ in range(cols)] for _ in range(rows)]
+        entries.append({
+            "level": str(raw_headings // 5 + 2 + t),
+            "title": _text(rnd, 3),
+            "content-type": "table",
+            "content": content,
+        })
+    for name in ("prepared_by", "confirmed_by", "date_of_preparation",
+                 "planned_next_review", "requires_completion"):
+        entries.append({
+            "level": f"prepration-meta-data-{name}",
+            "title": name,
+            "content-type": "rawtext",
+            "content": "2024-01-01" if name == "date_of_preparation" else _text(rnd, 2),
+        })
+    return entries
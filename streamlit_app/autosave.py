@@ -0,0 +1,194 @@
+"""
+Crash-safe autosave for the editor.
+
+The journal is an append-only JSON-lines file. Each flush appends only the
+sections whose build-cache entry changed since the previous flush:
+
+    {"op": "put", "key": "table:7", "entries": [...]}   section (re)written
+    {"op": "del", "key": "raw:3"}                        section removed
+    {"op": "order", "keys": ["raw:1", "table:7", ...]}   editor order of headings
+
+Replaying the records in order gives back the document. Once enough records
+pile up the file is compacted: rewritten from scratch with one "put" per live
+section, then swapped in atomically.
+
+The journal is for a single user: the desktop build, where the app has
+exactly one session.
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+
+from modality_definition import document_from_json
+
+# Seconds between two journal writes; edits in between are coalesced
+AUTOSAVE_INTERVAL = 2.0
+# Records appended before the journal is rewritten from scratch
+COMPACT_AFTER_RECORDS = 500
+JOURNAL_FILE_NAME = "autosave.jsonl"
+
+
+def default_autosave_dir():
+    """
+    Where the journal lives: the directory the desktop build mounts from the
+    user's app-data folder (see "nodefsMountpoints" in package.json), or None
+    elsewhere. The journal holds one document, so it is only used where there
+    is only one session: a Streamlit server shares its directories between
+    all the sessions it serves.
+    """
+    if sys.platform == "emscripten" and os.path.isdir("/mnt"):
+        return "/mnt/autosave"
+    return None
+
+
+def _key_to_str(key):
+    return key if isinstance(key, str) else f"{key[0]}:{key[1]}"
+
+
+class AutosaveJournal:
+    def __init__(self, path, interval=AUTOSAVE_INTERVAL, compact_after=COMPACT_AFTER_RECORDS):
+        self.path = path
+        self.interval = interval
+        self.compact_after = compact_after
+        self.saved = {}      # section key -> build-cache section last written
+        self.order = None    # heading keys as last written
+        self.records = 0     # records in the file since it was last compacted
+        self.last_flush = None
+        # Until the first flush the file may describe another document
+        self.needs_compaction = True
+        self.last_saved_at = None
+
+    def load(self):
+        """
+        Replays the journal and returns the Document it describes, or None if
+        there is nothing to restore. A torn last line (the app died mid-write)
+        is ignored.
+        """
+        sections = {}
+        order = []
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break
+                    op = record.get("op")
+                    if op == "put":
+                        sections[record["key"]] = record["entries"]
+                    elif op == "del":
+                        sections.pop(record["key"], None)
+                    elif op == "order":
+                        order = record["keys"]
+        except FileNotFoundError:
+            return None
+        if not sections:
+            return None
+        items = list(sections.get("meta", []))
+        for key in order:
+            items.extend(sections.get(key, []))
+        items.extend(sections.get("prep", []))
+        return document_from_json(items)
+
+    def _changed(self, key, section):
+        saved = self.saved.get(key)
+        if saved is section:
+            return False
+        # A structural change rebuilds every cache section; compare the text
+        return saved is None or saved["fragments"] != section["fragments"]
+
+    def flush(self, cache, force=False):
+        """
+        Appends the sections of the up-to-date build 'cache' that changed since
+        the last flush. Does nothing if the previous flush was less than
+        'interval' seconds ago, unless 'force' is set. Returns the number of
+        records written.
+        """
+        now = time.monotonic()
+        if not force and self.last_flush is not None and now - self.last_flush < self.interval:
+            return 0
+        self.last_flush = now
+
+        sections = cache["sections"]
+        if self.needs_compaction or self.records >= self.compact_after:
+            return self.compact(sections)
+
+        records = [
+            {"op": "put", "key": _key_to_str(key), "entries": section["entries"]}
+            for key, section in sections.items()
+            if self._changed(key, section)
+        ]
+        records += [
+            {"op": "del", "key": _key_to_str(key)}
+            for key in self.saved.keys() - sections.keys()
+        ]
+        order = [_key_to_str(key) for key in sections if key not in ("meta", "prep")]
+        if order != self.order:
+            records.append({"op": "order", "keys": order})
+        if not records:
+            return 0
+
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(r, separators=(",", ":")) + "\n" for r in records))
+            f.flush()
+            os.fsync(f.fileno())
+        self.saved = dict(sections)
+        self.order = order
+        self.records += len(records)
+        self.last_saved_at = time.time()
+        return len(records)
+
+    def compact(self, sections):
+        """Rewrites the journal as one record per live section, atomically."""
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        order = [_key_to_str(key) for key in sections if key not in ("meta", "prep")]
+        records = [
+            {"op": "put", "key": _key_to_str(key), "entries": section["entries"]}
+            for key, section in sections.items()
+        ]
+        records.append({"op": "order", "keys": order})
+
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write("".join(json.dumps(r, separators=(",", ":")) + "\n" for r in records))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        self.saved = dict(sections)
+        self.order = order
+        self.records = len(records)
+        self.needs_compaction = False
+        self.last_saved_at = time.time()
+        return len(records)
+
+    def discard(self):
+        """
+        Empties the journal, so the next start has nothing to restore, and
+        forgets what was written: nothing is saved again until the next edit.
+        """
+        if os.path.exists(self.path):
+            with open(self.path, "w", encoding="utf-8") as f:
+                os.fsync(f.fileno())
+        self.saved = {}
+        self.order = None
+        self.records = 0
+        self.last_flush = None
+        self.needs_compaction = True
+        self.last_saved_at = None
+
+
+def open_autosave_journal(directory=None):
+    """Returns an AutosaveJournal in 'directory' (default_autosave_dir()), or None if autosave is off."""
+    directory = directory or default_autosave_dir()
+    if not directory:
+        return None
+    os.makedirs(directory, exist_ok=True)
+    return AutosaveJournal(os.path.join(directory, JOURNAL_FILE_NAME))
@@ -0,0 +1,568 @@
+"""
+Binary formats for archiving definitions, next to the JSON export.
+
+* "msgpack": the list of JSON entries as one MessagePack array, readable by
+  any MessagePack library.
+* "columnar": a MessagePack map that stores every distinct string once (a
+  string pool), every distinct table header row once, and table cells
+  column by column as arrays of string numbers, so the headers and cell
+  values that tables repeat (the conversion table's fixed header, units,
+  "yes"/"no") cost four bytes each. An entry's offset is stored with it, so
+  ColumnarArchive reads straight from a memory-mapped file and decodes an
+  entry, or just its level and title, only when it is asked for.
+
+Both decode to exactly the entries they were made from: json.dumps() of a
+decoded archive is byte-identical to the JSON export of the same entries.
+Only the part of MessagePack that JSON values need is implemented (nil,
+booleans, integers, floats, strings, arrays, maps) plus binary data and one
+extension type, for references into the string pool. Arrays of string
+numbers are little-endian uint32. Every length is checked against the
+bytes that are left, so a truncated or damaged archive, or one with data
+after its last entry, raises ValueError. Nothing in here depends on
+Streamlit.
+"""
+import contextlib
+import mmap
+import struct
+import sys
+from array import array
+
+ARCHIVE_FORMATS = ("msgpack", "columnar")
+# File extensions of the formats
+ARCHIVE_EXTENSIONS = {"msgpack": ".msgpack", "columnar": ".mdcol"}
+
+COLUMNAR_FORMAT = "modality-columnar"
+COLUMNAR_VERSION = 1
+# MessagePack extension type of a string-pool reference (4-byte string number)
+STRING_REF = 1
+
+# Entry kinds of the columnar format:
+# [TEXT_ENTRY, level, title, content-type, content]  level, title and
+#     content-type as string numbers, content as a value
+# [TABLE_ENTRY, level, title, header row number, data row count, cells]
+#     cells as string numbers, column by column
+# [OTHER_ENTRY, entry]  anything else, as a value
+TEXT_ENTRY, TABLE_ENTRY, OTHER_ENTRY = 0, 1, 2
+ENTRY_KEYS = ["level", "title", "content-type", "content"]
+
+_INT_FORMATS = {
+    0xcc: ">B", 0xcd: ">H", 0xce: ">I", 0xcf: ">Q",
+    0xd0: ">b", 0xd1: ">h", 0xd2: ">i", 0xd3: ">q",
+}
+_FIXEXT_SIZES = {0xd4: 1, 0xd5: 2, 0xd6: 4, 0xd7: 8, 0xd8: 16}
+# What decoding a truncated or damaged archive runs into
+_DAMAGED_ERRORS = (AttributeError, IndexError, KeyError, TypeError, UnicodeDecodeError, struct.error)
+
+###############################################################################
+# MESSAGEPACK
+###############################################################################
+
+def _pack_length(n, fix_base, fix_limit, codes, out):
+    """Header of a string, array or map ('codes': 8-, 16- and 32-bit forms, None if absent)."""
+    if n < fix_limit:
+        out.append(bytes((fix_base | n,)))
+    elif codes[0] is not None and n < 0x100:
+        out.append(bytes((codes[0], n)))
+    elif n < 0x10000:
+        out.append(struct.pack(">BH", codes[1], n))
+    elif n < 0x100000000:
+        out.append(struct.pack(">BI", codes[2], n))
+    else:
+        raise ValueError("too large for MessagePack")
+
+
+def _pack_int(value, out):
+    if 0 <= value < 0x80:
+        out.append(bytes((value,)))
+    elif -0x20 <= value < 0:
+        out.append(bytes((value & 0xff,)))
+    elif value >= 0:
+        for code in (0xcc, 0xcd, 0xce, 0xcf):
+            if value < 1 << (8 * struct.calcsize(_INT_FORMATS[code])):
+                out.append(bytes((code,)) + struct.pack(_INT_FORMATS[code], value))
+                return
+        raise ValueError(f"integer {value} is too large for MessagePack")
+    else:
+        for code in (0xd0, 0xd1, 0xd2, 0xd3):
+            if value >= -(1 << (8 * struct.calcsize(_INT_FORMATS[code]) - 1)):
+                out.append(bytes((code,)) + struct.pack(_INT_FORMATS[code], value))
+                return
+        raise ValueError(f"integer {value} is too large for MessagePack")
+
+
+def _pack(value, out, intern=None):
+    """
+    Appends the MessagePack encoding of a JSON value to the list of bytes
+    'out'. With 'intern' (string -> string number) strings are written as
+    references to the string pool.
+    """
+    if isinstance(value, str):
+        if intern is not None:
+            out.append(struct.pack(">BbI", 0xd6, STRING_REF, intern(value)))
+            return
+        data = value.encode("utf-8")
+        _pack_length(len(data), 0xa0, 32, (0xd9, 0xda, 0xdb), out)
+        out.append(data)
+    elif value is None:
+        out.append(b"\xc0")
+    elif value is True:
+        out.append(b"\xc3")
+    elif value is False:
+        out.append(b"\xc2")
+    elif isinstance(value, int):
+        _pack_int(value, out)
+    elif isinstance(value, float):
+        out.append(struct.pack(">Bd", 0xcb, value))
+    elif isinstance(value, (list, tuple)):
+        _pack_length(len(value), 0x90, 16, (None, 0xdc, 0xdd), out)
+        for item in value:
+            _pack(item, out, intern)
+    elif isinstance(value, dict):
+        _pack_length(len(value), 0x80, 16, (None, 0xde, 0xdf), out)
+        for key, item in value.items():
+            _pack(key, out, intern)
+            _pack(item, out, intern)
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        _pack_length(len(value), 0, 0, (0xc4, 0xc5, 0xc6), out)
+        out.append(bytes(value))
+    else:
+        raise TypeError(f"can't encode {type(value).__name__} as MessagePack")
+
+
+def _unpack(buf, pos, string=None):
+    """
+    Decodes the MessagePack value at 'pos' of the memoryview 'buf'. Returns
+    (value, position after it). Binary data comes back as a memoryview into
+    'buf'; string references are resolved by 'string(number)'.
+    """
+    code = buf[pos]
+    pos += 1
+    if code < 0x80:
+        return code, pos
+    if code >= 0xe0:
+        return code - 0x100, pos
+    if 0xa0 <= code <= 0xbf:
+        end = _end_of(buf, pos, code & 0x1f)
+        return str(buf[pos:end], "utf-8"), end
+    if 0x90 <= code <= 0x9f:
+        return _unpack_array(buf, pos, code & 0x0f, string)
+    if 0x80 <= code <= 0x8f:
+        return _unpack_map(buf, pos, code & 0x0f, string)
+    if code == 0xc0:
+        return None, pos
+    if code == 0xc2:
+        return False, pos
+    if code == 0xc3:
+        return True, pos
+    if code in _INT_FORMATS:
+        fmt = _INT_FORMATS[code]
+        return struct.unpack_from(fmt, buf, pos)[0], pos + struct.calcsize(fmt)
+    if code == 0xcb:
+        return struct.unpack_from(">d", buf, pos)[0], pos + 8
+    if code == 0xca:
+        return struct.unpack_from(">f", buf, pos)[0], pos + 4
+    if code in (0xd9, 0xda, 0xdb, 0xc4, 0xc5, 0xc6):
+        n, pos = _unpack_length(buf, pos, code in (0xd9, 0xc4), code in (0xda, 0xc5))
+        end = _end_of(buf, pos, n)
+        if code >= 0xd9:
+            return str(buf[pos:end], "utf-8"), end
+        return buf[pos:end], end
+    if code in (0xdc, 0xdd):
+        n, pos = _unpack_length(buf, pos, False, code == 0xdc)
+        return _unpack_array(buf, pos, n, string)
+    if code in (0xde, 0xdf):
+        n, pos = _unpack_length(buf, pos, False, code == 0xde)
+        return _unpack_map(buf, pos, n, string)
+    if code in _FIXEXT_SIZES or code in (0xc7, 0xc8, 0xc9):
+        if code in _FIXEXT_SIZES:
+            n = _FIXEXT_SIZES[code]
+        else:
+            n, pos = _unpack_length(buf, pos, code == 0xc7, code == 0xc8)
+        ext_type = struct.unpack_from(">b", buf, pos)[0]
+        pos += 1
+        if ext_type != STRING_REF or n != 4 or string is None:
+            raise ValueError(f"unsupported MessagePack extension type {ext_type}")
+        return string(struct.unpack_from(">I", buf, pos)[0]), pos + 4
+    raise ValueError(f"unsupported MessagePack type byte 0x{code:02x}")
+
+
+def _end_of(buf, pos, n):
+    """The end of the 'n' bytes at 'pos', which must all be in 'buf'."""
+    if n > len(buf) - pos:
+        raise ValueError(f"truncated data: {n} bytes at offset {pos}, {len(buf) - pos} left")
+    return pos + n
+
+
+def _unpack_length(buf, pos, is_8bit, is_16bit):
+    if is_8bit:
+        return buf[pos], pos + 1
+    if is_16bit:
+        return struct.unpack_from(">H", buf, pos)[0], pos + 2
+    return struct.unpack_from(">I", buf, pos)[0], pos + 4
+
+
+def _unpack_array(buf, pos, n, string):
+    # Every item takes at least one byte
+    _end_of(buf, pos, n)
+    items = []
+    for _ in range(n):
+        item, pos = _unpack(buf, pos, string)
+        items.append(item)
+    return items, pos
+
+
+def _unpack_map(buf, pos, n, string):
+    _end_of(buf, pos, 2 * n)
+    items = {}
+    for _ in range(n):
+        key, pos = _unpack(buf, pos, string)
+        items[key], pos = _unpack(buf, pos, string)
+    return items, pos
+
+
+def _unpack_header(buf, pos, fix_base, codes):
+    """Length of the array (or map) at 'pos' and the position of its first item."""
+    code = buf[pos]
+    if fix_base <= code <= fix_base + 0x0f:
+        n, pos = code & 0x0f, pos + 1
+    elif code == codes[0]:
+        n, pos = struct.unpack_from(">H", buf, pos + 1)[0], pos + 3
+    elif code == codes[1]:
+        n, pos = struct.unpack_from(">I", buf, pos + 1)[0], pos + 5
+    else:
+        return None, pos
+    _end_of(buf, pos, n)
+    return n, pos
+
+
+def _uint32s(view):
+    """The little-endian uint32 numbers in a memoryview, without copying when possible."""
+    if sys.byteorder == "little":
+        return view.cast("I")
+    numbers = array("I", view)
+    numbers.byteswap()
+    return numbers
+
+
+def _uint32_bytes(numbers):
+    numbers = array("I", numbers)
+    if sys.byteorder != "little":
+        numbers.byteswap()
+    return numbers.tobytes()
+
+###############################################################################
+# ENCODING
+###############################################################################
+
+def encode_msgpack(entries):
+    """The entries (a definition as JSON values) as one MessagePack array."""
+    out = []
+    _pack(entries, out)
+    return b"".join(out)
+
+
+def _is_string_grid(rows, width):
+    return all(
+        type(row) is list and len(row) == width and all(type(cell) is str for cell in row)
+        for row in rows
+    )
+
+
+def encode_columnar(entries):
+    """The entries in the columnar format (see the module docstring)."""
+    numbers = {}
+    pool = []
+
+    def intern(value):
+        number = numbers.get(value)
+        if number is None:
+            number = numbers[value] = len(numbers)
+            pool.append(value.encode("utf-8"))
+        return number
+
+    header_rows = {}
+    body = []
+    entry_ends = []
+    size = 0
+    for entry in entries:
+        out = []
+        standard = (
+            type(entry) is dict and list(entry) == ENTRY_KEYS
+            and all(type(entry[key]) is str for key in ENTRY_KEYS[:3])
+        )
+        content = entry["content"] if standard else None
+        if (standard and entry["content-type"] == "table" and type(content) is list and content
+                and type(content[0]) is list and _is_string_grid(content, len(content[0]))):
+            header = tuple(intern(cell) for cell in content[0])
+            header_number = header_rows.setdefault(header, len(header_rows))
+            cells = [intern(row[c]) for c in range(len(header)) for row in content[1:]]
+            _pack([TABLE_ENTRY, intern(entry["level"]), intern(entry["title"]),
+                   header_number, len(content) - 1, _uint32_bytes(cells)], out)
+        elif standard:
+            out.append(b"\x95")
+            _pack(TEXT_ENTRY, out)
+            for key in ENTRY_KEYS[:3]:
+                _pack(intern(entry[key]), out)
+            _pack(content, out, intern)
+        else:
+            out.append(b"\x92")
+            _pack(OTHER_ENTRY, out)
+            _pack(entry, out, intern)
+        body.extend(out)
+        size += sum(len(part) for part in out)
+        entry_ends.append(size)
+
+    ends = []
+    end = 0
+    for data in pool:
+        end += len(data)
+        ends.append(end)
+    fields = {
+        "format": COLUMNAR_FORMAT,
+        "version": COLUMNAR_VERSION,
+        "strings": b"".join(pool),
+        "string_ends": _uint32_bytes(ends),
+        "headers": [_uint32_bytes(header) for header in header_rows],
+        "entry_ends": _uint32_bytes(entry_ends),
+    }
+    head = []
+    _pack_length(len(fields) + 1, 0x80, 16, (None, 0xde, 0xdf), head)
+    for key, value in fields.items():
+        _pack(key, head)
+        _pack(value, head)
+    # "entries" goes last, so a reader can stop at its start
+    _pack("entries", head)
+    _pack_length(len(entries), 0x90, 16, (None, 0xdc, 0xdd), head)
+    return b"".join(head + body)
+
+
+def encode_archive(entries, archive_format):
+    """The entries encoded in one of ARCHIVE_FORMATS."""
+    if archive_format == "msgpack":
+        return encode_msgpack(entries)
+    if archive_format == "columnar":
+        return encode_columnar(entries)
+    raise ValueError(f"unknown archive format '{archive_format}'")
+
+###############################################################################
+# DECODING
+###############################################################################
+
+class ColumnarArchive:
+    """
+    Read access to a columnar archive in 'buffer' (bytes, or an mmap of the
+    file). Opening it reads only the header; entries are decoded one by one
+    on access, and pooled strings when an entry first uses them. Call
+    close() (or use it as a context manager) before closing an mmap.
+    """
+
+    def __init__(self, buffer):
+        self._buf = memoryview(buffer)
+        self._views = [self._buf]
+        try:
+            self._read_header()
+        except _DAMAGED_ERRORS as e:
+            self.close()
+            raise ValueError(f"damaged or truncated archive header: {e}") from None
+        except BaseException:
+            self.close()
+            raise
+
+    def _read_header(self):
+        buf = self._buf
+        count, pos = _unpack_header(buf, 0, 0x80, (0xde, 0xdf))
+        if count is None:
+            raise ValueError("not a columnar definition archive")
+        fields = {}
+        for _ in range(count):
+            key, pos = _unpack(buf, pos)
+            if key == "entries":
+                self._count, self._start = _unpack_header(buf, pos, 0x90, (0xdc, 0xdd))
+                break
+            fields[key], pos = _unpack(buf, pos)
+            if isinstance(fields[key], memoryview):
+                self._views.append(fields[key])
+            elif key == "headers" and isinstance(fields[key], list):
+                self._views.extend(view for view in fields[key] if isinstance(view, memoryview))
+        else:
+            raise ValueError("not a columnar definition archive")
+        if fields.get("format") != COLUMNAR_FORMAT:
+            raise ValueError("not a columnar definition archive")
+        if fields.get("version") != COLUMNAR_VERSION:
+            raise ValueError(f"unsupported columnar archive version {fields.get('version')}")
+
+        for key in ("strings", "string_ends", "entry_ends"):
+            if not isinstance(fields.get(key), memoryview):
+                raise ValueError(f"damaged archive: '{key}' is missing or not binary data")
+        if not isinstance(fields.get("headers"), list):
+            raise ValueError("damaged archive: 'headers' is missing or not a list")
+        self._pool = fields["strings"]
+        self._string_ends = self._cast(fields["string_ends"])
+        self._entry_ends = self._cast(fields["entry_ends"])
+        self._header_rows = [self._cast(header) for header in fields["headers"]]
+        self._strings = [None] * len(self._string_ends)
+        if (self._string_ends[-1] if self._strings else 0) != len(self._pool):
+            raise ValueError("damaged archive: the string pool doesn't match its index")
+        if len(self._entry_ends) != self._count:
+            raise ValueError("damaged archive: the entry count doesn't match its index")
+        end = self._start + (self._entry_ends[-1] if self._count else 0)
+        if end != len(buf):
+            problem = "truncated" if end > len(buf) else f"{len(buf) - end} bytes of extra data"
+            raise ValueError(f"damaged archive: {problem} after the entries")
+
+    def _cast(self, view):
+        if not isinstance(view, memoryview):
+            raise ValueError("damaged archive: expected binary data")
+        numbers = _uint32s(view)
+        if isinstance(numbers, memoryview):
+            self._views.append(numbers)
+        return numbers
+
+    def string(self, number):
+        """Pooled string 'number'."""
+        value = self._strings[number]
+        if value is None:
+            start = self._string_ends[number - 1] if number else 0
+            end = self._string_ends[number]
+            if not start <= end <= len(self._pool):
+                raise ValueError(f"damaged archive: bad bounds of pooled string {number}")
+            value = self._strings[number] = str(self._pool[start:end], "utf-8")
+        return value
+
+    def __len__(self):
+        return self._count
+
+    def _entry_position(self, i):
+        if not 0 <= i < self._count:
+            raise IndexError("archive entry index out of range")
+        return self._start + (self._entry_ends[i - 1] if i else 0)
+
+    def __getitem__(self, i):
+        """Entry 'i', exactly as it was encoded."""
+        pos = self._entry_position(i)
+        try:
+            return self._decode_entry(pos, self._start + self._entry_ends[i])
+        except (ValueError, *_DAMAGED_ERRORS) as e:
+            raise ValueError(f"damaged or truncated archive entry {i}: {e}") from None
+
+    def _decode_entry(self, pos, end):
+        record, record_end = _unpack(self._buf, pos, self.string)
+        if record_end != end:
+            raise ValueError(f"the entry ends at offset {record_end} instead of {end}")
+        kind = record[0]
+        if kind == OTHER_ENTRY:
+            return record[1]
+        string = self.string
+        entry = {"level": string(record[1]), "title": string(record[2])}
+        if kind == TEXT_ENTRY:
+            entry["content-type"] = string(record[3])
+            entry["content"] = record[4]
+            return entry
+        header = [string(n) for n in self._header_rows[record[3]]]
+        row_count = record[4]
+        with record[5] as cells_view:
+            cells = _uint32s(cells_view)
+            if len(cells) != row_count * len(header):
+                raise ValueError(f"{len(cells)} cells for {row_count} rows of {len(header)} columns")
+            columns = [
+                [string(n) for n in cells[c * row_count:(c + 1) * row_count]]
+                for c in range(len(header))
+            ]
+            if isinstance(cells, memoryview):
+                cells.release()
+        if columns:
+            rows = [header] + [list(row) for row in zip(*columns)]
+        else:
+            rows = [header] + [[] for _ in range(row_count)]
+        entry["content-type"] = "table"
+        entry["content"] = rows
+        return entry
+
+    def heading(self, i):
+        """(level, title) of entry 'i', without decoding its content."""
+        buf = self._buf
+        try:
+            _, pos = _unpack_header(buf, self._entry_position(i), 0x90, (0xdc, 0xdd))
+            kind, pos = _unpack(buf, pos)
+            if kind != OTHER_ENTRY:
+                level, pos = _unpack(buf, pos)
+                title, pos = _unpack(buf, pos)
+                return self.string(level), self.string(title)
+        except _DAMAGED_ERRORS as e:
+            raise ValueError(f"damaged or truncated archive entry {i}: {e}") from None
+        entry = self[i]
+        return entry.get("level"), entry.get("title")
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self[i]
+
+    def close(self):
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def archive_format(buffer):
+    """Which of ARCHIVE_FORMATS the bytes in 'buffer' are, None if neither (e.g. JSON)."""
+    if not len(buffer):
+        return None
+    code = buffer[0]
+    if 0x90 <= code <= 0x9f or code in (0xdc, 0xdd):
+        return "msgpack"
+    if 0x80 <= code <= 0x8f or code in (0xde, 0xdf):
+        return "columnar"
+    return None
+
+
+def iter_archive_items(buffer):
+    """
+    Yields (index, offset, item) for each entry of a msgpack or columnar
+    archive in 'buffer', like iter_json_array_items(), decoding one entry
+    at a time.
+    """
+    kind = archive_format(buffer)
+    if kind == "columnar":
+        with ColumnarArchive(buffer) as archive:
+            for i in range(len(archive)):
+                yield i, archive._entry_position(i), archive[i]
+        return
+    if kind is None:
+        raise ValueError("not a definition archive")
+    with memoryview(buffer) as buf:
+        try:
+            count, pos = _unpack_header(buf, 0, 0x90, (0xdc, 0xdd))
+        except _DAMAGED_ERRORS as e:
+            raise ValueError(f"damaged or truncated archive header: {e}") from None
+        for i in range(count):
+            start = pos
+            try:
+                item, pos = _unpack(buf, pos)
+            except (ValueError, *_DAMAGED_ERRORS) as e:
+                raise ValueError(f"damaged or truncated archive entry {i}: {e}") from None
+            yield i, start, item
+        if pos != len(buf):
+            raise ValueError(f"damaged archive: {len(buf) - pos} bytes of extra data after the entries")
+
+
+def decode_archive(buffer):
+    """All the entries of a msgpack or columnar archive, as a list."""
+    return [item for _, _, item in iter_archive_items(buffer)]
+
+
+@contextlib.contextmanager
+def map_file(path):
+    """A read-only memory map of a file (its bytes, if it is empty), for the readers above."""
+    with open(path, "rb") as f:
+        if not f.seek(0, 2):
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield mapped
@@ -0,0 +1,422 @@
+"""
+Structural diff between two versions of a definition, as lists of JSON
+entries (what build_final_json and json.load of a saved file give).
+
+Meta-data and preparation entries are compared field by field. Headings
+are aligned by number and title with a sequence diff, so an inserted or
+removed heading doesn't make every later one look changed; headings left
+unaligned are paired by number, then by title, before being reported as
+added or removed. Tables are diffed cell by cell: columns are aligned by
+header, rows by their cells, so inserted and removed rows and columns are
+reported as such and only the cells of rows that really changed are listed.
+
+The sequence diff is Myers' O((N+M)D) algorithm in its linear-space form
+(recursing on the "middle snake"), run on small ints: every element is
+first replaced by the number of its distinct value, so comparing two table
+rows is one int comparison. The search gives up past MAX_EDIT_COST edits,
+where it would turn quadratic (e.g. a reformatted column makes every row
+differ): the range is then split on the values that occur once on each
+side, as patience diff does, the pieces between are diffed again within
+the same bound, and whatever is still too different is paired position by
+position. Sections whose entries are equal are skipped with a plain ==
+before any diffing, which keeps large, mostly unchanged documents cheap.
+Nothing in here depends on Streamlit.
+"""
+from bisect import bisect_left
+
+ADDED = "added"
+REMOVED = "removed"
+CHANGED = "changed"
+# Edits the exact sequence diff looks for in one range before giving up
+MAX_EDIT_COST = 200
+
+###############################################################################
+# SEQUENCE DIFF
+###############################################################################
+
+def _intern(a, b):
+    """'a' and 'b' with each element replaced by the number of its value."""
+    numbers = {}
+    return (
+        [numbers.setdefault(x, len(numbers)) for x in a],
+        [numbers.setdefault(x, len(numbers)) for x in b],
+    )
+
+
+def _middle_snake(a, alo, ahi, b, blo, bhi, max_cost=None):
+    """
+    The middle snake of an optimal edit path between a[alo:ahi] and
+    b[blo:bhi], as (x0, y0, x1, y1) relative to (alo, blo), and the length
+    of that path. Both ranges must be non-empty. None if the path is longer
+    than 'max_cost'.
+    """
+    n = ahi - alo
+    m = bhi - blo
+    delta = n - m
+    odd = delta & 1
+    offset = (n + m + 1) // 2 + 1
+    rounds = offset if max_cost is None else min(offset, max_cost // 2 + 1)
+    forward = [0] * (2 * offset + 1)
+    backward = [0] * (2 * offset + 1)
+    for d in range(rounds):
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and forward[offset + k - 1] < forward[offset + k + 1]):
+                x = forward[offset + k + 1]
+            else:
+                x = forward[offset + k - 1] + 1
+            y = x - k
+            x0, y0 = x, y
+            while x < n and y < m and a[alo + x] == b[blo + y]:
+                x += 1
+                y += 1
+            forward[offset + k] = x
+            if odd and -(d - 1) <= delta - k <= d - 1:
+                if x + backward[offset + delta - k] >= n:
+                    return (x0, y0, x, y), 2 * d - 1
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and backward[offset + k - 1] < backward[offset + k + 1]):
+                x = backward[offset + k + 1]
+            else:
+                x = backward[offset + k - 1] + 1
+            y = x - k
+            x0, y0 = x, y
+            while x < n and y < m and a[ahi - 1 - x] == b[bhi - 1 - y]:
+                x += 1
+                y += 1
+            backward[offset + k] = x
+            if not odd and -d <= delta - k <= d:
+                if x + forward[offset + delta - k] >= n:
+                    return (n - x, m - y, n - x0, m - y0), 2 * d
+    if rounds < offset:
+        return None
+    raise AssertionError("no middle snake")
+
+
+def _unique_anchors(a, alo, ahi, b, blo, bhi):
+    """
+    (i, j) pairs of the values that occur exactly once in a[alo:ahi] and
+    once in b[blo:bhi], the longest run of them in the same order on both
+    sides (patience sorting on j).
+    """
+    once = {}
+    for i in range(alo, ahi):
+        once[a[i]] = -1 if a[i] in once else i
+    partner = {}
+    for j in range(blo, bhi):
+        value = b[j]
+        if once.get(value, -1) >= 0:
+            partner[value] = -1 if value in partner else j
+    candidates = sorted((once[value], j) for value, j in partner.items() if j >= 0)
+
+    tails = []      # j of the last pair of the best run of each length
+    ends = []       # index into candidates of that pair
+    previous = []   # candidates index -> the one before it in its run
+    for n, (_, j) in enumerate(candidates):
+        length = bisect_left(tails, j)
+        if length == len(tails):
+            tails.append(j)
+            ends.append(n)
+        else:
+            tails[length] = j
+            ends[length] = n
+        previous.append(ends[length - 1] if length else -1)
+    anchors = []
+    n = ends[-1] if ends else -1
+    while n >= 0:
+        anchors.append(candidates[n])
+        n = previous[n]
+    return anchors[::-1]
+
+
+def _matching_blocks(a, alo, ahi, b, blo, bhi, blocks, max_cost=MAX_EDIT_COST, anchor=True):
+    """
+    Appends the (i, j, size) runs of an edit script, in order: a shortest
+    one when it costs at most 'max_cost' edits. Past that the range is split
+    on unique values (with 'anchor') and the pieces are diffed again without
+    splitting; runs of a piece that is still too costly are left unmatched.
+    """
+    start = alo
+    while alo < ahi and blo < bhi and a[alo] == b[blo]:
+        alo += 1
+        blo += 1
+    if alo > start:
+        blocks.append((start, blo - (alo - start), alo - start))
+    end = ahi
+    while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+        ahi -= 1
+        bhi -= 1
+    if alo < ahi and blo < bhi:
+        snake = _middle_snake(a, alo, ahi, b, blo, bhi, max_cost)
+        if snake is not None:
+            (x0, y0, x1, y1), _ = snake
+            _matching_blocks(a, alo, alo + x0, b, blo, blo + y0, blocks, max_cost, anchor)
+            if x1 > x0:
+                blocks.append((alo + x0, blo + y0, x1 - x0))
+            _matching_blocks(a, alo + x1, ahi, b, blo + y1, bhi, blocks, max_cost, anchor)
+        elif anchor:
+            i, j = alo, blo
+            for ai, bj in _unique_anchors(a, alo, ahi, b, blo, bhi):
+                _matching_blocks(a, i, ai, b, j, bj, blocks, max_cost, anchor=False)
+                blocks.append((ai, bj, 1))
+                i, j = ai + 1, bj + 1
+            _matching_blocks(a, i, ahi, b, j, bhi, blocks, max_cost, anchor=False)
+    if end > ahi:
+        blocks.append((ahi, bhi, end - ahi))
+
+
+def sequence_opcodes(a, b, max_cost=MAX_EDIT_COST):
+    """
+    How to turn sequence 'a' into 'b', as difflib-style opcodes: a list of
+    (tag, i1, i2, j1, j2) with tag "equal", "delete", "insert" or "replace".
+    The script is a shortest one when the sequences differ by at most
+    'max_cost' edits (None for no limit). The elements must be hashable.
+    """
+    a, b = _intern(a, b)
+    blocks = []
+    _matching_blocks(a, 0, len(a), b, 0, len(b), blocks, max_cost)
+    blocks.append((len(a), len(b), 0))
+
+    opcodes = []
+    i = j = 0
+    for bi, bj, size in blocks:
+        if i < bi and j < bj:
+            opcodes.append(("replace", i, bi, j, bj))
+        elif i < bi:
+            opcodes.append(("delete", i, bi, j, j))
+        elif j < bj:
+            opcodes.append(("insert", i, i, j, bj))
+        if size:
+            if opcodes and opcodes[-1][0] == "equal":
+                # Adjacent blocks from the two halves of a split
+                opcodes[-1] = ("equal", opcodes[-1][1], bi + size, opcodes[-1][3], bj + size)
+            else:
+                opcodes.append(("equal", bi, bi + size, bj, bj + size))
+        i, j = bi + size, bj + size
+    return opcodes
+
+###############################################################################
+# TABLE DIFF
+###############################################################################
+
+class TableDiff:
+    """
+    Cell-level differences between two tables (lists of rows, row 0 being
+    the headers). 'columns' lists (status, old index, new index, old header,
+    new header) for added, removed and renamed columns, and 'pairs' the
+    (old index, new index) of every column in both tables. 'rows' lists
+    (status, old row, new row, cells) for added, removed and changed data
+    rows, with 1-based row numbers (None on the side the row doesn't exist)
+    and 'cells' the (new column index, old value, new value) of each cell
+    that differs in a changed row.
+    """
+    __slots__ = ("columns", "pairs", "rows", "cells")
+
+    def __init__(self, columns, pairs, rows):
+        self.columns = columns
+        self.pairs = pairs
+        self.rows = rows
+        self.cells = sum(len(cells) for _, _, _, cells in rows)
+
+    def __bool__(self):
+        return bool(self.columns or self.rows)
+
+
+def _cell(row, c):
+    return row[c] if c < len(row) else ""
+
+
+def _pairs(opcodes, edits):
+    """
+    The (i, j) index pairs aligned by 'opcodes', replace blocks paired
+    position by position. 'edits' collects (CHANGED, i, j) for the pairs
+    from replace blocks and (REMOVED, i, None) / (ADDED, None, j) for the
+    elements left over.
+    """
+    pairs = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == "equal":
+            pairs.extend(zip(range(i1, i2), range(j1, j2)))
+            continue
+        common = min(i2 - i1, j2 - j1) if tag == "replace" else 0
+        for offset in range(common):
+            pairs.append((i1 + offset, j1 + offset))
+            edits.append((CHANGED, i1 + offset, j1 + offset))
+        edits.extend((REMOVED, i, None) for i in range(i1 + common, i2))
+        edits.extend((ADDED, None, j) for j in range(j1 + common, j2))
+    return pairs
+
+
+def diff_table(old_rows, new_rows):
+    """TableDiff of two tables in the JSON list-of-lists form."""
+    old_headers = old_rows[0] if old_rows else []
+    new_headers = new_rows[0] if new_rows else []
+    old_body = old_rows[1:]
+    new_body = new_rows[1:]
+
+    column_edits = []
+    column_pairs = _pairs(sequence_opcodes(old_headers, new_headers), column_edits)
+    columns = [
+        (status, i, j,
+         None if i is None else old_headers[i],
+         None if j is None else new_headers[j])
+        for status, i, j in column_edits
+    ]
+
+    # Rows are compared on the columns both tables have
+    old_keys = [tuple(_cell(row, i) for i, _ in column_pairs) for row in old_body]
+    new_keys = [tuple(_cell(row, j) for _, j in column_pairs) for row in new_body]
+    row_edits = []
+    _pairs(sequence_opcodes(old_keys, new_keys), row_edits)
+    rows = []
+    for status, i, j in row_edits:
+        cells = []
+        if status == CHANGED:
+            old_row, new_row = old_body[i], new_body[j]
+            cells = [
+                (nc, _cell(old_row, oc), _cell(new_row, nc))
+                for oc, nc in column_pairs
+                if _cell(old_row, oc) != _cell(new_row, nc)
+            ]
+        rows.append((
+            status,
+            None if i is None else i + 1,
+            None if j is None else j + 1,
+            cells,
+        ))
+    return TableDiff(columns, column_pairs, rows)
+
+###############################################################################
+# DEFINITION DIFF
+###############################################################################
+
+class SectionChange:
+    """
+    One changed section: 'old' and 'new' are its JSON entries in each version
+    (None when it was added or removed), 'table' the TableDiff when both are
+    tables.
+    """
+    __slots__ = ("status", "old", "new", "table")
+
+    def __init__(self, status, old, new, table=None):
+        self.status = status
+        self.old = old
+        self.new = new
+        self.table = table
+
+    @property
+    def entry(self):
+        return self.new if self.new is not None else self.old
+
+    @property
+    def is_heading(self):
+        return not _is_field(self.entry)
+
+    @property
+    def label(self):
+        entry = self.entry
+        if not self.is_heading:
+            return entry["title"]
+        return " ".join(part for part in (_text(entry.get("level")), _text(entry.get("title"))) if part)
+
+
+def _text(value):
+    return "" if value is None else str(value).strip()
+
+
+def _is_field(entry):
+    # A malformed heading can come without a level, or with a number or null
+    level = entry.get("level")
+    return isinstance(level, str) and level.startswith(("meta-data-", "prepration-meta-data-"))
+
+
+def _section_change(old, new):
+    """SectionChange of two versions of a section, or None if they are equal."""
+    if old == new:
+        return None
+    table = None
+    if old.get("content-type") == new.get("content-type") == "table":
+        table = diff_table(old["content"], new["content"])
+    return SectionChange(CHANGED, old, new, table)
+
+
+def _key_part(value):
+    # Malformed headings can have a list or an object as number or title
+    return value if value is None or isinstance(value, (str, int, float)) else repr(value)
+
+
+def _heading_key(entry):
+    """(number, title) of a heading, hashable even for a malformed one."""
+    return (_key_part(entry.get("level")), _key_part(entry.get("title")))
+
+
+def diff_definitions(old_entries, new_entries):
+    """
+    The sections that differ between two versions of a definition, as
+    SectionChange objects: meta-data fields first, then headings in the new
+    version's order (removed ones where they used to be), then preparation
+    fields.
+    """
+    old_fields = {e["level"]: e for e in old_entries if _is_field(e)}
+    new_fields = {e["level"]: e for e in new_entries if _is_field(e)}
+    old_headings = [e for e in old_entries if not _is_field(e)]
+    new_headings = [e for e in new_entries if not _is_field(e)]
+
+    def field_changes(prefix):
+        changes = []
+        for level in list(dict.fromkeys([*new_fields, *old_fields])):
+            if not level.startswith(prefix):
+                continue
+            old, new = old_fields.get(level), new_fields.get(level)
+            if old is None or new is None:
+                changes.append(SectionChange(ADDED if old is None else REMOVED, old, new))
+            else:
+                change = _section_change(old, new)
+                if change is not None:
+                    changes.append(change)
+        return changes
+
+    changes = field_changes("meta-data-")
+    opcodes = sequence_opcodes(
+        [_heading_key(e) for e in old_headings],
+        [_heading_key(e) for e in new_headings],
+    )
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == "equal":
+            for old, new in zip(old_headings[i1:i2], new_headings[j1:j2]):
+                change = _section_change(old, new)
+                if change is not None:
+                    changes.append(change)
+            continue
+        changes.extend(_pair_headings(old_headings[i1:i2], new_headings[j1:j2]))
+    changes += field_changes("prepration-meta-data-")
+    return changes
+
+
+def _pair_headings(old, new):
+    """
+    Changes for a run of headings the sequence diff couldn't align: pairs
+    with the same number, then with the same title, are changed (renamed or
+    renumbered); the rest are removed and added.
+    """
+    partner = {}  # new index -> old index
+    used = set()
+    old_keys = [_heading_key(entry) for entry in old]
+    new_keys = [_heading_key(entry) for entry in new]
+    for part in (0, 1):  # number, then title
+        free = {}
+        for i, key in enumerate(old_keys):
+            if i not in used:
+                free.setdefault(key[part], []).append(i)
+        for j, key in enumerate(new_keys):
+            if j not in partner and free.get(key[part]):
+                partner[j] = free[key[part]].pop(0)
+                used.add(partner[j])
+
+    changes = []
+    for j, entry in enumerate(new):
+        if j in partner:
+            changes.append(_section_change(old[partner[j]], entry))
+        else:
+            changes.append(SectionChange(ADDED, None, entry))
+    removed = [SectionChange(REMOVED, entry, None) for i, entry in enumerate(old) if i not in used]
+    return removed + [c for c in changes if c is not None]
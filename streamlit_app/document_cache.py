@@ -0,0 +1,122 @@
+"""
+Process-wide cache of parsed definitions, shared by every session.
+
+When the app is served to many users, the same templates and reference
+definitions get loaded by many sessions. A DocumentCache keeps one parsed
+Document per distinct file content (keyed by the SHA-256 of its bytes),
+with its build cache (the built JSON entries and text), and hands each
+session a copy of both that shares the tables and the built sections
+instead of copying them: a session copies a table only when it edits it
+(TableHeading.editable_table()), and rebuilds a section's JSON only when the
+section changes. The cached documents themselves are never edited.
+
+Documents are evicted least recently used first once there are more than
+'max_documents' of them or their estimated size exceeds 'max_bytes'; a
+document larger than 'max_bytes' on its own is not kept at all. Sessions
+still using an evicted document keep it alive, it just isn't handed out
+again. The cache is used from the sessions' threads, so it is locked;
+parsing happens outside the lock. Nothing in here depends on Streamlit.
+"""
+import hashlib
+import sys
+import threading
+from collections import OrderedDict
+
+from document_model import TableHeading
+from modality_definition import build_entries, copy_build_cache
+
+# Distinct documents kept, and a rough cap on their memory in bytes
+SHARED_CACHE_DOCUMENTS = 32
+SHARED_CACHE_BYTES = 256 * 1024 * 1024
+
+
+def content_hash(data):
+    """The cache key of a file's bytes (or any buffer)."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def _strings_size(values):
+    return sum(sys.getsizeof(v) for v in values if isinstance(v, str))
+
+
+def estimate_size(doc, cache):
+    """
+    Approximate memory of the Document 'doc' and its build cache 'cache', in
+    bytes: the strings and lists of the sections, the table rows of the
+    built entries (their cells are the document's strings) and the JSON text.
+    """
+    size = 0
+    for section in (doc.meta, doc.prep, *doc.rawtext_headings, *doc.table_headings):
+        size += sys.getsizeof(section)
+        for name in type(section).__slots__:
+            value = getattr(section, name, None)
+            if isinstance(value, list):
+                size += sys.getsizeof(value) + _strings_size(value)
+            elif isinstance(value, str):
+                size += sys.getsizeof(value)
+        if isinstance(section, TableHeading):
+            table = section.table
+            size += _strings_size(table.headers or ())
+            for column in table.columns:
+                size += sys.getsizeof(column) + _strings_size(column)
+    for built in cache["sections"].values():
+        size += sum(sys.getsizeof(fragment) for fragment in built["fragments"])
+        for entry in built["entries"]:
+            if entry["content-type"] == "table":
+                size += sum(sys.getsizeof(row) for row in entry["content"])
+    return size
+
+
+class DocumentCache:
+    def __init__(self, max_documents=SHARED_CACHE_DOCUMENTS, max_bytes=SHARED_CACHE_BYTES):
+        self.max_documents = max_documents
+        self.max_bytes = max_bytes
+        self.size = 0           # estimated bytes of the cached documents
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # content hash -> (document, build cache, size)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def checkout(self, digest, parse):
+        """
+        A session's copy of the document whose content hash is 'digest', and
+        of its build cache, as (document, build cache). 'parse()' returns the
+        parsed Document when it isn't cached yet; the Document it returns
+        must not be used by the caller afterwards.
+        """
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None:
+                self._entries.move_to_end(digest)
+                self.hits += 1
+        if entry is None:
+            entry = self._add(digest, parse())
+        doc, cache, _ = entry
+        return doc.copy(), copy_build_cache(cache)
+
+    def _add(self, digest, doc):
+        doc.share_tables()
+        cache = build_entries(doc)
+        entry = (doc, cache, estimate_size(doc, cache))
+        with self._lock:
+            self.misses += 1
+            if digest in self._entries:
+                # Another session parsed the same file meanwhile
+                self._entries.move_to_end(digest)
+                return self._entries[digest]
+            if entry[2] > self.max_bytes:
+                return entry
+            self._entries[digest] = entry
+            self.size += entry[2]
+            while len(self._entries) > self.max_documents or self.size > self.max_bytes:
+                _, (_, _, size) = self._entries.popitem(last=False)
+                self.size -= size
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
@@ -0,0 +1,566 @@
+"""
+In-memory model of a medical modality definition.
+
+A Document holds the meta-data, the preparation meta-data, the raw-text
+(markdown) headings and the table headings. Every class uses __slots__ so
+large sessions stay small, and tables are stored column by column so adding
+a column only allocates that column.
+
+Each section converts itself to the JSON entries of the definition format
+with to_entries(); parsing lives in modality_definition.
+
+Headings are also kept in a HeadingIndex, sorted by heading number, which
+is updated as numbers are edited; always add and remove headings through
+the Document so the index stays in step.
+"""
+import datetime
+import itertools
+from bisect import bisect_left, insort
+
+# Heading uids, unique across all the documents of the process: the undo
+# history can hold headings of a document that was replaced by a loaded one,
+# and a uid must never name two different headings
+_heading_uids = itertools.count(1)
+
+
+def _rawtext_entry(level, title, content):
+    return {
+        "level": level,
+        "title": title,
+        "content-type": "rawtext",
+        "content": content
+    }
+
+
+def _list_entry(level, title, content):
+    return {
+        "level": level,
+        "title": title,
+        "content-type": "list_of_strings",
+        "content": content
+    }
+
+
+class MetaData:
+    __slots__ = ("id", "parents", "title", "acronyms", "short_description")
+
+    def __init__(self, id="", parents=None, title="", acronyms=None, short_description=""):
+        self.id = id
+        self.parents = [""] if parents is None else parents
+        self.title = title
+        self.acronyms = ["", "", "", ""] if acronyms is None else acronyms
+        self.short_description = short_description
+
+    def to_entries(self):
+        # meta-data with single dictionary for parents & acronyms
+        return [
+            _rawtext_entry("meta-data-id", "id", self.id),
+            _list_entry("meta-data-parents", "parents", list(self.parents)),
+            _rawtext_entry("meta-data-title", "title", self.title),
+            _list_entry("meta-data-acronyms", "acronyms", list(self.acronyms)),
+            _rawtext_entry("meta-data-shortDescription", "shortDescription", self.short_description),
+        ]
+
+    def copy(self):
+        return MetaData(self.id, list(self.parents), self.title, list(self.acronyms), self.short_description)
+
+    def __eq__(self, other):
+        return isinstance(other, MetaData) and all(
+            getattr(self, name) == getattr(other, name) for name in self.__slots__
+        )
+
+
+class PreparationMetaData:
+    __slots__ = ("prepared_by", "confirmed_by", "date_of_preparation",
+                 "planned_next_review", "requires_completion")
+
+    def __init__(self, prepared_by="", confirmed_by="", date_of_preparation=None,
+                 planned_next_review="", requires_completion=""):
+        self.prepared_by = prepared_by
+        self.confirmed_by = confirmed_by
+        if date_of_preparation is None:
+            date_of_preparation = datetime.date.today().isoformat()
+        self.date_of_preparation = date_of_preparation
+        self.planned_next_review = planned_next_review
+        self.requires_completion = requires_completion
+
+    def to_entries(self):
+        # The misspelt "prepration" is part of the file format
+        return [
+            _rawtext_entry(f"prepration-meta-data-{name}", name, getattr(self, name))
+            for name in self.__slots__
+        ]
+
+    def copy(self):
+        return PreparationMetaData(*(getattr(self, name) for name in self.__slots__))
+
+    def __eq__(self, other):
+        return isinstance(other, PreparationMetaData) and all(
+            getattr(self, name) == getattr(other, name) for name in self.__slots__
+        )
+
+
+def heading_sort_key(number):
+    """
+    Total order for heading numbers: well-formed numbers ("1", "1.2", or
+    blank) by their integer parts first, then malformed ones by their text.
+    """
+    try:
+        parts = [p for p in number.split(".") if p.strip()]
+        return (0, tuple(int(p) for p in parts))
+    except (AttributeError, ValueError):
+        return (1, str(number))
+
+# Sort key of a blank heading number; blanks never count as duplicates
+BLANK_NUMBER_KEY = heading_sort_key("")
+
+
+class Heading:
+    """
+    Base class of the raw-text and table headings. 'uid' is assigned by the
+    Document, unique in the process, and stays fixed for the heading's
+    lifetime (copies keep it); setting 'number' moves the heading within its
+    document's HeadingIndex.
+    """
+    __slots__ = ("uid", "_number", "_index")
+    # Output order of headings that share a number: raw-text before tables
+    KIND = None
+    KIND_RANK = None
+
+    def __init__(self, number=""):
+        self.uid = None
+        self._index = None
+        self._number = number
+
+    @property
+    def number(self):
+        return self._number
+
+    @number.setter
+    def number(self, value):
+        if value == self._number:
+            return
+        index = self._index
+        if index is not None:
+            index.remove(self)
+        self._number = value
+        if index is not None:
+            index.add(self)
+
+    @property
+    def key(self):
+        """Identifies the heading's section, e.g. ("raw", 3) or ("table", 7)."""
+        return (self.KIND, self.uid)
+
+
+class RawTextHeading(Heading):
+    """A heading whose content is markdown text."""
+    __slots__ = ("title", "content")
+    KIND = "raw"
+    KIND_RANK = 0
+
+    def __init__(self, number="", title="", content=""):
+        super().__init__(number)
+        self.title = title
+        self.content = content
+
+    def is_blank(self):
+        return all(
+            isinstance(v, str) and v.strip() == ""
+            for v in (self.number, self.title, self.content)
+        )
+
+    def to_entries(self):
+        # If the row is fully empty, skip adding to final JSON
+        if self.is_blank():
+            return []
+        return [{
+            "level": self.number,
+            "title": self.title,
+            "content-type": "markdown",
+            "content": self.content
+        }]
+
+    def copy(self):
+        heading = RawTextHeading(self.number, self.title, self.content)
+        heading.uid = self.uid
+        return heading
+
+    def __eq__(self, other):
+        return isinstance(other, RawTextHeading) and (
+            (self.number, self.title, self.content) == (other.number, other.title, other.content)
+        )
+
+
+class Table:
+    """
+    A table stored by column: 'headers' is the header row (None when the
+    table has no rows at all) and columns[c][r] is data row r + 1, column c.
+    Every column has 'row_count' cells.
+
+    Each data row and column also has an id, row_ids[r] and column_ids[c],
+    which stays with it when other rows or columns are added or removed; the
+    editor names its widgets after them. Ids are not part of equality.
+    """
+    __slots__ = ("headers", "columns", "row_count", "row_ids", "column_ids", "_next_id")
+
+    def __init__(self, headers=None, columns=None, row_count=0):
+        self.headers = headers
+        self.columns = [] if columns is None else columns
+        self.row_count = row_count
+        self.row_ids = list(range(row_count))
+        self.column_ids = list(range(row_count, row_count + len(self.columns)))
+        self._next_id = row_count + len(self.columns)
+
+    def _new_id(self):
+        self._next_id += 1
+        return self._next_id - 1
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Builds a table from the JSON list-of-lists form, row 0 being the
+        headers. Short rows are padded with "" to the widest row.
+        """
+        if not isinstance(rows, list) or not all(isinstance(row, list) for row in rows):
+            raise ValueError("table content must be a list of rows")
+        if not rows:
+            return cls()
+        width = max(len(row) for row in rows)
+        headers = list(rows[0]) + [""] * (width - len(rows[0]))
+        columns = [
+            [row[c] if c < len(row) else "" for row in rows[1:]]
+            for c in range(width)
+        ]
+        return cls(headers, columns, len(rows) - 1)
+
+    def to_rows(self):
+        if self.headers is None:
+            return []
+        rows = [list(self.headers)]
+        if self.columns:
+            rows.extend(list(row) for row in zip(*self.columns))
+        else:
+            rows.extend([] for _ in range(self.row_count))
+        return rows
+
+    @property
+    def column_count(self):
+        return len(self.columns)
+
+    def ensure_default(self):
+        """Gives an empty table 1 header row (1 column) plus 1 empty data row."""
+        if self.headers is None:
+            self.headers = ["Column 1"]
+            self.columns = [[""]]
+            self.row_count = 1
+            self.row_ids = [self._new_id()]
+            self.column_ids = [self._new_id()]
+            return True
+        return False
+
+    def add_row(self):
+        """Appends an empty data row, leaving the header row alone. O(columns)."""
+        if self.ensure_default():
+            return
+        for column in self.columns:
+            column.append("")
+        self.row_count += 1
+        self.row_ids.append(self._new_id())
+
+    def add_column(self, header=None):
+        """Appends a column with a default header. O(rows), no row is rebuilt."""
+        if self.headers is None:
+            self.headers = []
+        if header is None:
+            header = f"Column {len(self.headers) + 1}"
+        self.headers.append(header)
+        self.columns.append([""] * self.row_count)
+        self.column_ids.append(self._new_id())
+
+    def extend_rows(self, columns):
+        """
+        Appends data rows given column by column: one list per column of the
+        table, all of the same length. O(cells added).
+        """
+        count = len(columns[0]) if columns else 0
+        for column, values in zip(self.columns, columns):
+            column.extend(values)
+        self.row_ids.extend(range(self._next_id, self._next_id + count))
+        self._next_id += count
+        self.row_count += count
+
+    def replace(self, headers, columns, column_ids):
+        """
+        Replaces the whole table with 'headers' and 'columns' (one list per
+        column). Each column keeps the id given in 'column_ids', None for a
+        new column; all data rows are new.
+        """
+        self.headers = list(headers)
+        self.columns = columns
+        self.row_count = len(columns[0]) if columns else 0
+        self.column_ids = [self._new_id() if i is None else i for i in column_ids]
+        self.row_ids = list(range(self._next_id, self._next_id + self.row_count))
+        self._next_id += self.row_count
+
+    def keep_rows(self, rows):
+        """Keeps only the data rows at the positions 'rows' (ascending), with their ids."""
+        self.columns = [[column[r] for r in rows] for column in self.columns]
+        self.row_ids = [self.row_ids[r] for r in rows]
+        self.row_count = len(rows)
+
+    def copy(self):
+        table = Table(
+            None if self.headers is None else list(self.headers),
+            [list(column) for column in self.columns],
+            self.row_count,
+        )
+        table.row_ids = list(self.row_ids)
+        table.column_ids = list(self.column_ids)
+        table._next_id = self._next_id
+        return table
+
+    def __eq__(self, other):
+        return isinstance(other, Table) and (
+            (self.headers, self.columns, self.row_count)
+            == (other.headers, other.columns, other.row_count)
+        )
+
+
+class TableHeading(Heading):
+    """
+    A heading whose content is a table.
+
+    A heading can share its table with other documents ('shared_table'), e.g.
+    with a cached document every session starts from: copying the heading
+    then shares the table too, and editable_table() copies it before the
+    first edit. Code that changes a table must get it through
+    editable_table(); reading heading.table is always fine.
+    """
+    __slots__ = ("title", "table", "shared_table")
+    KIND = "table"
+    KIND_RANK = 1
+
+    def __init__(self, number="", title="", table=None, shared_table=False):
+        super().__init__(number)
+        self.title = title
+        self.table = Table() if table is None else table
+        self.shared_table = shared_table
+
+    def editable_table(self):
+        """The table, copied first if it is shared (copy-on-write)."""
+        if self.shared_table:
+            self.table = self.table.copy()
+            self.shared_table = False
+        return self.table
+
+    def to_entries(self):
+        return [{
+            "level": self.number,
+            "title": self.title,
+            "content-type": "table",
+            "content": self.table.to_rows()
+        }]
+
+    def copy(self):
+        if self.shared_table:
+            heading = TableHeading(self.number, self.title, self.table, shared_table=True)
+        else:
+            heading = TableHeading(self.number, self.title, self.table.copy())
+        heading.uid = self.uid
+        return heading
+
+    def __eq__(self, other):
+        return isinstance(other, TableHeading) and (
+            (self.number, self.title, self.table) == (other.number, other.title, other.table)
+        )
+
+
+class HeadingIndex:
+    """
+    The headings of one document in output order: by heading_sort_key() of
+    their number, raw-text before tables on equal numbers, then by uid. Each
+    renumbering is a bisect removal and insertion, and headings are grouped
+    by number so duplicates are known without a rebuild.
+    """
+    __slots__ = ("_entries", "_headings", "_by_number")
+
+    def __init__(self):
+        self._entries = []     # sorted (sort key, kind rank, uid)
+        self._headings = {}    # uid -> heading
+        self._by_number = {}   # sort key -> uids of the headings using it
+
+    @staticmethod
+    def _entry(heading):
+        return (heading_sort_key(heading.number), heading.KIND_RANK, heading.uid)
+
+    def add(self, heading):
+        entry = self._entry(heading)
+        insort(self._entries, entry)
+        self._headings[heading.uid] = heading
+        self._by_number.setdefault(entry[0], set()).add(heading.uid)
+
+    def remove(self, heading):
+        entry = self._entry(heading)
+        i = bisect_left(self._entries, entry)
+        if i == len(self._entries) or self._entries[i] != entry:
+            raise KeyError(f"heading {heading.uid} is not in the index")
+        del self._entries[i]
+        del self._headings[heading.uid]
+        uids = self._by_number[entry[0]]
+        uids.discard(heading.uid)
+        if not uids:
+            del self._by_number[entry[0]]
+
+    def __iter__(self):
+        headings = self._headings
+        return (headings[uid] for _, _, uid in self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, uid):
+        """The heading with this uid, or None."""
+        return self._headings.get(uid)
+
+    def duplicates_of(self, heading):
+        """The other headings that use the same (non-blank) number as 'heading'."""
+        key = heading_sort_key(heading.number)
+        if key == BLANK_NUMBER_KEY:
+            return []
+        return [
+            self._headings[uid] for uid in self._by_number.get(key, ())
+            if uid != heading.uid
+        ]
+
+    def duplicate_numbers(self):
+        """Sort keys of all non-blank numbers used by more than one heading."""
+        return [
+            key for key, uids in self._by_number.items()
+            if len(uids) > 1 and key != BLANK_NUMBER_KEY
+        ]
+
+
+class Document:
+    __slots__ = ("meta", "prep", "rawtext_headings", "table_headings",
+                 "heading_index")
+
+    def __init__(self, meta=None, prep=None):
+        self.meta = MetaData() if meta is None else meta
+        self.prep = PreparationMetaData() if prep is None else prep
+        self.rawtext_headings = []
+        self.table_headings = []
+        self.heading_index = HeadingIndex()
+
+    def _attach(self, heading):
+        if heading.uid is None:
+            heading.uid = next(_heading_uids)
+        heading._index = self.heading_index
+        self.heading_index.add(heading)
+        return heading
+
+    def _detach(self, heading):
+        self.heading_index.remove(heading)
+        heading._index = None
+        return heading
+
+    def add_rawtext_heading(self, heading=None):
+        heading = RawTextHeading() if heading is None else heading
+        self.rawtext_headings.append(self._attach(heading))
+        return heading
+
+    def add_table_heading(self, heading=None):
+        heading = TableHeading() if heading is None else heading
+        self.table_headings.append(self._attach(heading))
+        return heading
+
+    def remove_rawtext_heading(self, idx=-1):
+        return self._detach(self.rawtext_headings.pop(idx))
+
+    def remove_table_heading(self, idx=-1):
+        return self._detach(self.table_headings.pop(idx))
+
+    def section(self, key):
+        """
+        The section with this key: "meta", "prep" or a heading key such as
+        ("table", 7). None if the document has no such section.
+        """
+        if key == "meta":
+            return self.meta
+        if key == "prep":
+            return self.prep
+        heading = self.heading_index.get(key[1])
+        return heading if heading is not None and heading.KIND == key[0] else None
+
+    def section_keys(self):
+        keys = ["meta", "prep"]
+        keys += [h.key for h in self.rawtext_headings]
+        keys += [h.key for h in self.table_headings]
+        return keys
+
+    def replace_section(self, key, section):
+        """
+        Puts 'section' in place of the section with this key, keeping its
+        position. A heading that isn't in the document yet is appended, and
+        None removes the heading. Whatever heading holds the key's uid is
+        replaced, even one of the other kind.
+        """
+        if key == "meta":
+            self.meta = section
+            return
+        if key == "prep":
+            self.prep = section
+            return
+        headings = self.rawtext_headings if key[0] == RawTextHeading.KIND else self.table_headings
+        current = self.heading_index.get(key[1])
+        if current is None:
+            if section is not None:
+                headings.append(self._attach(section))
+            return
+        current_headings = (
+            self.rawtext_headings if current.KIND == RawTextHeading.KIND else self.table_headings
+        )
+        # list.index() would compare by value and could pick an equal twin
+        i = next(i for i, h in enumerate(current_headings) if h is current)
+        self._detach(current)
+        if section is None or current_headings is not headings:
+            del current_headings[i]
+            if section is not None:
+                headings.append(self._attach(section))
+        else:
+            headings[i] = self._attach(section)
+
+    def heading_order(self):
+        """The uids of the raw-text headings and of the table headings, in editor order."""
+        return (
+            tuple(h.uid for h in self.rawtext_headings),
+            tuple(h.uid for h in self.table_headings),
+        )
+
+    def reorder_headings(self, rawtext_uids, table_uids):
+        """Puts the headings back in the editor order returned by heading_order()."""
+        get = self.heading_index.get
+        self.rawtext_headings = [get(uid) for uid in rawtext_uids]
+        self.table_headings = [get(uid) for uid in table_uids]
+
+    def share_tables(self):
+        """
+        Marks every table as shared, for a document that is never edited
+        again: its copies then share its tables until they edit them.
+        """
+        for tb in self.table_headings:
+            tb.shared_table = True
+
+    def copy(self):
+        doc = Document(self.meta.copy(), self.prep.copy())
+        for row in self.rawtext_headings:
+            doc.add_rawtext_heading(row.copy())
+        for tb in self.table_headings:
+            doc.add_table_heading(tb.copy())
+        return doc
+
+    def __eq__(self, other):
+        return isinstance(other, Document) and all(
+            getattr(self, name) == getattr(other, name)
+            for name in ("meta", "prep", "rawtext_headings", "table_headings")
+        )
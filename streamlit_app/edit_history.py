@@ -0,0 +1,212 @@
+"""
+Undo/redo for the editor.
+
+The history keeps a frozen copy of every section of the document ("meta",
+"prep" and one per heading key) as it was at the last recorded step. A step
+stores only the sections it changed, as (before, after) pairs of frozen
+copies, plus the heading order when headings were added or removed.
+Unchanged sections are shared by all steps, and so are unchanged table
+columns, so a one-cell edit in a large table stores one column, not the
+document.
+
+The frozen copies are never edited: undo and redo hand the document fresh
+copies of them. Once the copies held only by the history exceed
+'memory_limit' bytes, the oldest steps are dropped.
+"""
+import sys
+from collections import deque
+
+from document_model import TableHeading
+from modality_definition import STRUCTURE_DIRTY
+
+# Rough cap, in bytes, on the section copies kept for undo/redo
+HISTORY_MEMORY_LIMIT = 32 * 1024 * 1024
+
+
+def _freeze(section, previous):
+    """
+    Frozen copy of a live section. Table columns (and row and column ids)
+    equal to those of 'previous' (the section's last frozen copy) are shared
+    with it rather than copied, so editing one cell of a long table stores one
+    column. A shared table (see TableHeading.editable_table()) is not copied
+    at all.
+    """
+    frozen = section.copy()
+    if (isinstance(frozen, TableHeading) and not frozen.shared_table
+            and isinstance(previous, TableHeading)):
+        table, old = frozen.table, previous.table
+        columns = table.columns
+        for c, column in enumerate(old.columns[:len(columns)]):
+            if columns[c] == column:
+                columns[c] = column
+        if table.row_ids == old.row_ids:
+            table.row_ids = old.row_ids
+        if table.column_ids == old.column_ids:
+            table.column_ids = old.column_ids
+    return frozen
+
+
+def _values_size(values, twins=()):
+    """Bytes of the values that aren't the very same objects as their twins."""
+    size = sum(sys.getsizeof(v) for v, w in zip(values, twins) if v is not w)
+    return size + sum(sys.getsizeof(v) for v in values[len(twins):])
+
+
+def _section_size(section, other=None):
+    """
+    Approximate memory held only by the frozen 'section', in bytes, given
+    that 'other' (the same section on the other side of a step) is kept too.
+    Copies share their strings and unchanged columns with the section they
+    were made from, and shared objects are not counted, nor are shared tables.
+    """
+    if section is None:
+        return 0
+    if not isinstance(section, TableHeading):
+        values = []
+        for name in type(section).__slots__:
+            value = getattr(section, name)
+            values += value if isinstance(value, list) else [value]
+        return sys.getsizeof(section) + _values_size(values)
+
+    if section.shared_table:
+        return sys.getsizeof(section) + _values_size([section.number, section.title])
+    table = section.table
+    other_table = other.table if isinstance(other, TableHeading) else None
+    other_columns = other_table.columns if other_table is not None else []
+    size = sys.getsizeof(section) + sys.getsizeof(table) + sys.getsizeof(table.columns)
+    for ids in ("row_ids", "column_ids"):
+        if other_table is None or getattr(table, ids) is not getattr(other_table, ids):
+            size += sys.getsizeof(getattr(table, ids))
+    size += _values_size([section.number, section.title, *(table.headers or ())])
+    for c, column in enumerate(table.columns):
+        twin = other_columns[c] if c < len(other_columns) else []
+        if column is not twin:
+            size += sys.getsizeof(column) + _values_size(column, twin)
+    return size
+
+
+class _Step:
+    __slots__ = ("before", "after", "order_before", "order_after", "before_size", "after_size")
+
+    def __init__(self, before, after, order_before, order_after):
+        self.before = before    # section key -> frozen section, None if it didn't exist
+        self.after = after
+        self.order_before = order_before  # Document.heading_order(), None if unchanged
+        self.order_after = order_after
+        self.before_size = sum(_section_size(before[key], after[key]) for key in before)
+        self.after_size = sum(_section_size(after[key], before[key]) for key in after)
+
+
+class EditHistory:
+    def __init__(self, memory_limit=HISTORY_MEMORY_LIMIT):
+        self.memory_limit = memory_limit
+        self.memory = 0         # bytes held only by the undo/redo steps
+        self._sections = None   # section key -> frozen copy at the current step
+        self._order = None
+        self._undo = deque()
+        self._redo = []
+
+    @property
+    def can_undo(self):
+        return bool(self._undo)
+
+    @property
+    def can_redo(self):
+        return bool(self._redo)
+
+    def __len__(self):
+        return len(self._undo)
+
+    def reset(self, doc):
+        """Forgets all steps and takes 'doc' as the starting point."""
+        self._sections = {key: doc.section(key).copy() for key in doc.section_keys()}
+        self._order = doc.heading_order()
+        self._undo.clear()
+        self._redo.clear()
+        self.memory = 0
+
+    def record(self, doc, dirty):
+        """
+        Records the edits made to 'doc' since the last step as a new step.
+        'dirty' names the sections that may have changed, as for
+        update_build_cache(); with STRUCTURE_DIRTY every section is compared
+        and the heading order is checked. Returns True if a step was added.
+        """
+        if self._sections is None:
+            self.reset(doc)
+            return False
+
+        order_before = order_after = None
+        if STRUCTURE_DIRTY in dirty:
+            keys = set(doc.section_keys()) | self._sections.keys()
+            order = doc.heading_order()
+            if order != self._order:
+                order_before, order_after = self._order, order
+        else:
+            keys = dirty
+
+        before = {}
+        after = {}
+        for key in keys:
+            live = doc.section(key)
+            frozen = self._sections.get(key)
+            if live is None and frozen is None:
+                continue
+            if live is not None and frozen is not None and live == frozen:
+                continue
+            before[key] = frozen
+            after[key] = None if live is None else _freeze(live, frozen)
+        if not before and order_after is None:
+            return False
+
+        for step in self._redo:
+            self.memory -= step.after_size
+        self._redo.clear()
+
+        step = _Step(before, after, order_before, order_after)
+        self._undo.append(step)
+        self.memory += step.before_size
+        self._move_to(after, order_after)
+        while self.memory > self.memory_limit and self._undo:
+            self.memory -= self._undo.popleft().before_size
+        return True
+
+    def _move_to(self, sections, order):
+        for key, frozen in sections.items():
+            if frozen is None:
+                self._sections.pop(key, None)
+            else:
+                self._sections[key] = frozen
+        if order is not None:
+            self._order = order
+
+    def _apply(self, doc, sections, order):
+        """Writes the frozen 'sections' into 'doc' and returns the dirty marks to rebuild."""
+        self._move_to(sections, order)
+        for key, frozen in sections.items():
+            doc.replace_section(key, None if frozen is None else frozen.copy())
+        if order is None:
+            return set(sections)
+        doc.reorder_headings(*order)
+        return set(sections) | {STRUCTURE_DIRTY}
+
+    def undo(self, doc):
+        """
+        Reverts 'doc' to before the last step. Returns the dirty marks for
+        the sections that changed, or None if there is nothing to undo.
+        """
+        if not self._undo:
+            return None
+        step = self._undo.pop()
+        self._redo.append(step)
+        self.memory += step.after_size - step.before_size
+        return self._apply(doc, step.before, step.order_before)
+
+    def redo(self, doc):
+        """Re-applies the last undone step; see undo()."""
+        if not self._redo:
+            return None
+        step = self._redo.pop()
+        self._undo.append(step)
+        self.memory += step.before_size - step.after_size
+        return self._apply(doc, step.after, step.order_after)
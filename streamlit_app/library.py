@@ -0,0 +1,338 @@
+"""
+Full-text search over a folder of definition files.
+
+A DefinitionLibrary keeps an inverted index (term -> {file: weight}) over
+each definition's id, title, acronyms, short description, heading titles
+and markdown content. Terms found in the more specific fields weigh more,
+and results are ranked with BM25.
+
+The index is saved next to the definitions in INDEX_FILE_NAME, with each
+term's postings packed as (file number, weight) uint32 pairs; they are only
+unpacked when a search or an update first touches the term, so opening a
+large library is one JSON read. refresh() only re-reads files whose size or
+modification time changed, and only re-indexes those whose content hash
+changed too. A re-indexed file gets a new file number and the old one is
+skipped until compact() rewrites the postings.
+"""
+import base64
+import hashlib
+import heapq
+import io
+import json
+import math
+import os
+import re
+import sys
+import tempfile
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from pathlib import Path
+
+from modality_definition import iter_json_array_items, parse_document
+
+INDEX_FILE_NAME = ".modality_index.json"
+# Bump when the tokenizer, the field weights or the saved layout change
+INDEX_VERSION = 1
+# Postings are rewritten without removed files once the file numbers in use
+# outnumber the live files by this factor
+COMPACT_RATIO = 1.5
+# How much one occurrence of a term counts, per field
+FIELD_WEIGHTS = {
+    "id": 5,
+    "title": 4,
+    "acronyms": 4,
+    "short_description": 2,
+    "headings": 2,
+    "content": 1,
+}
+# Shorter last words are matched exactly rather than as a prefix
+PREFIX_MIN_LENGTH = 3
+# A prefix matches at most this many terms, the most widely used ones
+PREFIX_MAX_TERMS = 50
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower()) if isinstance(text, str) else []
+
+
+def default_library_dir():
+    """$MODALITY_LIBRARY_DIR if set, otherwise the desktop build's mounted library folder."""
+    configured = os.environ.get("MODALITY_LIBRARY_DIR")
+    if configured:
+        return configured
+    if sys.platform == "emscripten" and os.path.isdir("/mnt/library"):
+        return "/mnt/library"
+    return ""
+
+
+def document_terms(doc):
+    """Weighted term counts of a Document, per FIELD_WEIGHTS."""
+    meta = doc.meta
+    fields = {
+        "id": [meta.id],
+        "title": [meta.title],
+        "acronyms": meta.acronyms,
+        "short_description": [meta.short_description],
+        "headings": [h.title for h in doc.rawtext_headings] + [h.title for h in doc.table_headings],
+        "content": [h.content for h in doc.rawtext_headings],
+    }
+    terms = Counter()
+    for field, texts in fields.items():
+        weight = FIELD_WEIGHTS[field]
+        for text in texts:
+            for term in tokenize(text):
+                terms[term] += weight
+    return terms
+
+
+def _pack(postings):
+    """array('I') of (file number, weight) pairs -> base64 text, little-endian."""
+    if sys.byteorder == "big":
+        postings = array("I", postings)
+        postings.byteswap()
+    return base64.b64encode(postings.tobytes()).decode("ascii")
+
+
+def _unpack(text):
+    postings = array("I", base64.b64decode(text))
+    if sys.byteorder == "big":
+        postings.byteswap()
+    return postings
+
+
+class DefinitionLibrary:
+    def __init__(self, directory, index_path=None):
+        self.directory = Path(directory)
+        self.index_path = Path(index_path) if index_path else self.directory / INDEX_FILE_NAME
+        # Index records by file number; None once the file was re-indexed or removed
+        self.records = []
+        self.errors = {}          # path -> why it couldn't be indexed
+        self._numbers = {}        # path -> file number of its live record
+        # term -> array of (file number, weight) pairs, or its packed text
+        # until the term is first needed
+        self._postings = {}
+        self._vocabulary = None   # sorted terms, for prefix search
+        self._total_length = 0
+        self._load()
+
+    def __len__(self):
+        return len(self._numbers)
+
+    def _load(self):
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        if saved.get("version") != INDEX_VERSION:
+            return
+        self.records = saved["records"]
+        self._postings = saved["postings"]
+        for number, record in enumerate(self.records):
+            if record is not None:
+                self._numbers[record["path"]] = number
+                self._total_length += record["length"]
+
+    def save(self):
+        """Writes the index atomically; a read-only folder just keeps it in memory."""
+        saved = {
+            "version": INDEX_VERSION,
+            "records": self.records,
+            "postings": {
+                term: postings if isinstance(postings, str) else _pack(postings)
+                for term, postings in self._postings.items()
+            },
+        }
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.index_path.parent, suffix=".tmp")
+        except OSError:
+            return False
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(json.dumps(saved, separators=(",", ":")))
+            os.replace(tmp_path, self.index_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return True
+
+    def _posting_array(self, term):
+        postings = self._postings.get(term)
+        if isinstance(postings, str):
+            postings = self._postings[term] = _unpack(postings)
+        return postings
+
+    def record(self, path):
+        """The index record of an indexed file: path, id, title, parents, ..."""
+        return self.records[self._numbers[path]]
+
+    def paths(self):
+        return self._numbers.keys()
+
+    def _add(self, record, terms):
+        number = len(self.records)
+        self.records.append(record)
+        self._numbers[record["path"]] = number
+        self._total_length += record["length"]
+        for term, weight in terms.items():
+            postings = self._posting_array(term)
+            if postings is None:
+                postings = self._postings[term] = array("I")
+                self._vocabulary = None
+            postings.extend((number, weight))
+
+    def _remove(self, path):
+        # The postings keep the old file number until compact() drops it
+        number = self._numbers.pop(path)
+        self._total_length -= self.records[number]["length"]
+        self.records[number] = None
+
+    def compact(self):
+        """Renumbers the live records and drops the postings of removed ones."""
+        renumber = {}
+        records = []
+        for number, record in enumerate(self.records):
+            if record is not None:
+                renumber[number] = len(records)
+                records.append(record)
+        postings_by_term = {}
+        for term in self._postings:
+            postings = self._posting_array(term)
+            kept = array("I")
+            for i in range(0, len(postings), 2):
+                new_number = renumber.get(postings[i])
+                if new_number is not None:
+                    kept.extend((new_number, postings[i + 1]))
+            if kept:
+                postings_by_term[term] = kept
+        self.records = records
+        self._numbers = {record["path"]: number for number, record in enumerate(records)}
+        self._postings = postings_by_term
+        self._vocabulary = None
+
+    def refresh(self):
+        """
+        Brings the index up to date with the *.json files under the folder.
+        Returns the number of files (re)indexed or dropped, and saves the
+        index when that isn't zero.
+        """
+        changed = 0
+        seen = set()
+        self.errors = {}
+        for file_path in sorted(self.directory.rglob("*.json")):
+            if file_path == self.index_path:
+                continue
+            path = file_path.relative_to(self.directory).as_posix()
+            seen.add(path)
+            record = self.record(path) if path in self._numbers else None
+            try:
+                stat = file_path.stat()
+                if record is not None and (record["mtime_ns"], record["size"]) == (stat.st_mtime_ns, stat.st_size):
+                    continue
+                data = file_path.read_bytes()
+                digest = hashlib.sha256(data).hexdigest()
+                if record is not None and record["sha256"] == digest:
+                    # Touched but not changed
+                    record["mtime_ns"], record["size"] = stat.st_mtime_ns, stat.st_size
+                    changed += 1
+                    continue
+                doc = parse_document(iter_json_array_items(io.BytesIO(data)))
+            except Exception as e:
+                self.errors[path] = str(e)
+                if record is not None:
+                    self._remove(path)
+                    changed += 1
+                continue
+            terms = document_terms(doc)
+            new_record = {
+                "path": path,
+                "mtime_ns": stat.st_mtime_ns,
+                "size": stat.st_size,
+                "sha256": digest,
+                "id": doc.meta.id,
+                "title": doc.meta.title,
+                "parents": [p for p in doc.meta.parents if p.strip()],
+                "length": sum(terms.values()),
+            }
+            if record is not None:
+                self._remove(path)
+            self._add(new_record, terms)
+            changed += 1
+
+        for path in self._numbers.keys() - seen:
+            self._remove(path)
+            changed += 1
+        if changed:
+            if len(self.records) > len(self._numbers) * COMPACT_RATIO:
+                self.compact()
+            self.save()
+        return changed
+
+    def _posting_count(self, term):
+        """Number of (file, weight) pairs of a term, without unpacking it."""
+        postings = self._postings[term]
+        if isinstance(postings, str):
+            return len(postings) * 3 // 32
+        return len(postings) // 2
+
+    def _expand(self, prefix):
+        """The indexed terms starting with 'prefix', at most PREFIX_MAX_TERMS of them."""
+        if self._vocabulary is None:
+            self._vocabulary = sorted(self._postings)
+        vocabulary = self._vocabulary
+        i = bisect_left(vocabulary, prefix)
+        matches = []
+        while i < len(vocabulary) and vocabulary[i].startswith(prefix):
+            matches.append(vocabulary[i])
+            i += 1
+        if len(matches) > PREFIX_MAX_TERMS:
+            matches = heapq.nlargest(PREFIX_MAX_TERMS, matches, key=self._posting_count)
+        return matches
+
+    def search(self, query, limit=20):
+        """
+        Ranks the indexed files against 'query' with BM25. The last word of
+        the query also matches as a prefix (from PREFIX_MIN_LENGTH characters
+        on), so results show up while typing.
+        Returns up to 'limit' (score, path, record) tuples, best first.
+        """
+        words = tokenize(query)
+        file_count = len(self._numbers)
+        if not words or not file_count:
+            return []
+        records = self.records
+        average_length = self._total_length / file_count or 1
+
+        scores = Counter()
+        for i, word in enumerate(words):
+            if i == len(words) - 1 and len(word) >= PREFIX_MIN_LENGTH:
+                terms = self._expand(word)
+            else:
+                terms = [word]
+            for term in terms:
+                postings = self._posting_array(term)
+                if not postings:
+                    continue
+                live = [
+                    (number, weight)
+                    for number, weight in zip(postings[::2], postings[1::2])
+                    if records[number] is not None
+                ]
+                idf = math.log(1 + (file_count - len(live) + 0.5) / (len(live) + 0.5))
+                for number, weight in live:
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * records[number]["length"] / average_length)
+                    scores[number] += idf * weight * (BM25_K1 + 1) / (weight + norm)
+
+        best = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+        return [(score, records[number]["path"], records[number]) for number, score in best]
+
+    def read_bytes(self, path):
+        """The raw bytes of an indexed file."""
+        with open(self.directory / path, "rb") as f:
+            return f.read()
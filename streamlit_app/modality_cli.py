@@ -0,0 +1,157 @@
+"""
+Batch validation and normalization of modality definition files, without
+Streamlit.
+
+    python modality_cli.py DIRECTORY [--check] [--strict] [--workers N] [--recursive]
+                                     [--archive {msgpack,columnar}]
+
+Every *.json file is parsed, normalized (blank rows and parents/acronyms
+dropped, headings in number order) and written back in the editor's output
+format when that changes it. With --check nothing is written and files that
+would change are reported instead. With --archive the normalized definition
+is also written next to each file in that binary format (see
+definition_archive).
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from definition_archive import ARCHIVE_EXTENSIONS, ARCHIVE_FORMATS, encode_archive
+from library import INDEX_FILE_NAME
+from modality_definition import (
+    build_entries,
+    iter_json_array_items,
+    iter_json_chunks,
+    normalize_document,
+    parse_document,
+    validate_document,
+    write_json_export,
+)
+
+
+def write_atomically(path, data):
+    """Writes next to 'path' and swaps the files, so a crash never truncates it."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def process_file(path, check=False, strict=False, archive=None):
+    """
+    Loads, validates and normalizes one definition file, and with 'archive'
+    (one of ARCHIVE_FORMATS) writes it in that format next to it. Returns a
+    result dict with "path", "status" ("ok", "rewritten", "would rewrite" or
+    "error"), "bytes", "problems" and "error".
+    """
+    result = {"path": str(path), "status": "ok", "bytes": 0, "problems": [], "error": None}
+    try:
+        with open(path, "rb") as f:
+            original = f.read()
+        result["bytes"] = len(original)
+        # A missing date stays empty, so checking a file gives the same result every day
+        doc = parse_document(iter_json_array_items(io.BytesIO(original)), date_of_preparation="")
+        normalize_document(doc)
+        result["problems"] = validate_document(doc)
+        if strict and result["problems"]:
+            result["status"] = "error"
+            result["error"] = "; ".join(result["problems"])
+            return result
+
+        cache = build_entries(doc)
+        if archive is not None and not check:
+            write_atomically(
+                Path(path).with_suffix(ARCHIVE_EXTENSIONS[archive]),
+                encode_archive(cache["entries"], archive),
+            )
+        normalized = write_json_export(iter_json_chunks(cache))
+        if normalized == original:
+            return result
+        if check:
+            result["status"] = "would rewrite"
+            return result
+
+        write_atomically(path, normalized)
+        result["status"] = "rewritten"
+    except Exception as e:
+        result["status"] = "error"
+        result["error"] = str(e)
+    return result
+
+
+def find_definition_files(directory, recursive=False):
+    pattern = "**/*.json" if recursive else "*.json"
+    return sorted(
+        p for p in Path(directory).glob(pattern)
+        if p.is_file() and p.name != INDEX_FILE_NAME
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Validate and normalize a directory of modality definition JSON files."
+    )
+    parser.add_argument("directory", help="directory containing *.json definitions")
+    parser.add_argument("--check", action="store_true",
+                        help="don't write anything, exit 1 if any file would change")
+    parser.add_argument("--strict", action="store_true",
+                        help="treat validation problems as errors")
+    parser.add_argument("--recursive", action="store_true",
+                        help="also process subdirectories")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker processes (default: CPU count)")
+    parser.add_argument("--archive", choices=ARCHIVE_FORMATS,
+                        help="also write each definition in this binary format")
+    args = parser.parse_args(argv)
+
+    paths = find_definition_files(args.directory, args.recursive)
+    if not paths:
+        print(f"No *.json files found in {args.directory}", file=sys.stderr)
+        return 0
+
+    start = time.perf_counter()
+    counts = {"ok": 0, "rewritten": 0, "would rewrite": 0, "error": 0}
+    total_bytes = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        results = pool.map(
+            process_file,
+            paths,
+            [args.check] * len(paths),
+            [args.strict] * len(paths),
+            [args.archive] * len(paths),
+            chunksize=max(1, len(paths) // (4 * (args.workers or os.cpu_count() or 1))),
+        )
+        for result in results:
+            counts[result["status"]] += 1
+            total_bytes += result["bytes"]
+            if result["status"] == "error":
+                print(f"error: {result['path']}: {result['error']}", file=sys.stderr)
+                continue
+            for problem in result["problems"]:
+                print(f"warning: {result['path']}: {problem}", file=sys.stderr)
+            if result["status"] != "ok":
+                print(f"{result['status']}: {result['path']}")
+    elapsed = time.perf_counter() - start
+
+    print(
+        f"{len(paths)} files in {elapsed:.2f}s "
+        f"({len(paths) / elapsed:.1f} files/s, {total_bytes / elapsed / 1e6:.2f} MB/s): "
+        f"{counts['ok']} unchanged, {counts['rewritten']} rewritten, "
+        f"{counts['would rewrite']} would rewrite, {counts['error']} errors"
+    )
+    if counts["error"] or (args.check and counts["would rewrite"]):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,386 @@
+"""
+Reading, building and writing medical modality definition files.
+
+Nothing in here depends on Streamlit: documents are document_model.Document
+objects (held in st.session_state by the app, in a plain variable by the
+batch CLI).
+"""
+import codecs
+import gzip
+import io
+import json
+import re
+
+from document_model import (
+    Document,
+    PreparationMetaData,
+    RawTextHeading,
+    Table,
+    TableHeading,
+    heading_sort_key,
+)
+
+# Bytes read from a file at a time by the streaming parser
+STREAM_CHUNK_SIZE = 64 * 1024
+# Dirty marker meaning headings were added or removed; a section replaced by
+# another under the same key must be marked dirty by its key as well
+STRUCTURE_DIRTY = "*"
+# Heading numbers look like "1", "1.2", "1.2.3"
+HEADING_NUMBER_RE = re.compile(r"\d+(\.\d+)*")
+
+###############################################################################
+# PARSE
+###############################################################################
+
+class DefinitionParseError(ValueError):
+    """
+    Raised when an item of a definition file can't be read or applied.
+    'index' is the item's position in the top-level array and 'offset' the
+    character offset where it starts (None when parsing an in-memory list).
+    """
+    def __init__(self, message, index=None, offset=None):
+        location = []
+        if index is not None:
+            location.append(f"item {index}")
+        if offset is not None:
+            location.append(f"offset {offset}")
+        if location:
+            message = f"{', '.join(location)}: {message}"
+        super().__init__(message)
+        self.index = index
+        self.offset = offset
+
+def iter_json_array_items(stream, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Reads a top-level JSON array from a binary 'stream' and yields
+    (index, offset, item) for each element as soon as it is complete. Only the
+    element being decoded is buffered, so memory is bounded by the largest
+    single item rather than by the file size.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    buf = ""
+    base = 0  # stream offset of buf[0]
+    eof = False
+
+    def fill(size):
+        nonlocal buf, eof
+        chunk = stream.read(size)
+        if not chunk:
+            eof = True
+            buf += text_decoder.decode(b"", final=True)
+        else:
+            buf += text_decoder.decode(chunk)
+
+    def next_non_ws(pos):
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\n\r":
+                pos += 1
+            if pos < len(buf):
+                return pos
+            if eof:
+                return None
+            fill(chunk_size)
+
+    pos = next_non_ws(0)
+    if pos is None or buf[pos] != "[":
+        raise DefinitionParseError("expected a JSON array", offset=base + (pos or 0))
+    pos = next_non_ws(pos + 1)
+    if pos is not None and buf[pos] == "]":
+        trailing = next_non_ws(pos + 1)
+        if trailing is not None:
+            raise DefinitionParseError("extra data after the array", offset=base + trailing)
+        return
+
+    index = 0
+    read_size = chunk_size
+    while True:
+        if pos is None:
+            raise DefinitionParseError("unterminated array", index=index, offset=base + len(buf))
+        try:
+            item, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError as e:
+            if eof:
+                raise DefinitionParseError(e.msg, index=index, offset=base + e.pos) from None
+            # Incomplete item: read more, doubling so huge items stay linear
+            fill(read_size)
+            read_size *= 2
+            continue
+        if not eof and (end >= len(buf) or buf[end] not in " \t\n\r,]"):
+            # A number cut by the buffer (e.g. "1." of "1.5") decodes early,
+            # so only trust an item once the character after it is visible
+            fill(read_size)
+            continue
+
+        yield index, base + pos, item
+        index += 1
+        read_size = chunk_size
+        base += end
+        buf = buf[end:]
+
+        pos = next_non_ws(0)
+        if pos is None:
+            raise DefinitionParseError("unterminated array", index=index, offset=base + len(buf))
+        if buf[pos] == "]":
+            trailing = next_non_ws(pos + 1)
+            if trailing is not None:
+                raise DefinitionParseError("extra data after the array", offset=base + trailing)
+            return
+        if buf[pos] != ",":
+            raise DefinitionParseError("expected ',' or ']'", index=index, offset=base + pos)
+        pos = next_non_ws(pos + 1)
+
+def _set_meta(field, as_list=False):
+    def handler(doc, item):
+        content = item.get("content", "")
+        if as_list:
+            content = content if isinstance(content, list) else []
+        setattr(doc.meta, field, content)
+    return handler
+
+def _set_prep(field):
+    def handler(doc, item):
+        setattr(doc.prep, field, item.get("content", ""))
+    return handler
+
+def _add_table_heading(doc, item):
+    # expecting a list of lists, where row 0 = column headers
+    doc.add_table_heading(TableHeading(
+        item.get("level", ""),
+        item.get("title", ""),
+        Table.from_rows(item.get("content", ""))
+    ))
+
+def _add_rawtext_heading(doc, item):
+    # data type info row
+    doc.add_rawtext_heading(RawTextHeading(
+        item.get("level", ""), item.get("title", ""), item.get("content", "")
+    ))
+
+# (level, content-type) -> handler; a content-type of None matches any type
+ITEM_HANDLERS = {
+    # meta-data
+    ("meta-data-id", None): _set_meta("id"),
+    ("meta-data-parents", "list_of_strings"): _set_meta("parents", as_list=True),
+    ("meta-data-title", None): _set_meta("title"),
+    ("meta-data-acronyms", "list_of_strings"): _set_meta("acronyms", as_list=True),
+    ("meta-data-shortDescription", None): _set_meta("short_description"),
+    # prep meta-data
+    ("prepration-meta-data-prepared_by", None): _set_prep("prepared_by"),
+    ("prepration-meta-data-confirmed_by", None): _set_prep("confirmed_by"),
+    ("prepration-meta-data-date_of_preparation", None): _set_prep("date_of_preparation"),
+    ("prepration-meta-data-planned_next_review", None): _set_prep("planned_next_review"),
+    ("prepration-meta-data-requires_completion", None): _set_prep("requires_completion"),
+}
+# Any other level is a heading, handled by content-type.
+# Older formats or unrecognized content types are ignored.
+HEADING_HANDLERS = {
+    "table": _add_table_heading,
+    "markdown": _add_rawtext_heading,
+}
+
+def parse_document(items, date_of_preparation=None):
+    """
+    Builds a Document from 'items', an iterable of (index, offset, item) as
+    produced by iter_json_array_items(). A file without a date of preparation
+    gets 'date_of_preparation', by default today's date as in the editor.
+    """
+    doc = Document(prep=PreparationMetaData(date_of_preparation=date_of_preparation))
+
+    for index, offset, item in items:
+        try:
+            level = item.get("level", "")
+            ctype = item.get("content-type", "")
+            handler = (
+                ITEM_HANDLERS.get((level, ctype))
+                or ITEM_HANDLERS.get((level, None))
+                or HEADING_HANDLERS.get(ctype)
+            )
+            if handler is not None:
+                handler(doc, item)
+        except Exception as e:
+            raise DefinitionParseError(str(e), index=index, offset=offset) from e
+
+    # Cleanup empty strings
+    doc.meta.parents = [p for p in doc.meta.parents if p.strip()] or [""]
+    doc.meta.acronyms = [a for a in doc.meta.acronyms if a.strip()] or ["", "", "", ""]
+    return doc
+
+def document_from_json(json_data):
+    """Builds a Document from an already decoded definition (a list of entries)."""
+    return parse_document((i, None, item) for i, item in enumerate(json_data))
+
+###############################################################################
+# BUILD & EXPORT
+###############################################################################
+
+def json_fragment(entry):
+    # The exact text json.dumps(final_list, indent=4) emits for one list element
+    return "    " + json.dumps(entry, indent=4).replace("\n", "\n    ")
+
+def new_build_cache():
+    return {
+        "sections": {},  # section -> {"entries", "fragments", "level"}
+        "order": None,   # heading sections in output order
+        "entries": None,
+    }
+
+def copy_build_cache(cache):
+    """
+    A build cache for a copy of the document 'cache' was built from. The
+    built sections are shared, not copied: update_build_cache replaces a
+    section when rebuilding it and never changes one in place.
+    """
+    return {
+        "sections": dict(cache["sections"]),
+        "order": None if cache["order"] is None else list(cache["order"]),
+        "entries": cache["entries"],
+    }
+
+def update_build_cache(doc, cache, dirty):
+    """
+    Brings 'cache' up to date with the Document 'doc'. Only the sections
+    named in 'dirty' are rebuilt and re-serialized; everything else reuses the
+    entries and JSON text from the previous build. With STRUCTURE_DIRTY the
+    sections of added headings are built and those of removed headings
+    dropped, but no other section is rebuilt. Heading order is re-read from
+    the document's HeadingIndex only when a heading number changed or
+    sections were added/removed.
+    """
+    if not dirty and cache["entries"] is not None:
+        return
+
+    sections = cache["sections"]
+    reorder = STRUCTURE_DIRTY in dirty or cache["entries"] is None
+    if cache["entries"] is None:
+        sections.clear()
+    elif STRUCTURE_DIRTY in dirty:
+        for key in sections.keys() - set(doc.section_keys()):
+            del sections[key]
+
+    sources = [("meta", doc.meta), ("prep", doc.prep)]
+    sources += [(h.key, h) for h in doc.rawtext_headings]
+    sources += [(h.key, h) for h in doc.table_headings]
+    for key, section in sources:
+        if key in sections and key not in dirty:
+            continue
+        entries = section.to_entries()
+        # Only a heading's level (its number) or disappearing from the output moves it
+        level = entries[0]["level"] if entries else None
+        previous = sections.get(key)
+        if previous is None or previous["level"] != level:
+            reorder = True
+        sections[key] = {
+            "entries": entries,
+            "fragments": [json_fragment(e) for e in entries],
+            "level": level,
+        }
+
+    if reorder or cache["order"] is None:
+        cache["order"] = [h.key for h in doc.heading_index if sections[h.key]["entries"]]
+
+    ordered = ["meta"] + cache["order"] + ["prep"]
+    cache["entries"] = [e for key in ordered for e in sections[key]["entries"]]
+
+def iter_json_chunks(cache, compact=False):
+    """
+    Yields the built document from an up-to-date 'cache' as JSON text, one
+    entry at a time, without materializing the whole string. The pretty form
+    is byte-identical to json.dumps(entries, indent=4); the compact form has
+    no indentation or whitespace between tokens.
+    """
+    if compact:
+        yield "["
+        for i, entry in enumerate(cache["entries"]):
+            yield ("," if i else "") + json.dumps(entry, separators=(",", ":"))
+        yield "]"
+        return
+
+    sections = cache["sections"]
+    yield "[\n"
+    first = True
+    for key in ["meta"] + cache["order"] + ["prep"]:
+        for fragment in sections[key]["fragments"]:
+            yield fragment if first else ",\n" + fragment
+            first = False
+    yield "\n]"
+
+def write_json_export(chunks, compress=False):
+    """
+    Encodes JSON text chunks straight into a bytes buffer, gzip-compressing
+    them on the way in when 'compress' is set. Returns the buffer's bytes.
+    """
+    buffer = io.BytesIO()
+    if compress:
+        # mtime=0 keeps identical documents byte-identical once compressed
+        with gzip.GzipFile(fileobj=buffer, mode="wb", mtime=0) as gz:
+            for chunk in chunks:
+                gz.write(chunk.encode("utf-8"))
+    else:
+        for chunk in chunks:
+            buffer.write(chunk.encode("utf-8"))
+    return buffer.getvalue()
+
+def build_entries(doc):
+    """
+    One-off build of the Document 'doc' into its list of JSON entries.
+    Returns the (up-to-date) build cache, ready for iter_json_chunks().
+    """
+    cache = new_build_cache()
+    update_build_cache(doc, cache, {STRUCTURE_DIRTY})
+    return cache
+
+###############################################################################
+# NORMALIZE & VALIDATE
+###############################################################################
+
+def _is_blank(value):
+    return isinstance(value, str) and value.strip() == ""
+
+def normalize_document(doc):
+    """
+    Cleans up a parsed Document in place: drops fully blank raw-text rows and
+    fully blank table data rows, and removes blank parents/acronyms (keeping
+    the editor's placeholder entries when nothing is left). Heading order is
+    normalized by the build itself.
+    """
+    for i in reversed(range(len(doc.rawtext_headings))):
+        if doc.rawtext_headings[i].is_blank():
+            doc.remove_rawtext_heading(i)
+    for tb in doc.table_headings:
+        table = tb.table
+        keep = [
+            r for r in range(table.row_count)
+            if not all(_is_blank(column[r]) for column in table.columns)
+        ]
+        if len(keep) < table.row_count:
+            tb.editable_table().keep_rows(keep)
+    meta = doc.meta
+    meta.parents = [p for p in meta.parents if not _is_blank(p)] or [""]
+    meta.acronyms = [a for a in meta.acronyms if not _is_blank(a)] or ["", "", "", ""]
+
+def validate_document(doc):
+    """
+    Returns a list of human-readable problems with the Document 'doc'.
+    An empty list means the document is valid.
+    """
+    problems = []
+    meta = doc.meta
+    if not isinstance(meta.id, str) or not meta.id.strip():
+        problems.append("meta-data id is empty")
+    elif meta.id != meta.id.lower():
+        problems.append(f"meta-data id {meta.id!r} is not lowercase")
+
+    for heading in doc.heading_index:
+        kind = "table heading" if heading.KIND == "table" else "raw-text heading"
+        number = heading.number
+        if not isinstance(number, str) or not HEADING_NUMBER_RE.fullmatch(number.strip()):
+            problems.append(f"{kind} number {number!r} is not of the form 1 or 1.2")
+    for key in doc.heading_index.duplicate_numbers():
+        numbers = sorted({h.number for h in doc.heading_index if heading_sort_key(h.number) == key})
+        problems.append(f"heading number {' / '.join(map(repr, numbers))} is used more than once")
+
+    for tb in doc.table_headings:
+        if tb.table.headers is None:
+            problems.append(f"table {tb.number!r} has no header row")
+    return problems
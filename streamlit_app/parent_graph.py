@@ -0,0 +1,290 @@
+"""
+The parent hierarchy of a corpus of definitions.
+
+Each definition names its parents by id in "meta-data-parents". A
+ParentGraph resolves those ids, reports parents that no definition has
+(dangling) and groups of definitions that are their own ancestors
+(cycles), and keeps the transitive closure of the hierarchy as bitsets:
+every id gets a bit number, and each node stores its ancestors and its
+descendants as one int. "Is A an ancestor of B" is then a single bit test,
+and listing all ancestors or descendants costs only the size of the answer.
+
+Changing one definition's parents only recomputes the ancestors of that
+definition and of its descendants. Changes that make or break a cycle
+rebuild the closure from scratch.
+"""
+
+
+def _bits(mask):
+    """Positions of the set bits of 'mask', lowest first."""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class ParentGraph:
+    def __init__(self):
+        self._ids = []          # bit number -> id
+        self._bits = {}         # id -> bit number
+        self._parents = []      # bit number -> set of parent bit numbers
+        self._defined = {}      # id -> paths of the files that define it
+        self._ancestors = []    # bit number -> bitset
+        self._descendants = []  # bit number -> bitset
+        self._cyclic = 0        # bitset of the nodes that are their own ancestor
+        self._sources = {}      # path -> (id, parents) last synced from a library
+
+    @classmethod
+    def from_library(cls, library):
+        graph = cls()
+        graph.sync(library, rebuild=True)
+        return graph
+
+    def _node(self, id):
+        bit = self._bits.get(id)
+        if bit is None:
+            bit = self._bits[id] = len(self._ids)
+            self._ids.append(id)
+            self._parents.append(set())
+            self._ancestors.append(0)
+            self._descendants.append(0)
+        return bit
+
+    def _ids_of(self, mask):
+        ids = self._ids
+        return [ids[bit] for bit in _bits(mask)]
+
+    ###########################################################################
+    # Queries
+    ###########################################################################
+
+    def __contains__(self, id):
+        """True if a definition with this id exists."""
+        return bool(self._defined.get(id))
+
+    def ancestors(self, id):
+        bit = self._bits.get(id)
+        return [] if bit is None else self._ids_of(self._ancestors[bit] & ~(1 << bit))
+
+    def descendants(self, id):
+        bit = self._bits.get(id)
+        return [] if bit is None else self._ids_of(self._descendants[bit] & ~(1 << bit))
+
+    def is_ancestor(self, ancestor, id):
+        a = self._bits.get(ancestor)
+        b = self._bits.get(id)
+        return a is not None and b is not None and a != b and bool(self._ancestors[b] >> a & 1)
+
+    def dangling(self):
+        """{id: parents that no definition has} for every definition with such parents."""
+        result = {}
+        for id, paths in self._defined.items():
+            if paths:
+                missing = [
+                    self._ids[p] for p in self._parents[self._bits[id]]
+                    if self._ids[p] not in self
+                ]
+                if missing:
+                    result[id] = sorted(missing)
+        return result
+
+    def cycles(self):
+        """Groups of ids that are each other's ancestors, each group sorted."""
+        groups = []
+        remaining = self._cyclic
+        while remaining:
+            bit = next(_bits(remaining))
+            # A cyclic node's strongly connected group is ancestors & descendants
+            group = self._ancestors[bit] & self._descendants[bit]
+            groups.append(sorted(self._ids_of(group)))
+            remaining &= ~group
+        return groups
+
+    def duplicates(self):
+        """{id: paths} for ids defined by more than one file."""
+        return {id: sorted(paths) for id, paths in self._defined.items() if len(paths) > 1}
+
+    def check_parents(self, id, parents):
+        """
+        Problems with giving definition 'id' these 'parents', as messages,
+        without changing the graph. Each parent is checked with a bit test.
+        """
+        problems = []
+        seen = set()
+        for parent in parents:
+            parent = parent.strip()
+            if not parent:
+                continue
+            if parent in seen:
+                problems.append(f"'{parent}' is listed twice")
+            seen.add(parent)
+            if parent == id:
+                problems.append(f"'{parent}' is this definition itself")
+            elif parent not in self:
+                problems.append(f"'{parent}' is not a known definition id")
+            elif id and self.is_ancestor(id, parent):
+                problems.append(f"'{parent}' descends from '{id}', this would make a cycle")
+        return problems
+
+    ###########################################################################
+    # Updates
+    ###########################################################################
+
+    def sync(self, library, rebuild=False):
+        """
+        Applies the definitions of a DefinitionLibrary that changed since the
+        last sync. Returns the number of files whose id or parents changed.
+        """
+        sources = {}
+        for path in library.paths():
+            record = library.record(path)
+            sources[path] = (record["id"], tuple(record["parents"]))
+        changed = 0
+        changed_ids = set()
+        for path in self._sources.keys() | sources.keys():
+            old = self._sources.get(path)
+            new = sources.get(path)
+            if old == new:
+                continue
+            changed += 1
+            if old is not None:
+                self._defined[old[0]].discard(path)
+                changed_ids.add(old[0])
+            if new is not None:
+                self._node(new[0])
+                self._defined.setdefault(new[0], set()).add(path)
+                changed_ids.add(new[0])
+        self._sources = sources
+
+        # A definition's parents are those of all files with its id
+        parents_of = {}
+        for id, parents in sources.values():
+            if id in changed_ids:
+                parents_of.setdefault(id, set()).update(p for p in parents if p.strip())
+        if rebuild:
+            for id in changed_ids:
+                self._parents[self._bits[id]] = {self._node(p) for p in parents_of.get(id, ())}
+            self._rebuild()
+        else:
+            for id in changed_ids:
+                self.set_parents(id, parents_of.get(id, ()))
+        return changed
+
+    def set_parents(self, id, parents):
+        """Gives node 'id' these parents, updating the closure."""
+        bit = self._node(id)
+        new_parents = {self._node(p) for p in parents}
+        if new_parents == self._parents[bit]:
+            return
+
+        affected = self._descendants[bit] | (1 << bit)
+        makes_cycle = any(affected >> p & 1 for p in new_parents)
+        self._parents[bit] = new_parents
+        if makes_cycle or affected & self._cyclic:
+            self._rebuild()
+            return
+
+        # Only 'id' and its descendants can reach the changed edges; they form
+        # a DAG, so their ancestors are recomputed parents first
+        old_ancestors = {x: self._ancestors[x] for x in _bits(affected)}
+        for x in self._topological(affected):
+            mask = 0
+            for p in self._parents[x]:
+                mask |= self._ancestors[p] | (1 << p)
+            self._ancestors[x] = mask
+        for x, old in old_ancestors.items():
+            new = self._ancestors[x]
+            for y in _bits(old & ~new):
+                self._descendants[y] &= ~(1 << x)
+            for y in _bits(new & ~old):
+                self._descendants[y] |= 1 << x
+
+    def _topological(self, nodes):
+        """The bits of 'nodes' (an acyclic bitset) with every node after its parents in it."""
+        order = []
+        visited = 0
+        for start in _bits(nodes):
+            if visited >> start & 1:
+                continue
+            visited |= 1 << start
+            stack = [(start, iter(self._parents[start]))]
+            while stack:
+                node, parents = stack[-1]
+                for p in parents:
+                    if nodes >> p & 1 and not visited >> p & 1:
+                        visited |= 1 << p
+                        stack.append((p, iter(self._parents[p])))
+                        break
+                else:
+                    stack.pop()
+                    order.append(node)
+        return order
+
+    def _rebuild(self):
+        """Recomputes the whole closure: Tarjan's strongly connected components,
+        visited parents first, so each component's ancestors are known when
+        its children's are computed."""
+        count = len(self._ids)
+        ancestors = [0] * count
+        descendants = [0] * count
+        cyclic = 0
+
+        index = [None] * count
+        low = [0] * count
+        on_stack = [False] * count
+        component_stack = []
+        next_index = 0
+        for root in range(count):
+            if index[root] is not None:
+                continue
+            index[root] = low[root] = next_index
+            next_index += 1
+            component_stack.append(root)
+            on_stack[root] = True
+            work = [(root, iter(self._parents[root]))]
+            while work:
+                node, parents = work[-1]
+                for p in parents:
+                    if index[p] is None:
+                        index[p] = low[p] = next_index
+                        next_index += 1
+                        component_stack.append(p)
+                        on_stack[p] = True
+                        work.append((p, iter(self._parents[p])))
+                        break
+                    if on_stack[p]:
+                        low[node] = min(low[node], index[p])
+                else:
+                    work.pop()
+                    if work:
+                        parent_node = work[-1][0]
+                        low[parent_node] = min(low[parent_node], low[node])
+                    if low[node] != index[node]:
+                        continue
+                    # 'node' roots a component, and all its parents' components are done
+                    members = []
+                    while True:
+                        member = component_stack.pop()
+                        on_stack[member] = False
+                        members.append(member)
+                        if member == node:
+                            break
+                    member_mask = 0
+                    for member in members:
+                        member_mask |= 1 << member
+                    mask = 0
+                    for member in members:
+                        for p in self._parents[member]:
+                            mask |= ancestors[p] | (1 << p)
+                    if len(members) > 1 or mask & member_mask:
+                        cyclic |= member_mask
+                        mask |= member_mask
+                    for member in members:
+                        ancestors[member] = mask
+
+        for x in range(count):
+            for y in _bits(ancestors[x]):
+                descendants[y] |= 1 << x
+        self._ancestors = ancestors
+        self._descendants = descendants
+        self._cyclic = cyclic
@@ -0,0 +1,144 @@
+"""
+Timing of the editor's reruns, section by section.
+
+A RerunProfiler records nested spans (a section, a fragment, a callback)
+with their duration and the number of widgets created inside them. Spans
+are grouped into runs: a run ends when a root span (the whole script, or a
+fragment rerunning on its own) closes at the top level, and callback spans
+recorded before it belong to the same run. The last PROFILE_HISTORY runs
+are kept for rolling percentiles and can be exported in the Chrome
+trace-event format (chrome://tracing, Perfetto).
+
+While the profiler is disabled span() returns a shared no-op context, so
+instrumented code costs one attribute check.
+"""
+import contextlib
+import time
+from collections import deque
+
+# Runs kept for the percentiles and the trace
+PROFILE_HISTORY = 200
+PERCENTILES = (50, 90, 99)
+
+_NULL_SPAN = contextlib.nullcontext()
+
+
+def _percentile(sorted_values, percent):
+    """Nearest-rank percentile of an already sorted list."""
+    rank = max(1, -(-len(sorted_values) * percent // 100))
+    return sorted_values[rank - 1]
+
+
+class _Span:
+    __slots__ = ("profiler", "name", "category", "root", "start", "widgets")
+
+    def __init__(self, profiler, name, category, root):
+        self.profiler = profiler
+        self.name = name
+        self.category = category
+        self.root = root
+
+    def __enter__(self):
+        profiler = self.profiler
+        if profiler._run is None:
+            profiler._run = []
+        profiler._depth += 1
+        self.widgets = profiler._count_widgets()
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        profiler = self.profiler
+        profiler._depth -= 1
+        profiler._run.append((
+            self.name,
+            self.category,
+            self.start,
+            end - self.start,
+            profiler._count_widgets() - self.widgets,
+            profiler._depth,
+        ))
+        if self.root and profiler._depth == 0:
+            profiler.runs.append(profiler._run)
+            profiler._run = None
+        return False
+
+
+class RerunProfiler:
+    def __init__(self, widget_counter=None, history=PROFILE_HISTORY):
+        self.enabled = False
+        # Runs, each a list of (name, category, start ns, duration ns, widgets, depth)
+        self.runs = deque(maxlen=history)
+        self._run = None
+        self._depth = 0
+        # Returns the number of widgets created so far in this run, or None
+        self.widget_counter = widget_counter
+        self._origin = time.perf_counter_ns()
+
+    def _count_widgets(self):
+        count = self.widget_counter() if self.widget_counter is not None else None
+        return count or 0
+
+    def set_enabled(self, enabled):
+        self.enabled = enabled
+        if not enabled:
+            # Spans recorded before a run's root span belong to no run now
+            self._run = None
+            self._depth = 0
+
+    def span(self, name, category="section", root=False):
+        """Context manager timing 'name'; 'root' spans end the run when they close."""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, category, root)
+
+    def clear(self):
+        self.runs.clear()
+
+    def stats(self):
+        """
+        Per span name over the kept runs: the runs it appears in, percentiles
+        of its total time per run in milliseconds and the widgets it created
+        in the latest of them, slowest first.
+        """
+        durations = {}
+        widgets = {}
+        categories = {}
+        for run in self.runs:
+            per_run = {}
+            for name, category, _, duration, created, _ in run:
+                per_run[name] = per_run.get(name, 0) + duration
+                widgets[name] = created
+                categories[name] = category
+            for name, duration in per_run.items():
+                durations.setdefault(name, []).append(duration)
+
+        rows = []
+        for name, values in durations.items():
+            values.sort()
+            row = {"span": name, "kind": categories[name], "runs": len(values)}
+            for percent in PERCENTILES:
+                row[f"p{percent} ms"] = _percentile(values, percent) / 1e6
+            row["widgets"] = widgets[name]
+            rows.append(row)
+        rows.sort(key=lambda row: row[f"p{PERCENTILES[1]} ms"], reverse=True)
+        return rows
+
+    def chrome_trace(self):
+        """The kept runs as a Chrome trace-event JSON object."""
+        events = []
+        for name, category, start, duration, created, depth in (
+            span for run in self.runs for span in run
+        ):
+            events.append({
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": (start - self._origin) / 1000,
+                "dur": duration / 1000,
+                "pid": 1,
+                "tid": 1,
+                "args": {"widgets": created, "depth": depth},
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
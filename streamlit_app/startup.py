@@ -0,0 +1,96 @@
+"""
+Startup profile of the app: where the time goes between the start of the
+runtime and the first render of the editor.
+
+The phases are measured once per process, over the first script run:
+
+* runtime start: in the desktop build only, from the start of stlite's
+  worker to the first line of the script, i.e. the Pyodide boot and the
+  loading of the packages. With `streamlit run` the server may wait any
+  length of time for its first session, so the profile starts with the
+  first script run instead and has no runtime start.
+* package imports: the third-party imports at the top of the script.
+* app import: the app's own modules and the rest of the script's top level.
+* first editor render: main() up to the end of the first page.
+* deferred loading: the modules that the first screen doesn't need
+  (DEFERRED_MODULES), which the script imports only where they are used and
+  which are loaded here once that page has been sent.
+
+The script imports this module before anything else. With
+MODALITY_PROFILE_STARTUP=1 the profile is printed as one JSON line when it
+is complete (in the desktop build, to the developer tools console); the
+sidebar's Profiling panel always shows it. Nothing in here depends on
+Streamlit.
+"""
+import importlib
+import json
+import os
+import sys
+import time
+
+# Modules kept off the first screen: pandas alone takes longer to import than
+# the rest of the app together
+DEFERRED_MODULES = ("pandas", "table_import")
+PROFILE_STARTUP_ENV = "MODALITY_PROFILE_STARTUP"
+
+
+def runtime_age():
+    """Seconds since Pyodide's worker started, None outside the desktop build."""
+    if sys.platform != "emscripten":
+        return None
+    import js  # Pyodide's bridge to JavaScript
+    return js.performance.now() / 1000
+
+
+class StartupProfile:
+    def __init__(self):
+        self.runtime_start = runtime_age()
+        self.phases = []    # (name, seconds), in order
+        self.complete = False
+        # time.perf_counter() when the script started, i.e. this module was imported
+        self.started = self._last = time.perf_counter()
+
+    def mark(self, phase):
+        """Ends 'phase', which started where the previous one ended."""
+        if self.complete:
+            return
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    def finish(self):
+        """
+        Ends the profile after the first page: loads the deferred modules and
+        prints the report if asked to. Does nothing after the first call.
+        """
+        if self.complete:
+            return
+        self.mark("first editor render")
+        for name in DEFERRED_MODULES:
+            importlib.import_module(name)
+        self.mark("deferred loading")
+        self.complete = True
+        if os.environ.get(PROFILE_STARTUP_ENV):
+            print("startup profile:", json.dumps(self.report()), flush=True)
+
+    def report(self):
+        """
+        The phases in seconds, with "runtime start" first when known and
+        "time to first render" (runtime start, or the start of the script,
+        to the end of the first page).
+        """
+        report = {}
+        if self.runtime_start is not None:
+            report["runtime start"] = self.runtime_start
+        report.update(self.phases)
+        first_render = 0.0
+        for phase, seconds in self.phases:
+            first_render += seconds
+            if phase == "first editor render":
+                report["time to first render"] = (self.runtime_start or 0.0) + first_render
+                break
+        return report
+
+
+# Created when the script first imports this module, i.e. when it starts
+PROFILE = StartupProfile()
@@ -1,108 +1,345 @@
+# First, so the startup profile starts with the script
+import startup
+
+import datetime
+import functools
+import html
+import inspect
+import io
 import json
+import os
+import re
+import time
+
 import streamlit as st
-import datetime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+startup.PROFILE.mark("package imports")
+
+# pandas and table_import (startup.DEFERRED_MODULES) are imported where they
+# are used: the first screen doesn't need them
+from autosave import AUTOSAVE_INTERVAL, open_autosave_journal
+from definition_archive import (
+    ARCHIVE_EXTENSIONS,
+    ARCHIVE_FORMATS,
+    archive_format,
+    encode_archive,
+    iter_archive_items,
+)
+from definition_diff import ADDED, CHANGED, REMOVED, diff_definitions, sequence_opcodes
+from document_cache import DocumentCache, content_hash
+from document_model import Document, Table, TableHeading
+from edit_history import EditHistory
+from library import DefinitionLibrary, default_library_dir
+from parent_graph import ParentGraph
+from profiling import RerunProfiler
+from modality_definition import (
+    STRUCTURE_DIRTY,
+    build_entries,
+    document_from_json,
+    iter_json_array_items,
+    iter_json_chunks,
+    new_build_cache,
+    parse_document,
+    update_build_cache,
+    write_json_export,
+)
+
+# Tables with more data rows than this open in the paginated grid editor
+GRID_ROW_THRESHOLD = 20
+# Data rows shown per page in the grid editor
+GRID_PAGE_SIZE = 50
+# Raw-text heading rows rendered (and rerun) together as one fragment
+RAWTEXT_GROUP_SIZE = 10
+# Search hits listed in the library sidebar
+LIBRARY_RESULT_COUNT = 10
+# Table rows listed per changed table on the review page
+DIFF_ROW_LIMIT = 200
+# Download formats on the review page
+EXPORT_FORMAT_LABELS = {"json": "JSON", "msgpack": "MessagePack", "columnar": "Columnar"}
+# File types accepted wherever a saved definition is uploaded
+DEFINITION_FILE_TYPES = ["json"] + [ARCHIVE_EXTENSIONS[f].lstrip(".") for f in ARCHIVE_FORMATS]
+# Keys of the keyed widgets named after a heading's uid, e.g. "table_7_use_grid"
+# or "review_raw_3"; a document loaded again (from the shared cache) comes back
+# with the same uids
+HEADING_WIDGET_KEY_RE = re.compile(r"(review_)?(raw|table)_\d+(_|$)")
+# Colors of the change kinds on the review page
+CHANGE_COLORS = {ADDED: "green", REMOVED: "red", CHANGED: "orange"}
+# Recent Streamlit versions can skip running a collapsed expander's body; older
+# versions (e.g. in the desktop build) get a "Show" toggle inside it instead
+LAZY_EXPANDERS = "on_change" in inspect.signature(st.expander).parameters
+
+###############################################################################
+# PROFILING
+###############################################################################
+
+def count_widgets_this_run():
+    """Widgets created so far in the current script or fragment run, None if unknown."""
+    ctx = get_script_run_ctx()
+    ids = getattr(getattr(ctx, "shared", ctx), "widget_ids_this_run", None)
+    if ids is None:
+        return None
+    return len(ids.snapshot() if hasattr(ids, "snapshot") else ids)
+
+def profiled(name, category="section", root=False):
+    """
+    Times each call of the decorated section, fragment or callback with the
+    session's profiler. 'name' is formatted with the call's arguments, e.g.
+    "table_headings[{0}]". Fragments are roots: rerunning one on its own is
+    a run of its own. Costs a session state lookup while profiling is off.
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            profiler = st.session_state.get("profiler")
+            if profiler is None or not profiler.enabled:
+                return func(*args, **kwargs)
+            with profiler.span(name.format(*args), category, root):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
 
 ###############################################################################
 # CALLBACKS AND INITIALIZATION
 ###############################################################################
 
 def init_session_state():
-    if "meta_data" not in st.session_state:
-        st.session_state["meta_data"] = {
-            "id": "",
-            "parents": [""],
-            "title": "",
-            "acronyms": ["", "", "", ""],
-            "shortDescription": ""
-        }
-    if "preparation_meta_data" not in st.session_state:
-        st.session_state["preparation_meta_data"] = {
-            "prepared_by": "",
-            "confirmed_by": "",
-            "date_of_preparation": datetime.date.today().isoformat(),
-            "planned_next_review": "",
-            "requires_completion": ""
-        }
-    if "rawtext_headings" not in st.session_state:
-        # Each entry is [number, title, content]
-        st.session_state["rawtext_headings"] = []
-    if "table_headings" not in st.session_state:
-        # Each entry is {"number": str, "title": str, "table": [ [col headers], [row1 data], ... ]}
-        st.session_state["table_headings"] = []
+    if "autosave" not in st.session_state:
+        # AutosaveJournal, or None outside the desktop build
+        st.session_state["autosave"] = open_autosave_journal()
+        st.session_state["autosave_status"] = None
+    if "document" not in st.session_state:
+        journal = st.session_state["autosave"]
+        restored = journal.load() if journal is not None else None
+        if restored is not None:
+            st.session_state["autosave_status"] = "Restored unsaved work from the autosave journal."
+        st.session_state["document"] = restored or Document()
     if "show_review_page" not in st.session_state:
         st.session_state["show_review_page"] = False
+    if "ingested_upload" not in st.session_state:
+        # File id of the upload currently reflected in the session
+        st.session_state["ingested_upload"] = None
+    if "upload_status" not in st.session_state:
+        st.session_state["upload_status"] = None
+    if "table_import_status" not in st.session_state:
+        st.session_state["table_import_status"] = None
+    if "diff_baseline" not in st.session_state:
+        # (content hash, entries) of the saved version the review page compares with
+        st.session_state["diff_baseline"] = None
+        # (baseline content hash, compared entries, changes, milliseconds taken)
+        st.session_state["diff_changes"] = None
+    if "review_cache" not in st.session_state:
+        # section key -> (its entries in the build cache, what the review page shows)
+        st.session_state["review_cache"] = {}
+    if "dirty_sections" not in st.session_state:
+        # "meta", "prep", a heading's key (e.g. ("table", uid)) or STRUCTURE_DIRTY
+        st.session_state["dirty_sections"] = {STRUCTURE_DIRTY}
+    if "build_cache" not in st.session_state:
+        st.session_state["build_cache"] = new_build_cache()
+    if "history" not in st.session_state:
+        # Undo/redo steps; the first record_history() call sets the starting point
+        st.session_state["history"] = EditHistory()
+        # Sections changed since the last undo step, same marks as "dirty_sections"
+        st.session_state["history_dirty"] = {STRUCTURE_DIRTY}
+    if "widget_generation" not in st.session_state:
+        st.session_state["widget_generation"] = 0
+    if "library" not in st.session_state:
+        # DefinitionLibrary of the folder named in the sidebar, once one is given
+        st.session_state["library"] = None
+        # ParentGraph of the library's definitions, for checking parent ids
+        st.session_state["parent_graph"] = None
+    if "profiler" not in st.session_state:
+        st.session_state["profiler"] = RerunProfiler(widget_counter=count_widgets_this_run)
+
+# Dirty tracking for the incremental JSON build and the undo history
+def mark_dirty(section):
+    st.session_state["dirty_sections"].add(section)
+    st.session_state["history_dirty"].add(section)
+
+def mark_all_dirty():
+    st.session_state["dirty_sections"].add(STRUCTURE_DIRTY)
+    st.session_state["history_dirty"].add(STRUCTURE_DIRTY)
+
+# Editor widgets are named by widget_name(), after the uid of their heading
+# and the ids of their table row and column, so adding or removing a heading,
+# row or column leaves the other widgets (and what was typed into them) alone.
+# An unkeyed widget is identified by its label and default value, and
+# remembers what was typed into it while it stays on screen. When the
+# document's values change underneath the widgets (undo, loading a file) the
+# generation is bumped, which renames every editor widget so it shows the
+# document's value.
+# (The names go into collapsed labels rather than keys: keyed text inputs
+# scan the whole session state each, which is quadratic on large documents.)
+def widget_name(name):
+    return f"{name}@{st.session_state['widget_generation']}"
+
+def reset_editor_widgets():
+    st.session_state["widget_generation"] += 1
+
+def reset_document_widgets():
+    """
+    Resets the editor widgets for a newly loaded document, and forgets the
+    keyed widgets of the previous document's headings (grid toggles, pages,
+    review sections, the import target), so the loaded headings start from
+    their defaults even when they come back with uids seen before.
+    """
+    reset_editor_widgets()
+    for key in list(st.session_state):
+        if HEADING_WIDGET_KEY_RE.match(key):
+            del st.session_state[key]
+    st.session_state.pop("table_import_target", None)
+
+# Undo/redo
+def record_history():
+    """
+    Turns the edits made since the previous call into one undo step. Called
+    at the end of each editor fragment and of the whole script run.
+    """
+    if st.session_state["history_dirty"]:
+        st.session_state["history"].record(
+            st.session_state["document"], st.session_state["history_dirty"]
+        )
+        st.session_state["history_dirty"] = set()
+
+@profiled("undo_edit", "callback")
+def undo_edit():
+    record_history()
+    history = st.session_state["history"]
+    if not history.can_undo:
+        st.toast("Nothing to undo")
+        return
+    dirty = history.undo(st.session_state["document"])
+    if dirty:
+        st.session_state["dirty_sections"] |= dirty
+        reset_editor_widgets()
+
+@profiled("redo_edit", "callback")
+def redo_edit():
+    history = st.session_state["history"]
+    if not history.can_redo:
+        st.toast("Nothing to redo")
+        return
+    dirty = history.redo(st.session_state["document"])
+    if dirty:
+        st.session_state["dirty_sections"] |= dirty
+        reset_editor_widgets()
+
+def discard_autosave():
+    """
+    Drops the work restored from the autosave journal and empties the
+    journal: the session starts over from a new document, with no history.
+    """
+    st.session_state["autosave"].discard()
+    st.session_state["autosave_status"] = None
+    st.session_state["document"] = Document()
+    st.session_state["build_cache"] = new_build_cache()
+    st.session_state["dirty_sections"] = {STRUCTURE_DIRTY}
+    st.session_state["history"] = EditHistory()
+    st.session_state["history_dirty"] = {STRUCTURE_DIRTY}
+    reset_document_widgets()
 
 # Callbacks for the "Data Type Information" (raw markdown headings)
+@profiled("add_rawtext_row", "callback")
 def add_rawtext_row():
-    st.session_state["rawtext_headings"].append(["", "", ""])
+    st.session_state["document"].add_rawtext_heading()
+    mark_all_dirty()
 
+@profiled("remove_last_rawtext_row", "callback")
 def remove_last_rawtext_row():
-    if len(st.session_state["rawtext_headings"]) > 0:
-        st.session_state["rawtext_headings"].pop()
+    doc = st.session_state["document"]
+    if len(doc.rawtext_headings) > 0:
+        doc.remove_rawtext_heading()
+        mark_all_dirty()
 
 # Callbacks for Table Headings
+@profiled("add_table_heading", "callback")
 def add_table_heading():
     """
     Creates a new empty table with 1 header row (by default 1 column),
     plus 1 empty data row. The user can add columns/rows in the UI.
     """
-    st.session_state["table_headings"].append({
-        "number": "",
-        "title": "",
-        "table": [
-            ["Column 1"],  # row 0 -> column headers
-            [""],          # row 1 -> first data row
-        ]
-    })
+    table = Table()
+    table.ensure_default()
+    st.session_state["document"].add_table_heading(TableHeading(table=table))
+    mark_all_dirty()
 
+@profiled("add_conversion_table", "callback")
 def add_conversion_table():
     """
     Creates a new table with 4 preset column headers for conversions,
     plus one empty data row.
     """
-    st.session_state["table_headings"].append({
-        "number": "",
-        "title": "",
-        "table": [
-            ["conversion_from", "conversion_to", "description", "link to code/software"],
-            ["", "", "", ""]
-        ]
-    })
-
-def add_row_table(idx):
+    table = Table.from_rows([
+        ["conversion_from", "conversion_to", "description", "link to code/software"],
+        ["", "", "", ""]
+    ])
+    st.session_state["document"].add_table_heading(TableHeading(table=table))
+    mark_all_dirty()
+
+@profiled("add_row_table({0})", "callback")
+def add_row_table(uid):
     """
-    Adds a new data row to the table 'table_headings[idx]',
+    Adds a new data row to the table of the table heading with this uid,
     leaving the header row alone.
     """
-    if 0 <= idx < len(st.session_state["table_headings"]):
-        table_data = st.session_state["table_headings"][idx]["table"]
-        if len(table_data) == 0:
-            # if no rows at all, create 1 header row + 1 data row
-            table_data.append(["Column 1"])
-            table_data.append([""])
-        else:
-            col_count = len(table_data[0])  # number of columns from the header row
-            new_row = ["" for _ in range(col_count)]
-            table_data.append(new_row)
+    heading = st.session_state["document"].heading_index.get(uid)
+    if isinstance(heading, TableHeading):
+        heading.editable_table().add_row()
+        mark_dirty(heading.key)
 
-def add_column_table(idx):
+@profiled("add_column_table({0})", "callback")
+def add_column_table(uid):
     """
-    Adds a new column to the table 'table_headings[idx]'.
-    The first row is headers, subsequent rows are data.
+    Adds a new column to the table of the table heading with this uid,
+    with a default header name.
     """
-    if 0 <= idx < len(st.session_state["table_headings"]):
-        table_data = st.session_state["table_headings"][idx]["table"]
-        for r, row in enumerate(table_data):
-            if r == 0:
-                # For the header row, create a default column name
-                row.append(f"Column {len(row) + 1}")
-            else:
-                row.append("")
+    heading = st.session_state["document"].heading_index.get(uid)
+    if isinstance(heading, TableHeading):
+        heading.editable_table().add_column()
+        mark_dirty(heading.key)
+
+# Callback for the table import (see render_table_import)
+@profiled("import_table_rows", "callback")
+def import_table_rows():
+    from table_import import import_rows, read_delimited, read_table_file
+
+    heading = st.session_state["document"].heading_index.get(st.session_state["table_import_target"])
+    if not isinstance(heading, TableHeading):
+        return
+    uploaded = st.session_state["table_import_file"]
+    start = time.perf_counter()
+    try:
+        if uploaded is not None:
+            frame = read_table_file(uploaded.name, uploaded.getvalue())
+        else:
+            frame = read_delimited(st.session_state["table_import_text"])
+        count = import_rows(
+            heading.editable_table(),
+            frame,
+            has_header=st.session_state["table_import_header"],
+            replace=st.session_state["table_import_mode"] == "Replace",
+        )
+    except Exception as e:
+        st.session_state["table_import_status"] = ("error", f"Error importing rows: {e}")
+        return
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    mark_dirty(heading.key)
+    # The grid keeps its cell edits across changes to its data; renamed, it
+    # starts from the imported rows instead of writing the old edits over them
+    reset_editor_widgets()
+    if heading.table.row_count > GRID_ROW_THRESHOLD:
+        # Before this run's widgets exist, so the table's toggle can be set
+        st.session_state[f"table_{heading.uid}_use_grid"] = True
+    st.session_state["table_import_status"] = (
+        "imported", f"Imported {count} rows in {elapsed_ms:.1f} ms"
+    )
 
 # Page switching
+@profiled("go_to_review_page", "callback")
 def go_to_review_page():
     st.session_state["show_review_page"] = True
 
+@profiled("back_to_editor", "callback")
 def back_to_editor():
     st.session_state["show_review_page"] = False
 
@@ -112,202 +349,290 @@ def back_to_editor():
 ###############################################################################
 
 def parse_json_into_session(json_data):
-    st.session_state["meta_data"] = {
-        "id": "",
-        "parents": [""],
-        "title": "",
-        "acronyms": ["", "", "", ""],
-        "shortDescription": ""
-    }
-    st.session_state["preparation_meta_data"] = {
-        "prepared_by": "",
-        "confirmed_by": "",
-        "date_of_preparation": datetime.date.today().isoformat(),
-        "planned_next_review": "",
-        "requires_completion": ""
-    }
-    st.session_state["rawtext_headings"] = []
-    st.session_state["table_headings"] = []
-
-    for item in json_data:
-        level = item.get("level", "")
-        ctype = item.get("content-type", "")
-        content = item.get("content", "")
-        title = item.get("title", "")
-
-        # meta-data
-        if level == "meta-data-id":
-            st.session_state["meta_data"]["id"] = content
-        elif level == "meta-data-parents" and ctype == "list_of_strings":
-            st.session_state["meta_data"]["parents"] = content if isinstance(content, list) else []
-        elif level == "meta-data-title":
-            st.session_state["meta_data"]["title"] = content
-        elif level == "meta-data-acronyms" and ctype == "list_of_strings":
-            st.session_state["meta_data"]["acronyms"] = content if isinstance(content, list) else []
-        elif level == "meta-data-shortDescription":
-            st.session_state["meta_data"]["shortDescription"] = content
-
-        # prep meta-data
-        elif level == "prepration-meta-data-prepared_by":
-            st.session_state["preparation_meta_data"]["prepared_by"] = content
-        elif level == "prepration-meta-data-confirmed_by":
-            st.session_state["preparation_meta_data"]["confirmed_by"] = content
-        elif level == "prepration-meta-data-date_of_preparation":
-            st.session_state["preparation_meta_data"]["date_of_preparation"] = content
-        elif level == "prepration-meta-data-planned_next_review":
-            st.session_state["preparation_meta_data"]["planned_next_review"] = content
-        elif level == "prepration-meta-data-requires_completion":
-            st.session_state["preparation_meta_data"]["requires_completion"] = content
-
-        # headings
-        else:
-            if ctype == "table":
-                # expecting a list of lists, where row 0 = column headers
-                st.session_state["table_headings"].append({
-                    "number": level,
-                    "title": title,
-                    "table": content
-                })
-            elif ctype == "markdown":
-                # data type info row
-                st.session_state["rawtext_headings"].append([level, title, content])
-            # else ignore older format or unrecognized
-
-    # Cleanup empty strings
-    st.session_state["meta_data"]["parents"] = [
-        p for p in st.session_state["meta_data"]["parents"] if p.strip()
-    ] or [""]
-    st.session_state["meta_data"]["acronyms"] = [
-        a for a in st.session_state["meta_data"]["acronyms"] if a.strip()
-    ] or ["", "", "", ""]
-
+    st.session_state["document"] = document_from_json(json_data)
+    # Same keys, different headings: nothing in the build cache applies
+    st.session_state["build_cache"] = new_build_cache()
+    mark_all_dirty()
+    reset_document_widgets()
+
+@st.cache_resource
+def shared_documents():
+    """The DocumentCache shared by all sessions of this server process."""
+    return DocumentCache()
+
+def load_shared_document(digest, parse):
+    """
+    Puts the session on its own copy of the document with content hash
+    'digest' from shared_documents(), parsed by 'parse()' if no session has
+    loaded it yet. The copy comes with the JSON already built for it, so
+    nothing is rebuilt until the session edits a section. Loading is one
+    undo step; heading uids are unique in the process (copies keep them), so
+    undoing it restores the previous headings without clashing with any.
+    """
+    doc, cache = shared_documents().checkout(digest, parse)
+    st.session_state["document"] = doc
+    st.session_state["build_cache"] = cache
+    st.session_state["dirty_sections"] = set()
+    st.session_state["history_dirty"].add(STRUCTURE_DIRTY)
+    reset_document_widgets()
+
+@profiled("build_final_json")
 def build_final_json():
-    final_list = []
-
-    meta = st.session_state["meta_data"]
-    # meta-data with single dictionary for parents & acronyms
-    final_list.append({
-        "level": "meta-data-id",
-        "title": "id",
-        "content-type": "rawtext",
-        "content": meta["id"]
-    })
-    final_list.append({
-        "level": "meta-data-parents",
-        "title": "parents",
-        "content-type": "list_of_strings",
-        "content": meta["parents"]
-    })
-    final_list.append({
-        "level": "meta-data-title",
-        "title": "title",
-        "content-type": "rawtext",
-        "content": meta["title"]
-    })
-    final_list.append({
-        "level": "meta-data-acronyms",
-        "title": "acronyms",
-        "content-type": "list_of_strings",
-        "content": meta["acronyms"]
-    })
-    final_list.append({
-        "level": "meta-data-shortDescription",
-        "title": "shortDescription",
-        "content-type": "rawtext",
-        "content": meta["shortDescription"]
-    })
-
-    # headings
-    combined = []
-    # store data type info as markdown
-    for rt in st.session_state["rawtext_headings"]:
-        num_str, heading_title, heading_content = rt
-        # If the row is fully empty, skip adding to final JSON
-        if num_str.strip() == "" and heading_title.strip() == "" and heading_content.strip() == "":
-            continue
-        combined.append({
-            "number": num_str,
-            "title": heading_title,
-            "content-type": "markdown",
-            "content": heading_content
-        })
-    for tb in st.session_state["table_headings"]:
-        combined.append({
-            "number": tb["number"],
-            "title": tb["title"],
-            "content-type": "table",
-            "content": tb["table"]
-        })
-
-    # sort
-    def parse_num(n):
-        parts = [p for p in n.split(".") if p.strip()]
-        try:
-            return tuple(int(p) for p in parts)
-        except ValueError:
-            return (999999,)
-
-    combined.sort(key=lambda x: parse_num(x["number"]))
-
-    for c in combined:
-        final_list.append({
-            "level": c["number"],
-            "title": c["title"],
-            "content-type": c["content-type"],
-            "content": c["content"]
-        })
-
-    # prep meta-data
-    prep = st.session_state["preparation_meta_data"]
-    final_list.append({
-        "level": "prepration-meta-data-prepared_by",
-        "title": "prepared_by",
-        "content-type": "rawtext",
-        "content": prep["prepared_by"]
-    })
-    final_list.append({
-        "level": "prepration-meta-data-confirmed_by",
-        "title": "confirmed_by",
-        "content-type": "rawtext",
-        "content": prep["confirmed_by"]
-    })
-    final_list.append({
-        "level": "prepration-meta-data-date_of_preparation",
-        "title": "date_of_preparation",
-        "content-type": "rawtext",
-        "content": prep["date_of_preparation"]
-    })
-    final_list.append({
-        "level": "prepration-meta-data-planned_next_review",
-        "title": "planned_next_review",
-        "content-type": "rawtext",
-        "content": prep["planned_next_review"]
-    })
-    final_list.append({
-        "level": "prepration-meta-data-requires_completion",
-        "title": "requires_completion",
-        "content-type": "rawtext",
-        "content": prep["requires_completion"]
-    })
-
-    return final_list
+    """
+    Returns the document as the list of JSON entries, rebuilding only the
+    sections marked dirty since the previous call.
+    """
+    cache = st.session_state["build_cache"]
+    update_build_cache(st.session_state["document"], cache, st.session_state["dirty_sections"])
+    st.session_state["dirty_sections"] = set()
+    return cache["entries"]
+
+def build_final_json_text():
+    """
+    Same document as build_final_json(), serialized exactly like
+    json.dumps(build_final_json(), indent=4).
+    """
+    build_final_json()
+    return "".join(iter_json_chunks(st.session_state["build_cache"]))
+
+@profiled("build_final_archive({0})")
+def build_final_archive(archive_format):
+    """Same document as build_final_json(), encoded in one of ARCHIVE_FORMATS."""
+    return encode_archive(build_final_json(), archive_format)
+
+def parse_definition_file(uploaded_file):
+    """
+    Parses an uploaded definition: JSON, streamed as it is decoded, or a
+    MessagePack or columnar archive (see definition_archive).
+    """
+    with uploaded_file.getbuffer() as view:
+        if archive_format(view) is not None:
+            return parse_document(iter_archive_items(view))
+    uploaded_file.seek(0)
+    return parse_document(iter_json_array_items(uploaded_file))
 
 ###############################################################################
-# RENDERING FUNCTIONS (EDITOR PAGES)
+# UPLOAD INGESTION
 ###############################################################################
 
-def render_table_editor(prefix, table_data, idx):
+@profiled("ingest_uploaded_file")
+def ingest_uploaded_file(uploaded_file):
     """
-    Renders the table. The first row is interpreted as column headers (user-editable).
-    Subsequent rows are data, each row begins with a read-only row number.
+    Loads an uploaded JSON file into the session once per upload. An upload
+    is identified by the uploader's file id, so later reruns with the same
+    file attached neither hash nor parse it again and leave the user's edits
+    alone. The parsed document is shared with other sessions loading the
+    same file (see load_shared_document).
     """
-    if not table_data:
-        # If there's no data, create a default structure
-        table_data.append(["Column 1"])  # row 0: column headers
-        table_data.append([""])          # row 1: first data row
+    if st.session_state["ingested_upload"] == uploaded_file.file_id:
+        return
+
+    st.session_state["ingested_upload"] = uploaded_file.file_id
+    parse_ms = []
+
+    def parse():
+        start = time.perf_counter()
+        doc = parse_definition_file(uploaded_file)
+        parse_ms.append((time.perf_counter() - start) * 1000)
+        return doc
+
+    try:
+        with uploaded_file.getbuffer() as view:
+            digest = content_hash(view)
+        load_shared_document(digest, parse)
+    except Exception as e:
+        st.session_state["upload_status"] = ("error", f"Error loading the file: {e}")
+        return
+    if parse_ms:
+        message = f"Successfully loaded the file! (parsed in {parse_ms[0]:.1f} ms)"
+    else:
+        message = "Successfully loaded the file! (already parsed by this server, no parse needed)"
+    st.session_state["upload_status"] = ("success", message)
 
-    row_count = len(table_data)
-    col_count = len(table_data[0])
+###############################################################################
+# LIBRARY
+###############################################################################
+
+def get_library(folder):
+    """The session's DefinitionLibrary for 'folder', opened and refreshed on first use."""
+    library = st.session_state["library"]
+    if library is None or str(library.directory) != folder:
+        library = DefinitionLibrary(folder)
+        library.refresh()
+        st.session_state["library"] = library
+        st.session_state["parent_graph"] = ParentGraph.from_library(library)
+    return library
+
+@st.fragment
+@profiled("library sidebar", "fragment", root=True)
+def render_library_sidebar():
+    """
+    Searches the definitions of a local folder. Typing a query only reruns
+    this fragment; opening a hit reruns the app with the loaded document.
+    """
+    folder = st.text_input("Definitions folder", value=default_library_dir(), key="library_dir")
+    if not folder:
+        return
+    if not os.path.isdir(folder):
+        st.warning(f"{folder} is not a folder")
+        return
+    library = get_library(folder)
+    graph = st.session_state["parent_graph"]
+    if st.button("Refresh index", key="btn_library_refresh"):
+        library.refresh()
+        graph.sync(library)
+    st.caption(f"{len(library)} definitions indexed")
+    if library.errors:
+        st.caption(f"{len(library.errors)} files could not be read: {', '.join(sorted(library.errors))}")
+    for ids in graph.cycles():
+        st.caption(f"Parent cycle: {' -> '.join(ids)}")
+    for id, paths in sorted(graph.duplicates().items()):
+        st.caption(f"Id {id} is defined by {', '.join(paths)}")
+    dangling = graph.dangling()
+    if dangling:
+        st.caption(f"{len(dangling)} definitions have unknown parents")
+
+    query = st.text_input("Search definitions", key="library_query")
+    if not query:
+        return
+    start = time.perf_counter()
+    hits = library.search(query, limit=LIBRARY_RESULT_COUNT)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    st.caption(f"{len(hits)} results in {elapsed_ms:.1f} ms")
+    for _, path, record in hits:
+        if st.button(record["title"] or record["id"] or path, key=f"library_open_{path}", help=path):
+            try:
+                data = library.read_bytes(path)
+                load_shared_document(
+                    content_hash(data),
+                    lambda: parse_document(iter_json_array_items(io.BytesIO(data))),
+                )
+            except Exception as e:
+                st.error(f"Error loading {path}: {e}")
+                return
+            st.session_state["show_review_page"] = False
+            st.rerun()
+
+###############################################################################
+# AUTOSAVE
+###############################################################################
+
+@st.fragment(run_every=AUTOSAVE_INTERVAL)
+@profiled("autosave", "fragment", root=True)
+def autosave_tick():
+    """
+    Appends the sections changed since the last save to the autosave journal.
+    Runs on every full rerun and on a timer, so edits made inside other
+    fragments are saved too; the journal itself debounces the writes.
+    """
+    journal = st.session_state["autosave"]
+    if journal is None:
+        return
+    if st.session_state["autosave_status"]:
+        st.info(st.session_state["autosave_status"])
+        if st.button("Discard restored work", key="btn_discard_autosave"):
+            discard_autosave()
+            # The document changed: rerun the whole app, not this fragment
+            st.rerun()
+    # Nothing to save before the first edit: the next start would "restore"
+    # an untouched document
+    if journal.last_saved_at is None and not st.session_state["history"].can_undo:
+        return
+    build_final_json()
+    try:
+        journal.flush(st.session_state["build_cache"])
+    except OSError as e:
+        st.session_state["autosave"] = None
+        st.error(f"Autosave disabled: {e}")
+        return
+    if journal.last_saved_at is not None:
+        saved_at = datetime.datetime.fromtimestamp(journal.last_saved_at)
+        st.caption(f"Autosaved at {saved_at:%H:%M:%S}")
+
+###############################################################################
+# RENDERING FUNCTIONS (EDITOR PAGES)
+###############################################################################
+
+@profiled("{0} grid")
+def render_table_grid(prefix, heading):
+    """
+    Renders the data rows of the heading's table one page at a time through
+    st.data_editor, so only GRID_PAGE_SIZE rows exist as widgets no matter how
+    long the table is. Edited cells are written back into the table one by
+    one; untouched cells and rows on other pages are never copied. Returns
+    the number of changed cells.
+    """
+    import pandas as pd
+
+    table = heading.table
+    row_count = table.row_count
+    col_count = table.column_count
+    page_count = max(1, -(-row_count // GRID_PAGE_SIZE))
+
+    page = 1
+    if page_count > 1:
+        page = st.number_input(
+            f"{prefix}_page",
+            min_value=1,
+            max_value=page_count,
+            value=1,
+            step=1,
+            key=f"{prefix}_page",
+            label_visibility="collapsed"
+        )
+    start = 1 + (page - 1) * GRID_PAGE_SIZE
+    end = min(start + GRID_PAGE_SIZE, row_count + 1)
+    st.caption(f"Rows {start}-{end - 1} of {row_count} (page {page} of {page_count})")
+
+    # Positional column ids keep blank or duplicate headers from clashing
+    column_ids = [f"c{c}" for c in range(col_count)]
+    shown = pd.DataFrame(
+        {
+            column_ids[c]: ["" if cell is None else str(cell) for cell in table.columns[c][start - 1:end - 1]]
+            for c in range(col_count)
+        },
+        index=pd.RangeIndex(start, end, name="Row #"),
+    )
+    edited = st.data_editor(
+        shown,
+        key=widget_name(f"{prefix}_grid_p{page}"),
+        num_rows="fixed",
+        column_config={
+            column_ids[c]: st.column_config.TextColumn(table.headers[c] or f"Column {c + 1}")
+            for c in range(col_count)
+        },
+    ).fillna("")
+
+    changed = (edited != shown).to_numpy()
+    rows_idx, cols_idx = changed.nonzero()
+    if len(rows_idx):
+        table = heading.editable_table()
+    for i, c in zip(rows_idx, cols_idx):
+        table.columns[c][start - 1 + i] = edited.iat[i, c]
+    return len(rows_idx)
+
+
+def render_table_editor(prefix, heading):
+    """
+    Renders the heading's table. The header row is rendered first (user-editable).
+    Data rows follow, each row begins with a read-only row number.
+    Long tables switch to the paginated grid (see render_table_grid).
+    """
+    # Read from heading.table, written through heading.editable_table()
+    table = heading.table
+    section = heading.key
+    if table.headers is None:
+        # There was no data, a default structure is created
+        table = heading.editable_table()
+        table.ensure_default()
+        mark_dirty(section)
+
+    row_count = table.row_count
+    col_count = table.column_count
+
+    # Seeded rather than given as value=, so import_table_rows can switch it on
+    st.session_state.setdefault(f"{prefix}_use_grid", row_count > GRID_ROW_THRESHOLD)
+    use_grid = st.toggle("Grid editor", key=f"{prefix}_use_grid")
 
     # --- Render header row ---
     # We'll create col_count + 1 columns in Streamlit so that the first col can label "Row # / Columns".
@@ -317,53 +642,101 @@ def render_table_editor(prefix, table_data, idx):
         st.write("Row # / Columns")
     for c in range(col_count):
         with header_cols[c + 1]:
-            cell_key = f"{prefix}_hdr_c{c}"
-            table_data[0][c] = st.text_input(
-                cell_key,
-                value=table_data[0][c],
+            cell_key = f"{prefix}_hdr_c{table.column_ids[c]}"
+            value = st.text_input(
+                widget_name(cell_key),
+                value=table.headers[c],
                 label_visibility="collapsed"
             )
-
-    # --- Render data rows (row 1 onward) ---
-    for r in range(1, row_count):
-        row_cols = st.columns(col_count + 1)
-        with row_cols[0]:
-            # Display a read-only row number
-            st.write(str(r))
-        for c in range(col_count):
-            with row_cols[c + 1]:
-                cell_key = f"{prefix}_r{r}_c{c}"
-                table_data[r][c] = st.text_input(
-                    cell_key,
-                    value=table_data[r][c],
-                    label_visibility="collapsed"
-                )
+            if value != table.headers[c]:
+                table = heading.editable_table()
+                table.headers[c] = value
+                mark_dirty(section)
+
+    # --- Render data rows ---
+    if use_grid:
+        if render_table_grid(prefix, heading):
+            mark_dirty(section)
+    else:
+        for r in range(row_count):
+            row_cols = st.columns(col_count + 1)
+            with row_cols[0]:
+                # Display a read-only row number
+                st.write(str(r + 1))
+            for c in range(col_count):
+                with row_cols[c + 1]:
+                    column = table.columns[c]
+                    cell_key = f"{prefix}_r{table.row_ids[r]}_c{table.column_ids[c]}"
+                    value = st.text_input(
+                        widget_name(cell_key),
+                        value=column[r],
+                        label_visibility="collapsed"
+                    )
+                    if value != column[r]:
+                        table = heading.editable_table()
+                        table.columns[c][r] = value
+                        mark_dirty(section)
 
     #  Add row/column buttons, e.g.:
     btn_cols = st.columns(2)
     with btn_cols[0]:
-        st.button("Add Row", on_click=add_row_table, args=(idx,), key=f"addrow_{idx}")
+        st.button("Add Row", on_click=add_row_table, args=(heading.uid,), key=f"{prefix}_addrow")
     with btn_cols[1]:
-        st.button("Add Column", on_click=add_column_table, args=(idx,), key=f"addcol_{idx}")
-
-    return table_data
-
+        st.button("Add Column", on_click=add_column_table, args=(heading.uid,), key=f"{prefix}_addcol")
 
-def editor_page():
-    st.title("Medical Modality Definition - Editor")
 
-    # ========== META-DATA ==========
-    meta = st.session_state["meta_data"]
+@st.fragment
+@profiled("table import", "fragment", root=True)
+def render_table_import():
+    """
+    Imports pasted CSV/TSV text or an uploaded CSV/TSV/XLSX file into one
+    table, appended to its rows or replacing them. The whole import is one
+    edit (one undo step); the app then reruns to show the table.
+    """
+    doc = st.session_state["document"]
+    if st.session_state["table_import_status"] is not None:
+        kind, message = st.session_state["table_import_status"]
+        if kind == "imported":
+            # The callback only reran this fragment, the table needs the app
+            st.session_state["table_import_status"] = ("success", message)
+            st.rerun()
+        st.session_state["table_import_status"] = None
+        (st.success if kind == "success" else st.error)(message)
+    if not doc.table_headings:
+        st.caption("Add a table heading first.")
+        return
+
+    labels = {heading.uid: f"#{i + 1} {heading.title}" for i, heading in enumerate(doc.table_headings)}
+    st.selectbox(
+        "Table",
+        list(labels),
+        format_func=lambda uid: labels.get(uid, "(removed)"),
+        key="table_import_target",
+    )
+    st.text_area("Paste rows (tab or comma separated)", key="table_import_text")
+    from table_import import IMPORT_FILE_TYPES
+    st.file_uploader("or upload a file", type=IMPORT_FILE_TYPES, key="table_import_file")
+    options = st.columns(2)
+    options[0].radio("Rows", ["Append", "Replace"], horizontal=True, key="table_import_mode")
+    options[1].checkbox("First row is the header row", value=True, key="table_import_header")
+    st.button("Import", on_click=import_table_rows, key="btn_table_import")
+
+
+@st.fragment
+@profiled("meta section", "fragment", root=True)
+def render_meta_section():
+    meta = st.session_state["document"].meta
+    meta_before = meta.copy()
     st.write("**Meta-Data**")
     # Use HTML for color
     c1, c2 = st.columns([1,3])
     with c1:
         st.markdown("<span style='color:blue;font-weight:bold'>ID (lowercase)</span>", unsafe_allow_html=True)
     with c2:
-        meta["id"] = st.text_input("id_lowercase", meta["id"], label_visibility="collapsed")
+        meta.id = st.text_input(widget_name("id_lowercase"), meta.id, label_visibility="collapsed")
 
     st.markdown("<span style='color:blue;font-weight:bold'>Parents</span>", unsafe_allow_html=True)
-    parents_copy = list(meta["parents"])
+    parents_copy = list(meta.parents)
     row_size = 4
     idx_p = 0
     while idx_p < len(parents_copy):
@@ -372,25 +745,29 @@ def editor_page():
             if idx_p < len(parents_copy):
                 with cols[j]:
                     parents_copy[idx_p] = st.text_input(
-                        f"parents_{idx_p}",
+                        widget_name(f"parents_{idx_p}"),
                         value=parents_copy[idx_p],
                         label_visibility="collapsed"
                     )
                 idx_p += 1
 
+    render_parent_check(meta.id, parents_copy)
+
+    @profiled("add_parent", "callback")
     def add_parent():
-        st.session_state["meta_data"]["parents"].append("")
+        st.session_state["document"].meta.parents.append("")
+        mark_dirty("meta")
     st.button("Add parent", on_click=add_parent, key="btn_add_parent")
-    meta["parents"] = parents_copy
+    meta.parents = parents_copy
 
     c3, c4 = st.columns([1,3])
     with c3:
         st.markdown("<span style='color:blue;font-weight:bold'>Title</span>", unsafe_allow_html=True)
     with c4:
-        meta["title"] = st.text_input("title_field", meta["title"], label_visibility="collapsed")
+        meta.title = st.text_input(widget_name("title_field"), meta.title, label_visibility="collapsed")
 
     st.markdown("<span style='color:blue;font-weight:bold'>Acronyms</span>", unsafe_allow_html=True)
-    acronyms_copy = list(meta["acronyms"])
+    acronyms_copy = list(meta.acronyms)
     idx_a = 0
     while idx_a < len(acronyms_copy):
         cols = st.columns(row_size)
@@ -398,48 +775,167 @@ def editor_page():
             if idx_a < len(acronyms_copy):
                 with cols[j]:
                     acronyms_copy[idx_a] = st.text_input(
-                        f"acronyms_{idx_a}",
+                        widget_name(f"acronyms_{idx_a}"),
                         value=acronyms_copy[idx_a],
                         label_visibility="collapsed"
                     )
                 idx_a += 1
 
+    @profiled("add_acronym", "callback")
     def add_acronym():
-        st.session_state["meta_data"]["acronyms"].append("")
+        st.session_state["document"].meta.acronyms.append("")
+        mark_dirty("meta")
     st.button("Add acronym", on_click=add_acronym, key="btn_add_acronym")
-    meta["acronyms"] = acronyms_copy
+    meta.acronyms = acronyms_copy
 
     st.markdown("<span style='color:blue;font-weight:bold'>Short Description</span>", unsafe_allow_html=True)
-    meta["shortDescription"] = st.text_area(
-        "shortDescription_field",
-        meta["shortDescription"],
+    meta.short_description = st.text_area(
+        widget_name("shortDescription_field"),
+        meta.short_description,
         label_visibility="collapsed"
     )
+    if meta != meta_before:
+        mark_dirty("meta")
+    record_history()
 
-    st.write("---")
 
-    # ========== PREPARATION META-DATA ==========
+def render_parent_check(id, parents):
+    """
+    Checks the parent ids being typed against the library's parent graph
+    (when a library is open) and lists the resulting ancestors.
+    """
+    graph = st.session_state["parent_graph"]
+    if graph is None:
+        return
+    for problem in graph.check_parents(id, parents):
+        st.warning(problem)
+    ancestors = []
+    for parent in dict.fromkeys(p.strip() for p in parents):
+        if parent in graph:
+            ancestors += [parent] + graph.ancestors(parent)
+    if ancestors:
+        st.caption(f"Ancestors: {', '.join(dict.fromkeys(ancestors))}")
+
+
+@st.fragment
+@profiled("prep section", "fragment", root=True)
+def render_prep_section():
     st.write("**Preparation Meta-Data**")
-    prep = st.session_state["preparation_meta_data"]
+    prep = st.session_state["document"].prep
+    prep_before = prep.copy()
 
     col_pre1, col_pre2 = st.columns(2)
     with col_pre1:
         st.markdown("<span style='color:orange;font-weight:bold'>Prepared by</span>", unsafe_allow_html=True)
-        prep["prepared_by"] = st.text_input("prepared_by", prep["prepared_by"], label_visibility="collapsed")
+        prep.prepared_by = st.text_input(widget_name("prepared_by"), prep.prepared_by, label_visibility="collapsed")
     with col_pre2:
         st.markdown("<span style='color:orange;font-weight:bold'>Confirmed by</span>", unsafe_allow_html=True)
-        prep["confirmed_by"] = st.text_input("confirmed_by", prep["confirmed_by"], label_visibility="collapsed")
+        prep.confirmed_by = st.text_input(widget_name("confirmed_by"), prep.confirmed_by, label_visibility="collapsed")
 
     col_pre3, col_pre4 = st.columns(2)
     with col_pre3:
         st.markdown("<span style='color:orange;font-weight:bold'>Date of Preparation (YYYY-MM-DD)</span>", unsafe_allow_html=True)
-        prep["date_of_preparation"] = st.text_input("date_of_preparation", prep["date_of_preparation"], label_visibility="collapsed")
+        prep.date_of_preparation = st.text_input(widget_name("date_of_preparation"), prep.date_of_preparation, label_visibility="collapsed")
     with col_pre4:
         st.markdown("<span style='color:orange;font-weight:bold'>Planned next review</span>", unsafe_allow_html=True)
-        prep["planned_next_review"] = st.text_input("planned_next_review", prep["planned_next_review"], label_visibility="collapsed")
+        prep.planned_next_review = st.text_input(widget_name("planned_next_review"), prep.planned_next_review, label_visibility="collapsed")
 
     st.markdown("<span style='color:orange;font-weight:bold'>Requires completion</span>", unsafe_allow_html=True)
-    prep["requires_completion"] = st.text_area("requires_completion", prep["requires_completion"], label_visibility="collapsed")
+    prep.requires_completion = st.text_area(widget_name("requires_completion"), prep.requires_completion, label_visibility="collapsed")
+    if prep != prep_before:
+        mark_dirty("prep")
+    record_history()
+
+
+def render_duplicate_warning(container, heading):
+    """
+    Warns under a heading's number field when another heading already uses
+    that number. Reads the live heading index, so no rebuild is needed.
+    """
+    duplicates = st.session_state["document"].heading_index.duplicates_of(heading)
+    if duplicates:
+        titles = ", ".join(repr(h.title or "untitled") for h in duplicates)
+        container.warning(f"Number {heading.number} is also used by {titles}")
+
+
+@st.fragment
+@profiled("raw-text rows {0}-{1}", "fragment", root=True)
+def render_rawtext_group(start, stop):
+    """
+    Renders raw-text heading rows [start, stop). Each group reruns on its own
+    when one of its cells is edited.
+    """
+    rows = st.session_state["document"].rawtext_headings
+    for i in range(start, min(stop, len(rows))):
+        row = rows[i]
+        row_before = row.copy()
+        cols = st.columns([1,2,5])
+        row.number = cols[0].text_input(widget_name(f"raw_number_{row.uid}"), value=row.number, label_visibility="collapsed")
+        row.title = cols[1].text_input(widget_name(f"raw_title_{row.uid}"), value=row.title, label_visibility="collapsed")
+        row.content = cols[2].text_input(widget_name(f"raw_content_{row.uid}"), value=row.content, label_visibility="collapsed")
+        render_duplicate_warning(cols[0], row)
+        if row != row_before:
+            mark_dirty(row.key)
+    record_history()
+
+
+@st.fragment
+@profiled("table_headings[{0}]", "fragment", root=True)
+def render_table_heading(idx):
+    """
+    Renders one table heading. Cell edits and Add Row/Column only rerun this
+    fragment; removing the heading reruns the whole app because every later
+    table shifts position (their widgets are named by uid and keep their state).
+    """
+    table_headings = st.session_state["document"].table_headings
+    heading = table_headings[idx]
+    heading_before = (heading.number, heading.title)
+    prefix = f"table_{heading.uid}"
+
+    st.write(f"**Table Heading #{idx+1}**")
+    sub_cols = st.columns([1,2])
+    with sub_cols[0]:
+        st.write("Heading Number")
+        heading.number = st.text_input(widget_name(f"{prefix}_num"), value=heading.number, label_visibility="collapsed")
+    with sub_cols[1]:
+        st.write("Heading Title")
+        heading.title = st.text_input(widget_name(f"{prefix}_title"), value=heading.title, label_visibility="collapsed")
+
+        render_duplicate_warning(st, heading)
+
+    if (heading.number, heading.title) != heading_before:
+        mark_dirty(heading.key)
+
+    # Render the actual table
+    render_table_editor(prefix, heading)
+
+    if st.button(f"Remove Table Heading #{idx+1}", key=f"{prefix}_remove"):
+        st.session_state["document"].remove_table_heading(idx)
+        mark_all_dirty()
+        st.rerun()
+
+    st.write("---")
+    record_history()
+
+
+@profiled("editor page")
+def editor_page():
+    st.title("Medical Modality Definition - Editor")
+
+    doc = st.session_state["document"]
+
+    # If no row, add one (before any fragment records it as an undo step)
+    if not doc.rawtext_headings:
+        doc.add_rawtext_heading()
+        mark_all_dirty()
+
+    # ========== META-DATA ==========
+    render_meta_section()
+
+    st.write("---")
+
+    # ========== PREPARATION META-DATA ==========
+    render_prep_section()
 
     st.write("---")
 
@@ -463,15 +959,8 @@ def editor_page():
     with head_cols[2]:
         st.write("**Content** (Markdown)")
 
-    # If no row, add one
-    if not st.session_state["rawtext_headings"]:
-        st.session_state["rawtext_headings"].append(["", "", ""])
-
-    for i, row in enumerate(st.session_state["rawtext_headings"]):
-        cols = st.columns([1,2,5])
-        row[0] = cols[0].text_input(f"raw_number_{i}", value=row[0], label_visibility="collapsed")
-        row[1] = cols[1].text_input(f"raw_title_{i}", value=row[1], label_visibility="collapsed")
-        row[2] = cols[2].text_input(f"raw_content_{i}", value=row[2], label_visibility="collapsed")
+    for start in range(0, len(doc.rawtext_headings), RAWTEXT_GROUP_SIZE):
+        render_rawtext_group(start, start + RAWTEXT_GROUP_SIZE)
 
     st.button("Add Row", on_click=add_rawtext_row, key="add_rawtext")
     st.button("Remove Last Row", on_click=remove_last_rawtext_row, key="remove_rawtext")
@@ -486,61 +975,317 @@ def editor_page():
     with heading_btn_cols[1]:
         st.button("Add Conversion Table", on_click=add_conversion_table, key="btn_add_conversion_table")
 
-    new_table_headings = []
-    skip_removal = False
+    for idx in range(len(doc.table_headings)):
+        render_table_heading(idx)
 
-    for idx, table_obj in enumerate(st.session_state["table_headings"]):
-        if skip_removal:
-            new_table_headings.append(table_obj)
-            continue
+    expander, is_open = collapsible_section("Import rows from CSV, TSV or Excel", "table_import_open")
+    if is_open:
+        with expander:
+            render_table_import()
+
+    # ========== SAVE & GO TO REVIEW PAGE ==========
+    st.button("Save and go to Review Page", on_click=go_to_review_page, key="btn_go_review")
 
-        st.write(f"**Table Heading #{idx+1}**")
-        sub_cols = st.columns([1,2])
-        with sub_cols[0]:
-            st.write("Heading Number")
-            num_val = st.text_input(f"table_num_{idx}", value=table_obj["number"], label_visibility="collapsed")
-        with sub_cols[1]:
-            st.write("Heading Title")
-            title_val = st.text_input(f"table_title_{idx}", value=table_obj["title"], label_visibility="collapsed")
-
-        # Render the actual table
-        table_val = render_table_editor(f"table_{idx}", table_obj["table"], idx)
-
-        remove_clicked = st.button(f"Remove Table Heading #{idx+1}", key=f"remove_table_{idx}")
-        if remove_clicked:
-            skip_removal = True
-            st.write("This table heading removed.")
+
+###############################################################################
+# RENDERING FUNCTIONS (REVIEW PAGE)
+###############################################################################
+
+def load_diff_baseline(uploaded_file):
+    """
+    (content hash, entries) of a saved definition to compare with, the
+    entries built the same way as the editor's own (so only real differences
+    show). Parsed once per distinct file.
+    """
+    with uploaded_file.getbuffer() as view:
+        digest = content_hash(view)
+    baseline = st.session_state["diff_baseline"]
+    if baseline is None or baseline[0] != digest:
+        doc = parse_definition_file(uploaded_file)
+        baseline = st.session_state["diff_baseline"] = (digest, build_entries(doc)["entries"])
+    return baseline
+
+
+def _lines(content):
+    """A section's content as lines of text: list items, table rows or text lines."""
+    if isinstance(content, list):
+        return ["\t".join(map(str, item)) if isinstance(item, list) else str(item) for item in content]
+    return str(content).splitlines()
+
+
+def render_text_change(old, new):
+    """Changed lines only, as a diff."""
+    old_lines, new_lines = _lines(old), _lines(new)
+    lines = []
+    for tag, i1, i2, j1, j2 in sequence_opcodes(old_lines, new_lines):
+        if tag != "equal":
+            lines += [f"- {line}" for line in old_lines[i1:i2]]
+            lines += [f"+ {line}" for line in new_lines[j1:j2]]
+    if lines:
+        st.code("\n".join(lines), language="diff")
+
+
+def _column_names(headers):
+    # Numbered, so blank or repeated headers still make distinct columns
+    return [f"{header} ({c + 1})" for c, header in enumerate(headers)]
+
+
+def render_table_rows(rows):
+    """The first DIFF_ROW_LIMIT data rows of a table (JSON list-of-lists form)."""
+    import pandas as pd
+
+    if not rows:
+        return
+    width = len(rows[0])
+    records = [[str(v) for v in (row + [""] * width)[:width]] for row in rows[1:DIFF_ROW_LIMIT + 1]]
+    st.dataframe(pd.DataFrame(records, columns=_column_names(rows[0])), hide_index=True)
+    if len(rows) - 1 > DIFF_ROW_LIMIT:
+        st.caption(f"... and {len(rows) - 1 - DIFF_ROW_LIMIT} more rows")
+
+
+def render_table_change(old_rows, new_rows, diff):
+    """Summary of a table's changes, and its added, removed and changed rows."""
+    import pandas as pd
+
+    added = sum(1 for status, *_ in diff.rows if status == ADDED)
+    removed = sum(1 for status, *_ in diff.rows if status == REMOVED)
+    st.caption(f"{diff.cells} cells changed, {added} rows added, {removed} rows removed")
+    for status, _, _, old_header, new_header in diff.columns:
+        if status == CHANGED:
+            st.caption(f"Column renamed: {old_header} → {new_header}")
+        else:
+            st.caption(f"Column {status}: {new_header if status == ADDED else old_header}")
+    if not diff.rows:
+        return
+
+    headers = new_rows[0]
+    new_column = dict(diff.pairs)
+    records = []
+    for status, old_row, new_row, cells in diff.rows[:DIFF_ROW_LIMIT]:
+        if status == REMOVED:
+            values = [""] * len(headers)
+            for c, value in enumerate(old_rows[old_row]):
+                if c in new_column:
+                    values[new_column[c]] = value
         else:
-            new_table_headings.append({
-                "number": num_val,
-                "title": title_val,
-                "table": table_val
-            })
+            values = list(new_rows[new_row]) + [""] * (len(headers) - len(new_rows[new_row]))
+            for c, old_value, new_value in cells:
+                values[c] = f"{old_value} → {new_value}"
+        records.append([status, new_row or old_row] + [str(v) for v in values])
+    frame = pd.DataFrame(records, columns=["change", "row"] + _column_names(headers))
+    st.dataframe(frame, hide_index=True)
+    if len(diff.rows) > DIFF_ROW_LIMIT:
+        st.caption(f"... and {len(diff.rows) - DIFF_ROW_LIMIT} more rows")
+
+
+def render_section_change(change):
+    color = CHANGE_COLORS[change.status]
+    st.markdown(
+        f"<span style='color:{color};font-weight:bold'>{change.status.capitalize()}</span> "
+        f"{html.escape(change.label)}",
+        unsafe_allow_html=True,
+    )
+    old, new = change.old, change.new
+    if change.status != CHANGED:
+        if change.entry["content-type"] == "table":
+            render_table_rows(change.entry["content"])
+        else:
+            render_text_change(old["content"] if old else "", new["content"] if new else "")
+        return
+    if change.is_heading:
+        if old["level"] != new["level"]:
+            st.caption(f"Number: {old['level']} → {new['level']}")
+        if old["title"] != new["title"]:
+            st.caption(f"Title: {old['title']} → {new['title']}")
+    if change.table is not None:
+        render_table_change(old["content"], new["content"], change.table)
+    elif old["content"] != new["content"]:
+        render_text_change(old["content"], new["content"])
+
+
+def render_changes(baseline, final_data):
+    """
+    Only the sections that differ from 'baseline', the (content hash,
+    entries) of the saved version. The comparison is kept until either side
+    changes: the build gives a new entries list only when it rebuilt a section.
+    """
+    digest, baseline_entries = baseline
+    cached = st.session_state["diff_changes"]
+    if cached is not None and cached[0] == digest and cached[1] is final_data:
+        changes, elapsed_ms = cached[2], cached[3]
+    else:
+        start = time.perf_counter()
+        changes = diff_definitions(baseline_entries, final_data)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        st.session_state["diff_changes"] = (digest, final_data, changes, elapsed_ms)
+    if not changes:
+        st.success("No changes.")
+        return
+    st.caption(f"{len(changes)} sections changed (compared in {elapsed_ms:.1f} ms)")
+    for change in changes:
+        render_section_change(change)
+
+
+def collapsible_section(label, key):
+    """
+    A collapsed expander, and whether it is open. Its content should only
+    be rendered when it is, so closed sections cost one element each.
+    """
+    if LAZY_EXPANDERS:
+        expander = st.expander(label, key=key, on_change="rerun")
+        return expander, bool(expander.open)
+    expander = st.expander(label)
+    return expander, expander.toggle("Show", key=key)
 
-        st.write("---")
 
-    st.session_state["table_headings"] = new_table_headings
+def review_content(key, entries):
+    """
+    What the review page shows for a section: a markdown string, or for a
+    table a DataFrame of its data rows. Cached per section until the build
+    rebuilds it (the build cache then holds a new entries list).
+    """
+    cache = st.session_state["review_cache"]
+    cached = cache.get(key)
+    if cached is not None and cached[0] is entries:
+        return cached[1]
+    entry = entries[0]
+    if key in ("meta", "prep"):
+        lines = []
+        for e in entries:
+            value = ", ".join(e["content"]) if isinstance(e["content"], list) else e["content"]
+            lines.append(f"**{e['title']}**: {value}")
+        content = "  \n".join(lines)
+    elif entry["content-type"] == "table":
+        import pandas as pd
+        rows = entry["content"]
+        width = len(rows[0]) if rows else 0
+        content = pd.DataFrame(
+            [[str(v) for v in (row + [""] * width)[:width]] for row in rows[1:]],
+            columns=_column_names(rows[0]) if rows else [],
+            index=pd.RangeIndex(1, len(rows), name="Row #") if rows else None,
+        )
+    else:
+        content = entry["content"]
+    cache[key] = (entries, content)
+    return content
+
+
+def render_review_section(key, entries, widget_key):
+    content = review_content(key, entries)
+    if isinstance(content, str):
+        st.markdown(content)
+        return
+    row_count = len(content)
+    page_count = max(1, -(-row_count // GRID_PAGE_SIZE))
+    page = 1
+    if page_count > 1:
+        page = st.number_input(
+            "Page", min_value=1, max_value=page_count, value=1, step=1, key=f"{widget_key}_page"
+        )
+    start = (page - 1) * GRID_PAGE_SIZE
+    st.dataframe(content.iloc[start:start + GRID_PAGE_SIZE])
+    st.caption(f"Rows {start + 1}-{min(start + GRID_PAGE_SIZE, row_count)} of {row_count}")
+
+
+def section_label(key, entries):
+    if key == "meta":
+        return "Meta-Data"
+    if key == "prep":
+        return "Preparation Meta-Data"
+    entry = entries[0]
+    parts = [str(entry["level"]).strip(), str(entry["title"]).strip()]
+    if entry["content-type"] == "table":
+        rows = entry["content"]
+        parts.append(f"(table, {max(len(rows) - 1, 0)} rows)")
+    return " ".join(part for part in parts if part) or "(untitled)"
+
+
+@st.fragment
+@profiled("review outline", "fragment", root=True)
+def render_review_outline():
+    """
+    The final document as one collapsed section per meta-data block and
+    heading, in output order. Opening a section reruns only this fragment
+    and renders just that section.
+    """
+    cache = st.session_state["build_cache"]
+    sections = cache["sections"]
+    keys = ["meta"] + cache["order"] + ["prep"]
+    review_cache = st.session_state["review_cache"]
+    for stale in review_cache.keys() - sections.keys():
+        del review_cache[stale]
+
+    for key in keys:
+        entries = sections[key]["entries"]
+        if not entries:
+            continue
+        widget_key = "review_" + (key if isinstance(key, str) else f"{key[0]}_{key[1]}")
+        expander, is_open = collapsible_section(section_label(key, entries), widget_key)
+        if is_open:
+            with expander:
+                render_review_section(key, entries, widget_key)
 
-    # ========== SAVE & GO TO REVIEW PAGE ==========
-    st.button("Save and go to Review Page", on_click=go_to_review_page, key="btn_go_review")
+    raw_json, is_open = collapsible_section("Raw JSON", "review_raw_json")
+    if is_open:
+        with raw_json:
+            st.json(build_final_json())
 
 
+@profiled("review page")
 def review_page():
     st.title("Review & Download")
 
     final_data = build_final_json()
-    st.subheader("Final JSON Preview")
-    st.json(final_data)
-
-    file_name = (st.session_state["meta_data"]["id"] or "output") + ".json"
-    json_str = json.dumps(final_data, indent=4)
+    with st.expander("Compare with a saved version"):
+        baseline_file = st.file_uploader("Saved version", type=DEFINITION_FILE_TYPES, key="diff_baseline_file")
+    baseline = None
+    if baseline_file is not None:
+        try:
+            baseline = load_diff_baseline(baseline_file)
+        except Exception as e:
+            st.error(f"Error loading the saved version: {e}")
 
-    st.download_button(
-        label="Download JSON",
-        data=json_str,
-        file_name=file_name,
-        mime="application/json"
+    if baseline is not None:
+        st.subheader("Changes")
+        with st.session_state["profiler"].span("changes"):
+            render_changes(baseline, final_data)
+    else:
+        st.subheader("Final JSON Preview")
+        render_review_outline()
+
+    export_format = st.radio(
+        "Format",
+        list(EXPORT_FORMAT_LABELS),
+        format_func=EXPORT_FORMAT_LABELS.get,
+        horizontal=True,
+        key="export_format",
     )
+    file_stem = st.session_state["document"].meta.id or "output"
+    if export_format == "json":
+        export_cols = st.columns(2)
+        with export_cols[0]:
+            compact = st.toggle("Compact (no indentation)", key="export_compact")
+        with export_cols[1]:
+            compress = st.toggle("Gzip compressed", key="export_gzip")
+
+        file_name = file_stem + ".json"
+        chunks = iter_json_chunks(st.session_state["build_cache"], compact=compact)
+        if compress:
+            file_name += ".gz"
+
+        st.download_button(
+            label="Download JSON",
+            data=write_json_export(chunks, compress=compress),
+            file_name=file_name,
+            mime="application/gzip" if compress else "application/json"
+        )
+    else:
+        st.download_button(
+            label=f"Download {EXPORT_FORMAT_LABELS[export_format]}",
+            data=build_final_archive(export_format),
+            file_name=file_stem + ARCHIVE_EXTENSIONS[export_format],
+            mime="application/octet-stream",
+        )
 
     st.button("Back to Editor", on_click=back_to_editor, key="btn_back_editor")
 
@@ -549,26 +1294,90 @@ def review_page():
 # MAIN
 ###############################################################################
 
-def main():
-    st.set_page_config(page_title="Medical Modality Editor", layout="wide")
-    init_session_state()
-
+def render_app():
     st.sidebar.title("Options")
-    uploaded_file = st.sidebar.file_uploader("Upload previously saved JSON", type=["json"])
+    uploaded_file = st.sidebar.file_uploader("Upload a saved definition", type=DEFINITION_FILE_TYPES)
     if uploaded_file is not None:
-        try:
-            file_contents = uploaded_file.read().decode("utf-8")
-            loaded_json = json.loads(file_contents)
-            parse_json_into_session(loaded_json)
-            st.sidebar.success("Successfully loaded JSON!")
-        except Exception as e:
-            st.sidebar.error(f"Error loading JSON: {e}")
+        ingest_uploaded_file(uploaded_file)
+        if st.session_state["upload_status"] is not None:
+            kind, message = st.session_state["upload_status"]
+            if kind == "success":
+                st.sidebar.success(message)
+            else:
+                st.sidebar.error(message)
+
+    # Always enabled: edits made in a fragment rerun don't redraw the sidebar,
+    # so the callbacks say when there is nothing to undo or redo
+    history_cols = st.sidebar.columns(2)
+    history_cols[0].button("Undo", on_click=undo_edit, key="btn_undo")
+    history_cols[1].button("Redo", on_click=redo_edit, key="btn_redo")
+
+    with st.sidebar.expander("Library"):
+        render_library_sidebar()
 
     if st.session_state["show_review_page"]:
         review_page()
     else:
         editor_page()
 
+    if st.session_state["autosave"] is not None:
+        with st.sidebar:
+            autosave_tick()
+
+    record_history()
+
+
+def render_profiling_panel():
+    """
+    Sidebar debug panel: where the app's startup went, how the documents
+    shared between sessions are used, per-section timings over the last
+    reruns and the trace of those reruns for chrome://tracing or Perfetto.
+    """
+    if startup.PROFILE.complete:
+        st.caption("Startup: " + ", ".join(
+            f"{phase} {seconds:.2f} s" for phase, seconds in startup.PROFILE.report().items()
+        ))
+    documents = shared_documents()
+    st.caption(
+        f"Shared documents: {len(documents)} cached ({documents.size / 1e6:.1f} MB), "
+        f"{documents.hits} hits, {documents.misses} misses"
+    )
+    profiler = st.session_state["profiler"]
+    st.toggle("Profile reruns", key="profiling_enabled")
+    if not profiler.enabled:
+        return
+    stats = profiler.stats()
+    if not stats:
+        st.caption("Timings appear after the next rerun.")
+        return
+    st.caption(f"Last {len(profiler.runs)} runs, milliseconds per run")
+    import pandas as pd
+    st.dataframe(pd.DataFrame(stats).set_index("span"))
+    cols = st.columns(2)
+    cols[0].download_button(
+        label="Download trace",
+        data=json.dumps(profiler.chrome_trace()),
+        file_name="modality_editor_trace.json",
+        mime="application/json",
+        key="btn_download_trace",
+    )
+    cols[1].button("Clear", on_click=profiler.clear, key="btn_clear_profile")
+
+
+def main():
+    st.set_page_config(page_title="Medical Modality Editor", layout="wide")
+    init_session_state()
+    profiler = st.session_state["profiler"]
+    profiler.set_enabled(st.session_state.get("profiling_enabled", False))
+    with profiler.span("script run", root=True):
+        render_app()
+    startup.PROFILE.finish()
+
+    with st.sidebar.expander("Profiling"):
+        render_profiling_panel()
+
+
+startup.PROFILE.mark("app import")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
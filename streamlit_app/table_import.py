@@ -0,0 +1,115 @@
+"""
+Bulk import of rows into a table heading's table, from pasted CSV/TSV text
+or an uploaded CSV, TSV or Excel file.
+
+The data is parsed in one pass by pandas (its C CSV parser, or openpyxl for
+.xlsx files, which is optional) into columns of strings, and then added to
+the document_model.Table column by column, so a large import never builds
+one Python row at a time. Nothing in here depends on Streamlit.
+"""
+import csv
+import io
+import os
+
+import pandas as pd
+
+# Extensions accepted for uploads
+IMPORT_FILE_TYPES = ["csv", "tsv", "txt", "xlsx"]
+# Characters read to guess the delimiter of CSV text
+SNIFF_SAMPLE_SIZE = 64 * 1024
+
+
+def _delimiter(text):
+    """Tab if the first line has one (data copied from a spreadsheet), else a guess."""
+    first_line = text.split("\n", 1)[0]
+    if "\t" in first_line:
+        return "\t"
+    try:
+        return csv.Sniffer().sniff(text[:SNIFF_SAMPLE_SIZE], delimiters=",;|").delimiter
+    except csv.Error:
+        return ","
+
+
+def read_delimited(text):
+    """DataFrame of strings (no header interpretation) from CSV or TSV text."""
+    if not text.strip():
+        raise ValueError("there is nothing to import")
+    try:
+        frame = pd.read_csv(
+            io.StringIO(text),
+            sep=_delimiter(text),
+            header=None,
+            dtype=str,
+            keep_default_na=False,
+        )
+    except (pd.errors.ParserError, pd.errors.EmptyDataError) as e:
+        raise ValueError(f"could not read the data: {e}") from None
+    return frame
+
+
+def read_table_file(name, data):
+    """DataFrame of strings from the bytes of a .csv, .tsv, .txt or .xlsx file."""
+    extension = os.path.splitext(name)[1].lower()
+    if extension == ".xlsx":
+        try:
+            frame = pd.read_excel(io.BytesIO(data), header=None, dtype=str, engine="openpyxl")
+        except ImportError:
+            raise ValueError("reading .xlsx files needs the openpyxl package") from None
+        return frame.fillna("")
+    if extension not in (".csv", ".tsv", ".txt"):
+        raise ValueError(f"unsupported file type '{extension}'")
+    return read_delimited(data.decode("utf-8-sig"))
+
+
+def _header_key(header):
+    return str(header).strip().casefold()
+
+
+def import_rows(table, frame, has_header=True, replace=False):
+    """
+    Adds the rows of 'frame' to 'table', or replaces the table's rows with
+    them. Returns the number of data rows imported.
+
+    With 'has_header' the first row of 'frame' names its columns, and each is
+    matched (ignoring case and surrounding spaces) to the table column with
+    that header; otherwise columns are matched by position. When appending,
+    unmatched columns are added to the table and table columns missing from
+    the data get empty cells. When replacing, the table takes the data's
+    columns, keeping the ids of the columns it matched.
+    """
+    incoming = [frame[c].tolist() for c in frame.columns]
+    if has_header:
+        headers = [str(column[0]) for column in incoming]
+        incoming = [column[1:] for column in incoming]
+    else:
+        headers = None
+    count = len(incoming[0]) if incoming else 0
+
+    existing = table.headers or []
+    if has_header:
+        positions = {}
+        for c, header in enumerate(existing):
+            positions.setdefault(_header_key(header), c)
+        matches = [positions.pop(_header_key(header), None) for header in headers]
+    else:
+        matches = [c if c < len(existing) else None for c in range(len(incoming))]
+
+    if replace or table.headers is None:
+        if headers is None:
+            headers = [
+                existing[c] if c is not None else f"Column {j + 1}"
+                for j, c in enumerate(matches)
+            ]
+        column_ids = [None if c is None else table.column_ids[c] for c in matches]
+        table.replace(headers, incoming, column_ids)
+        return count
+
+    aligned = [None] * table.column_count
+    for j, c in enumerate(matches):
+        if c is None:
+            table.add_column(headers[j] if headers is not None else None)
+            aligned.append(incoming[j])
+        else:
+            aligned[c] = incoming[j]
+    table.extend_rows([[""] * count if column is None else column for column in aligned])
+    return count
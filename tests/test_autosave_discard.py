@@ -0,0 +1,47 @@
+"""
+Work restored from the autosave journal can be discarded: the session
+starts over from a new document and the next start restores nothing.
+"""
+import sys
+from pathlib import Path
+
+from streamlit.testing.v1 import AppTest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "streamlit_app"))
+
+import autosave  # noqa: E402
+
+APP = Path(__file__).resolve().parent.parent / "streamlit_app" / "streamlit_app.py"
+
+
+def start_app():
+    at = AppTest.from_file(str(APP), default_timeout=60)
+    at.run()
+    assert not at.exception, at.exception
+    return at
+
+
+def test_discard_restored_work(monkeypatch, tmp_path):
+    monkeypatch.setattr(autosave, "default_autosave_dir", lambda: str(tmp_path))
+    journal = tmp_path / autosave.JOURNAL_FILE_NAME
+
+    at = start_app()
+    at.button(key="btn_add_table_heading").click().run()
+    assert not at.exception, at.exception
+    assert journal.stat().st_size > 0
+
+    at = start_app()
+    assert len(at.session_state["document"].table_headings) == 1
+    at.button(key="btn_discard_autosave").click().run()
+    assert not at.exception, at.exception
+    assert at.session_state["document"].table_headings == []
+    assert not at.session_state["history"].can_undo
+    assert all(button.key != "btn_discard_autosave" for button in at.button)
+    assert journal.stat().st_size == 0
+
+    # Nothing is written back until the next edit, and nothing restored
+    at.run()
+    assert journal.stat().st_size == 0
+    at = start_app()
+    assert at.session_state["autosave_status"] is None
+    assert at.session_state["document"].table_headings == []
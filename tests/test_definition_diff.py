@@ -0,0 +1,32 @@
+"""
+A saved version can hold malformed headings: no number, or a number or
+title that isn't a string. Comparing against it must report them, not fail.
+"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "streamlit_app"))
+
+from definition_diff import ADDED, REMOVED, diff_definitions  # noqa: E402
+
+
+def heading(level, title, content="text"):
+    return {"level": level, "title": title, "content-type": "markdown", "content": content}
+
+
+def test_malformed_headings_are_reported():
+    old = [
+        {"title": "no number", "content-type": "markdown", "content": ""},
+        heading(None, None),
+        heading(3, ["a", "list"]),
+    ]
+    new = [heading("1", "Kept")]
+    changes = diff_definitions(old, new)
+    assert sorted((c.status, c.label) for c in changes) == [
+        (ADDED, "1 Kept"),
+        (REMOVED, ""),
+        (REMOVED, "3 ['a', 'list']"),
+        (REMOVED, "no number"),
+    ]
+    assert all(c.is_heading for c in changes)
+    assert len(diff_definitions(new, old)) == 4
@@ -0,0 +1,77 @@
+"""
+Loading a definition is one undo step. Undoing it must give back the
+previous document exactly, with no heading of the loaded one left behind,
+and the review page must render it.
+"""
+import json
+from pathlib import Path
+
+from streamlit.testing.v1 import AppTest
+
+APP = Path(__file__).resolve().parent.parent / "streamlit_app" / "streamlit_app.py"
+
+
+def write_definition(path, id):
+    # The first heading is a table, the editor's first heading raw text
+    path.write_text(json.dumps([
+        {"level": "meta-data-id", "title": "id", "content-type": "rawtext", "content": id},
+        {"level": "1", "title": "Loaded", "content-type": "table", "content": [["a"], ["x"]]},
+    ]))
+
+
+def open_from_library(at, query, name):
+    at.sidebar.text_input(key="library_query").input(query).run()
+    at.sidebar.button(key=f"library_open_{name}").click().run()
+    assert not at.exception, at.exception
+
+
+def start_app(monkeypatch, tmp_path):
+    write_definition(tmp_path / "loaded.json", "loaded")
+    monkeypatch.setenv("MODALITY_LIBRARY_DIR", str(tmp_path))
+    at = AppTest.from_file(str(APP), default_timeout=60)
+    at.run()
+    # Something for the review page to show under the raw-text heading
+    uid = at.session_state["document"].rawtext_headings[0].uid
+    title = next(w for w in at.text_input if w.label.startswith(f"raw_title_{uid}@"))
+    title.input("Typed").run()
+    assert not at.exception, at.exception
+    return at
+
+
+def assert_review_renders(at, titles):
+    doc = at.session_state["document"]
+    uids = [h.uid for h in doc.heading_index]
+    assert len(uids) == len(set(uids))
+    assert [h.title for h in doc.heading_index] == titles
+    at.button(key="btn_go_review").click().run()
+    assert not at.exception, at.exception
+
+
+def test_undo_load_restores_previous_document(monkeypatch, tmp_path):
+    at = start_app(monkeypatch, tmp_path)
+    open_from_library(at, "loaded", "loaded.json")
+    # The editor adds its empty raw-text row to the loaded document
+    assert [h.title for h in at.session_state["document"].heading_index] == ["", "Loaded"]
+
+    at.sidebar.button(key="btn_undo").click().run()
+    assert not at.exception, at.exception
+    assert_review_renders(at, ["Typed"])
+
+
+def test_undo_load_of_shared_copy(monkeypatch, tmp_path):
+    # The second session gets its copy from the shared cache: same uids,
+    # same (copy-on-write) tables as the first one's
+    first = start_app(monkeypatch, tmp_path)
+    open_from_library(first, "loaded", "loaded.json")
+    second = start_app(monkeypatch, tmp_path)
+    open_from_library(second, "loaded", "loaded.json")
+    [first_table] = first.session_state["document"].table_headings
+    [second_table] = second.session_state["document"].table_headings
+    assert second_table.uid == first_table.uid
+    assert second_table.table is first_table.table
+
+    second.sidebar.button(key="btn_undo").click().run()
+    assert not second.exception, second.exception
+    assert_review_renders(second, ["Typed"])
+    # Undoing in one session leaves the other's copy alone
+    assert_review_renders(first, ["", "Loaded"])